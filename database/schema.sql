@@ -19,6 +19,9 @@ CREATE TABLE starpower (
   FOREIGN KEY (brawler_id, brawler_version) REFERENCES brawler (brawler_id, brawler_version)
 );
 
+-- Supports joins and foreign key checks against brawler versions
+CREATE INDEX idx_starpower_brawler_id_brawler_version ON starpower (brawler_id, brawler_version);
+
 DROP TABLE IF EXISTS gadget;
 CREATE TABLE gadget (
   gadget_id INTEGER NOT NULL,
@@ -31,6 +34,8 @@ CREATE TABLE gadget (
   FOREIGN KEY (brawler_id, brawler_version) REFERENCES brawler (brawler_id, brawler_version)
 );
 
+CREATE INDEX idx_gadget_brawler_id_brawler_version ON gadget (brawler_id, brawler_version);
+
 DROP TABLE IF EXISTS gear;
 CREATE TABLE gear (
   gear_id INTEGER NOT NULL,
@@ -43,6 +48,40 @@ CREATE TABLE gear (
   FOREIGN KEY (brawler_id, brawler_version) REFERENCES brawler (brawler_id, brawler_version)
 );
 
+CREATE INDEX idx_gear_brawler_id_brawler_version ON gear (brawler_id, brawler_version);
+
+-- Latest version of each brawler, starpower and gadget, maintained by the
+-- loaders in the same transaction as the versioned tables above
+DROP TABLE IF EXISTS brawler_current;
+CREATE TABLE brawler_current (
+  brawler_id INTEGER NOT NULL,
+  brawler_version INTEGER NOT NULL,
+  brawler_name TEXT NOT NULL,
+  PRIMARY KEY (brawler_id)
+);
+
+DROP TABLE IF EXISTS starpower_current;
+CREATE TABLE starpower_current (
+  starpower_id INTEGER NOT NULL,
+  starpower_version INTEGER NOT NULL,
+  starpower_name TEXT NOT NULL,
+  brawler_id INTEGER NOT NULL,
+  brawler_version INTEGER NOT NULL,
+  brawler_name TEXT NOT NULL,
+  PRIMARY KEY (starpower_id)
+);
+
+DROP TABLE IF EXISTS gadget_current;
+CREATE TABLE gadget_current (
+  gadget_id INTEGER NOT NULL,
+  gadget_version INTEGER NOT NULL,
+  gadget_name TEXT NOT NULL,
+  brawler_id INTEGER NOT NULL,
+  brawler_version INTEGER NOT NULL,
+  brawler_name TEXT NOT NULL,
+  PRIMARY KEY (gadget_id)
+);
+
 DROP TABLE IF EXISTS player;
 CREATE TABLE player (
   player_id INTEGER NOT NULL,
@@ -64,6 +103,10 @@ PRIMARY KEY (player_exp_id),
 FOREIGN KEY (player_id) references player (player_id)
 );
 
+-- Rows are only written when a value changes, the value at any time
+-- is the last row at or before it
+CREATE INDEX idx_player_exp_player_id_created_at ON player_exp (player_id, created_at);
+
 DROP TABLE IF EXISTS player_trophies;
 CREATE TABLE player_trophies (
   player_trophies_id INTEGER NOT NULL,
@@ -75,6 +118,8 @@ CREATE TABLE player_trophies (
   FOREIGN KEY (player_id) references player (player_id)
 );
 
+CREATE INDEX idx_player_trophies_player_id_created_at ON player_trophies (player_id, created_at);
+
 DROP TABLE IF EXISTS player_victories;
 CREATE TABLE player_victories (
   player_victories_id INTEGER NOT NULL,
@@ -87,6 +132,31 @@ CREATE TABLE player_victories (
   FOREIGN KEY (player_id) references player (player_id)
 );
 
+CREATE INDEX idx_player_victories_player_id_created_at ON player_victories (player_id, created_at);
+
+DROP TABLE IF EXISTS player_stat_rollup;
+CREATE TABLE player_stat_rollup (
+  player_id INTEGER NOT NULL,
+  stat_name TEXT NOT NULL,
+  granularity TEXT NOT NULL,
+  bucket_start TEXT NOT NULL,
+  first_value INTEGER NOT NULL,
+  last_value INTEGER NOT NULL,
+  min_value INTEGER NOT NULL,
+  max_value INTEGER NOT NULL,
+  sample_count INTEGER NOT NULL,
+  PRIMARY KEY (player_id, stat_name, granularity, bucket_start),
+  FOREIGN KEY (player_id) references player (player_id)
+) WITHOUT ROWID;
+
+DROP TABLE IF EXISTS rollup_checkpoint;
+CREATE TABLE rollup_checkpoint (
+  source_table TEXT NOT NULL,
+  last_rolled_up_id INTEGER NOT NULL,
+  last_updated TEXT DEFAULT (datetime('now')),
+  PRIMARY KEY (source_table)
+);
+
 DROP TABLE IF EXISTS bs_event;
 CREATE TABLE bs_event (
   bs_event_id INTEGER NOT NULL,
@@ -97,6 +167,16 @@ CREATE TABLE bs_event (
   PRIMARY KEY (bs_event_id, bs_event_version)
 );
 
+-- Latest version of each event, maintained by the event loader
+DROP TABLE IF EXISTS bs_event_current;
+CREATE TABLE bs_event_current (
+  bs_event_id INTEGER NOT NULL,
+  bs_event_version INTEGER NOT NULL,
+  mode TEXT NOT NULL,
+  map TEXT NOT NULL,
+  PRIMARY KEY (bs_event_id)
+);
+
 
 DROP TABLE IF EXISTS process;
 CREATE TABLE process (
@@ -105,9 +185,39 @@ CREATE TABLE process (
   PRIMARY KEY (process_id)
 );
 
+CREATE UNIQUE INDEX idx_process_process_name ON process (process_name);
+
 INSERT INTO process (process_id, process_name) VALUES
 (1, 'Brawler ETL'),
-(2, 'Player ETL');
+(2, 'Player ETL'),
+(3, 'Battle Log ETL'),
+(4, 'Roster ETL'),
+(5, 'Event Rotation ETL');
+
+-- Players tracked by the roster ETL (etl/roster.py), removed players are
+-- kept inactive. next_poll_at is set from the player's battle rate
+-- (etl/polling.py), NULL until the player is first polled
+DROP TABLE IF EXISTS roster;
+CREATE TABLE roster (
+  player_tag VARCHAR(50) NOT NULL,
+  active INTEGER NOT NULL DEFAULT 1,
+  added_at TEXT DEFAULT (datetime('now')),
+  last_polled_at TEXT,
+  next_poll_at TEXT,
+  PRIMARY KEY (player_tag)
+);
+
+-- Bumped by every ETL in the transaction that writes its data, cached
+-- query results are only served for the current generation (etl/cache.py)
+DROP TABLE IF EXISTS data_generation;
+CREATE TABLE data_generation (
+  data_generation_id INTEGER NOT NULL CHECK (data_generation_id = 1),
+  generation INTEGER NOT NULL,
+  last_updated TEXT DEFAULT (datetime('now')),
+  PRIMARY KEY (data_generation_id)
+);
+
+INSERT INTO data_generation (data_generation_id, generation) VALUES (1, 0);
 
 DROP TABLE IF EXISTS process_log;
 CREATE TABLE process_log (
@@ -119,28 +229,144 @@ CREATE TABLE process_log (
   FOREIGN KEY (process_id) REFERENCES process (process_id)
 );
 
--- DROP TABLE IF EXISTS battle_type;
--- CREATE TABLE battle_type (
---   battle_type_id SMALLINT GENERATED ALWAYS AS IDENTITY,
---   battle_type_name TEXT NOT NULL,
---   created_at TIMESTAMPTZ DEFAULT NOW(),
---   PRIMARY KEY (battle_type_id)
--- ); 
-
--- DROP TABLE IF EXISTS battle;
--- CREATE TABLE battle (
---   battle_id INT TEXT NOT NULL,
---   player_tag VARCHAR(50) NOT NULL,
---   battle_time TIMESTAMPTZ,
---   bs_event_id INT NOT NULL,
---   battle_type_id SMALLINT NOT NULL,
---   result TEXT NOT NULL,
---   duration INTEGER NOT NULL,
---   trophy_change INTEGER, 
---   brawler_id INTEGER NOT NULL,
---   star_player boolean,
---   PRIMARY KEY (id),
---   FOREIGN KEY (bs_event_id) REFERENCES bs_event (bs_event_id),
---   FOREIGN KEY (player_id) references player (player_id)
--- );
+-- Supports the last run lookup (get_last_process_id_run in main.py)
+CREATE INDEX idx_process_log_process_id_process_status_last_updated
+ON process_log (process_id, process_status, last_updated);
+
+-- Timings and counts of each stage of every ETL run (etl/metrics.py), keyed by
+-- run id, process_stage 'run' holds the whole run
+DROP TABLE IF EXISTS etl_metric;
+CREATE TABLE etl_metric (
+  process_id INTEGER NOT NULL,
+  run_id TEXT NOT NULL,
+  run_started_at TEXT NOT NULL,
+  process_stage TEXT NOT NULL,
+  seconds REAL NOT NULL,
+  calls INTEGER NOT NULL,
+  records INTEGER NOT NULL,
+  bytes INTEGER NOT NULL,
+  api_calls INTEGER NOT NULL,
+  retries INTEGER NOT NULL,
+  rows_written INTEGER NOT NULL,
+  PRIMARY KEY (process_id, run_id, process_stage)
+);
+
+-- Event rotation timeline (etl/rotation.py), one row per slot and start,
+-- start and end times in unix seconds (UTC)
+DROP TABLE IF EXISTS event_slot;
+CREATE TABLE event_slot (
+  slot_id INTEGER NOT NULL,
+  start_time INTEGER NOT NULL,
+  end_time INTEGER NOT NULL,
+  bs_event_id INTEGER NOT NULL,
+  PRIMARY KEY (slot_id, start_time)
+) WITHOUT ROWID;
+
+CREATE INDEX idx_event_slot_end_time
+ON event_slot (end_time);
+
+-- Jobs claimed by worker processes (etl/job_queue.py), one per job type and key
+-- (e.g. a roster player). A leased job whose lease has expired is claimed again
+DROP TABLE IF EXISTS job_queue;
+CREATE TABLE job_queue (
+  job_id INTEGER PRIMARY KEY,
+  job_type TEXT NOT NULL,
+  job_key TEXT NOT NULL,
+  job_status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  worker_id TEXT,
+  lease_expires_at TEXT,
+  last_error TEXT,
+  last_updated TEXT DEFAULT (datetime('now')),
+  UNIQUE (job_type, job_key)
+);
+
+CREATE INDEX idx_job_queue_job_type_job_status_job_id
+ON job_queue (job_type, job_status, job_id);
+
+-- Last player committed by the current run of a batched process (etl/checkpoint.py),
+-- written with each batch and cleared when the run ends
+DROP TABLE IF EXISTS process_checkpoint;
+CREATE TABLE process_checkpoint (
+  process_id INTEGER NOT NULL,
+  process_stage TEXT NOT NULL,
+  last_player_tag TEXT NOT NULL,
+  last_updated TEXT DEFAULT (datetime('now')),
+  PRIMARY KEY (process_id, process_stage)
+);
+
+DROP TABLE IF EXISTS battle_type;
+CREATE TABLE battle_type (
+  battle_type_id INTEGER NOT NULL,
+  battle_type_name TEXT UNIQUE NOT NULL,
+  created_at TEXT DEFAULT (datetime('now')),
+  PRIMARY KEY (battle_type_id)
+);
+
+DROP TABLE IF EXISTS battle;
+CREATE TABLE battle (
+  battle_id INTEGER NOT NULL,
+  player_tag VARCHAR(50) NOT NULL,
+  battle_time TEXT NOT NULL,
+  bs_event_id INTEGER NOT NULL,
+  battle_type_id INTEGER,
+  result TEXT,
+  duration INTEGER,
+  trophy_change INTEGER,
+  brawler_id INTEGER NOT NULL,
+  star_player INTEGER,
+  brawler_trophies INTEGER,
+  created_at TEXT DEFAULT (datetime('now')),
+  PRIMARY KEY (battle_id),
+  FOREIGN KEY (battle_type_id) REFERENCES battle_type (battle_type_id)
+);
+
+-- Natural key, a battle is only stored once per player
+CREATE UNIQUE INDEX idx_battle_player_tag_battle_time ON battle (player_tag, battle_time DESC);
+CREATE INDEX idx_battle_brawler_id ON battle (brawler_id);
+CREATE INDEX idx_battle_bs_event_id ON battle (bs_event_id);
+
+-- Battle counters per brawler, maintained incrementally as battles are
+-- loaded (etl/stats.py), pick and win rates are derived from these
+DROP TABLE IF EXISTS brawler_stats;
+CREATE TABLE brawler_stats (
+  brawler_id INTEGER NOT NULL,
+  mode TEXT NOT NULL,
+  map TEXT NOT NULL,
+  trophy_bracket INTEGER NOT NULL,
+  day TEXT NOT NULL,
+  games INTEGER NOT NULL,
+  wins INTEGER NOT NULL,
+  losses INTEGER NOT NULL,
+  star_players INTEGER NOT NULL,
+  trophy_change_sum INTEGER NOT NULL,
+  PRIMARY KEY (mode, map, trophy_bracket, day, brawler_id)
+) WITHOUT ROWID;
+
+CREATE INDEX idx_brawler_stats_brawler_id_day ON brawler_stats (brawler_id, day);
+
+-- Brawler vs brawler wins and games per mode, stored as compressed NumPy
+-- matrices and updated incrementally as battles are loaded (etl/matchup.py)
+DROP TABLE IF EXISTS matchup_matrix;
+CREATE TABLE matchup_matrix (
+  mode TEXT NOT NULL,
+  wins BLOB NOT NULL,
+  games BLOB NOT NULL,
+  last_updated TEXT DEFAULT (datetime('now')),
+  PRIMARY KEY (mode)
+);
+
+-- Wins and games of each 3v3 team composition (sorted brawler triple
+-- encoded as an integer) per map, score is the lower bound of the win
+-- rate confidence interval (etl/composition.py)
+DROP TABLE IF EXISTS team_composition_stats;
+CREATE TABLE team_composition_stats (
+  map TEXT NOT NULL,
+  composition_key INTEGER NOT NULL,
+  wins INTEGER NOT NULL,
+  games INTEGER NOT NULL,
+  score REAL NOT NULL,
+  PRIMARY KEY (map, composition_key)
+) WITHOUT ROWID;
 
+CREATE INDEX idx_team_composition_stats_map_score ON team_composition_stats (map, score DESC);
@@ -0,0 +1,347 @@
+-- PostgreSQL schema for the tables written by the PostgreSQL storage backend
+-- (etl/backend.py). Mirrors database/schema.sql.
+
+DROP TABLE IF EXISTS team_composition_stats;
+DROP TABLE IF EXISTS matchup_matrix;
+DROP TABLE IF EXISTS brawler_stats;
+DROP TABLE IF EXISTS battle;
+DROP TABLE IF EXISTS battle_type;
+DROP TABLE IF EXISTS roster;
+DROP TABLE IF EXISTS data_generation;
+DROP TABLE IF EXISTS process_checkpoint;
+DROP TABLE IF EXISTS job_queue;
+DROP TABLE IF EXISTS event_slot;
+DROP TABLE IF EXISTS etl_metric;
+DROP TABLE IF EXISTS process_log;
+DROP TABLE IF EXISTS process;
+DROP TABLE IF EXISTS bs_event_current;
+DROP TABLE IF EXISTS bs_event;
+DROP TABLE IF EXISTS player_victories;
+DROP TABLE IF EXISTS player_trophies;
+DROP TABLE IF EXISTS player_exp;
+DROP TABLE IF EXISTS player;
+DROP TABLE IF EXISTS gadget_current;
+DROP TABLE IF EXISTS starpower_current;
+DROP TABLE IF EXISTS brawler_current;
+DROP TABLE IF EXISTS gear;
+DROP TABLE IF EXISTS gadget;
+DROP TABLE IF EXISTS starpower;
+DROP TABLE IF EXISTS brawler;
+
+CREATE TABLE brawler (
+  brawler_id INTEGER NOT NULL,
+  brawler_version INTEGER NOT NULL,
+  brawler_name TEXT NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (brawler_id, brawler_version)
+);
+
+CREATE TABLE starpower (
+  starpower_id INTEGER NOT NULL,
+  starpower_version INTEGER NOT NULL,
+  starpower_name TEXT NOT NULL,
+  brawler_id INTEGER NOT NULL,
+  brawler_version INTEGER NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (starpower_id, starpower_version),
+  FOREIGN KEY (brawler_id, brawler_version) REFERENCES brawler (brawler_id, brawler_version)
+);
+
+-- Supports joins and foreign key checks against brawler versions
+CREATE INDEX idx_starpower_brawler_id_brawler_version ON starpower (brawler_id, brawler_version);
+
+CREATE TABLE gadget (
+  gadget_id INTEGER NOT NULL,
+  gadget_version INTEGER NOT NULL,
+  gadget_name TEXT NOT NULL,
+  brawler_id INTEGER NOT NULL,
+  brawler_version INTEGER NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (gadget_id, gadget_version),
+  FOREIGN KEY (brawler_id, brawler_version) REFERENCES brawler (brawler_id, brawler_version)
+);
+
+CREATE INDEX idx_gadget_brawler_id_brawler_version ON gadget (brawler_id, brawler_version);
+
+CREATE TABLE gear (
+  gear_id INTEGER NOT NULL,
+  gear_version INTEGER NOT NULL,
+  gear_name TEXT NOT NULL,
+  brawler_id INTEGER NOT NULL,
+  brawler_version INTEGER NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (gear_id, gear_version),
+  FOREIGN KEY (brawler_id, brawler_version) REFERENCES brawler (brawler_id, brawler_version)
+);
+
+CREATE INDEX idx_gear_brawler_id_brawler_version ON gear (brawler_id, brawler_version);
+
+CREATE TABLE brawler_current (
+  brawler_id INTEGER NOT NULL,
+  brawler_version INTEGER NOT NULL,
+  brawler_name TEXT NOT NULL,
+  PRIMARY KEY (brawler_id)
+);
+
+CREATE TABLE starpower_current (
+  starpower_id INTEGER NOT NULL,
+  starpower_version INTEGER NOT NULL,
+  starpower_name TEXT NOT NULL,
+  brawler_id INTEGER NOT NULL,
+  brawler_version INTEGER NOT NULL,
+  brawler_name TEXT NOT NULL,
+  PRIMARY KEY (starpower_id)
+);
+
+CREATE TABLE gadget_current (
+  gadget_id INTEGER NOT NULL,
+  gadget_version INTEGER NOT NULL,
+  gadget_name TEXT NOT NULL,
+  brawler_id INTEGER NOT NULL,
+  brawler_version INTEGER NOT NULL,
+  brawler_name TEXT NOT NULL,
+  PRIMARY KEY (gadget_id)
+);
+
+CREATE TABLE player (
+  player_id INTEGER GENERATED ALWAYS AS IDENTITY,
+  player_tag VARCHAR(50) UNIQUE NOT NULL,
+  player_name TEXT NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  last_updated TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (player_id)
+);
+
+CREATE TABLE player_exp (
+  player_exp_id BIGINT GENERATED ALWAYS AS IDENTITY,
+  player_id INTEGER NOT NULL,
+  exp_level INTEGER NOT NULL,
+  exp_points INTEGER NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (player_exp_id),
+  FOREIGN KEY (player_id) REFERENCES player (player_id)
+);
+
+CREATE INDEX idx_player_exp_player_id_created_at ON player_exp (player_id, created_at);
+
+CREATE TABLE player_trophies (
+  player_trophies_id BIGINT GENERATED ALWAYS AS IDENTITY,
+  player_id INTEGER NOT NULL,
+  trophies INTEGER NOT NULL,
+  highest_trophies INTEGER NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (player_trophies_id),
+  FOREIGN KEY (player_id) REFERENCES player (player_id)
+);
+
+CREATE INDEX idx_player_trophies_player_id_created_at ON player_trophies (player_id, created_at);
+
+CREATE TABLE player_victories (
+  player_victories_id BIGINT GENERATED ALWAYS AS IDENTITY,
+  player_id INTEGER NOT NULL,
+  _3vs3_victories INTEGER,
+  solo_victories INTEGER,
+  duo_victories INTEGER,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (player_victories_id),
+  FOREIGN KEY (player_id) REFERENCES player (player_id)
+);
+
+CREATE INDEX idx_player_victories_player_id_created_at ON player_victories (player_id, created_at);
+
+CREATE TABLE bs_event (
+  bs_event_id INTEGER NOT NULL,
+  bs_event_version INTEGER NOT NULL,
+  mode TEXT NOT NULL,
+  map TEXT NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (bs_event_id, bs_event_version)
+);
+
+CREATE TABLE bs_event_current (
+  bs_event_id INTEGER NOT NULL,
+  bs_event_version INTEGER NOT NULL,
+  mode TEXT NOT NULL,
+  map TEXT NOT NULL,
+  PRIMARY KEY (bs_event_id)
+);
+
+CREATE TABLE process (
+  process_id SMALLINT NOT NULL,
+  process_name TEXT NOT NULL,
+  PRIMARY KEY (process_id)
+);
+
+CREATE UNIQUE INDEX idx_process_process_name ON process (process_name);
+
+INSERT INTO process (process_id, process_name) VALUES
+(1, 'Brawler ETL'),
+(2, 'Player ETL'),
+(3, 'Battle Log ETL'),
+(4, 'Roster ETL'),
+(5, 'Event Rotation ETL');
+
+-- Players tracked by the roster ETL (etl/roster.py), removed players are
+-- kept inactive. next_poll_at is set from the player's battle rate
+-- (etl/polling.py), NULL until the player is first polled
+CREATE TABLE roster (
+  player_tag VARCHAR(50) NOT NULL,
+  active BOOLEAN NOT NULL DEFAULT TRUE,
+  added_at TIMESTAMPTZ DEFAULT NOW(),
+  last_polled_at TEXT,
+  next_poll_at TEXT,
+  PRIMARY KEY (player_tag)
+);
+
+-- Bumped by every ETL in the transaction that writes its data, cached
+-- query results are only served for the current generation (etl/cache.py)
+CREATE TABLE data_generation (
+  data_generation_id SMALLINT NOT NULL CHECK (data_generation_id = 1),
+  generation BIGINT NOT NULL,
+  last_updated TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (data_generation_id)
+);
+
+INSERT INTO data_generation (data_generation_id, generation) VALUES (1, 0);
+
+CREATE TABLE process_log (
+  process_log_id BIGINT GENERATED ALWAYS AS IDENTITY,
+  process_id SMALLINT NOT NULL,
+  process_status TEXT NOT NULL,
+  last_updated TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (process_log_id),
+  FOREIGN KEY (process_id) REFERENCES process (process_id)
+);
+
+-- Supports the last run lookup (get_last_process_id_run in main.py)
+CREATE INDEX idx_process_log_process_id_process_status_last_updated
+ON process_log (process_id, process_status, last_updated);
+
+-- Timings and counts of each stage of every ETL run (etl/metrics.py), keyed by
+-- run id, process_stage 'run' holds the whole run
+CREATE TABLE etl_metric (
+  process_id SMALLINT NOT NULL,
+  run_id TEXT NOT NULL,
+  run_started_at TEXT NOT NULL,
+  process_stage TEXT NOT NULL,
+  seconds DOUBLE PRECISION NOT NULL,
+  calls INTEGER NOT NULL,
+  records INTEGER NOT NULL,
+  bytes BIGINT NOT NULL,
+  api_calls INTEGER NOT NULL,
+  retries INTEGER NOT NULL,
+  rows_written BIGINT NOT NULL,
+  PRIMARY KEY (process_id, run_id, process_stage)
+);
+
+-- Event rotation timeline (etl/rotation.py), one row per slot and start,
+-- start and end times in unix seconds (UTC)
+CREATE TABLE event_slot (
+  slot_id SMALLINT NOT NULL,
+  start_time BIGINT NOT NULL,
+  end_time BIGINT NOT NULL,
+  bs_event_id INTEGER NOT NULL,
+  PRIMARY KEY (slot_id, start_time)
+);
+
+CREATE INDEX idx_event_slot_end_time
+ON event_slot (end_time);
+
+-- Jobs claimed by worker processes (etl/job_queue.py), one per job type and key
+-- (e.g. a roster player). A leased job whose lease has expired is claimed again
+CREATE TABLE job_queue (
+  job_id BIGINT GENERATED ALWAYS AS IDENTITY,
+  job_type TEXT NOT NULL,
+  job_key TEXT NOT NULL,
+  job_status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  worker_id TEXT,
+  lease_expires_at TEXT,
+  last_error TEXT,
+  last_updated TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (job_id),
+  UNIQUE (job_type, job_key)
+);
+
+CREATE INDEX idx_job_queue_job_type_job_status_job_id
+ON job_queue (job_type, job_status, job_id);
+
+-- Last player committed by the current run of a batched process (etl/checkpoint.py),
+-- written with each batch and cleared when the run ends
+CREATE TABLE process_checkpoint (
+  process_id SMALLINT NOT NULL,
+  process_stage TEXT NOT NULL,
+  last_player_tag TEXT NOT NULL,
+  last_updated TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (process_id, process_stage)
+);
+
+CREATE TABLE battle_type (
+  battle_type_id SMALLINT GENERATED ALWAYS AS IDENTITY,
+  battle_type_name TEXT UNIQUE NOT NULL,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (battle_type_id)
+);
+
+CREATE TABLE battle (
+  battle_id BIGINT GENERATED ALWAYS AS IDENTITY,
+  player_tag VARCHAR(50) NOT NULL,
+  battle_time TIMESTAMP NOT NULL,
+  bs_event_id INTEGER NOT NULL,
+  battle_type_id SMALLINT,
+  result TEXT,
+  duration INTEGER,
+  trophy_change INTEGER,
+  brawler_id INTEGER NOT NULL,
+  star_player BOOLEAN,
+  brawler_trophies INTEGER,
+  created_at TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (battle_id),
+  FOREIGN KEY (battle_type_id) REFERENCES battle_type (battle_type_id)
+);
+
+CREATE UNIQUE INDEX idx_battle_player_tag_battle_time ON battle (player_tag, battle_time DESC);
+CREATE INDEX idx_battle_brawler_id ON battle (brawler_id);
+CREATE INDEX idx_battle_bs_event_id ON battle (bs_event_id);
+
+-- Battle counters per brawler, maintained incrementally as battles are
+-- loaded (etl/stats.py), pick and win rates are derived from these
+CREATE TABLE brawler_stats (
+  brawler_id INTEGER NOT NULL,
+  mode TEXT NOT NULL,
+  map TEXT NOT NULL,
+  trophy_bracket INTEGER NOT NULL,
+  day DATE NOT NULL,
+  games INTEGER NOT NULL,
+  wins INTEGER NOT NULL,
+  losses INTEGER NOT NULL,
+  star_players INTEGER NOT NULL,
+  trophy_change_sum INTEGER NOT NULL,
+  PRIMARY KEY (mode, map, trophy_bracket, day, brawler_id)
+);
+
+CREATE INDEX idx_brawler_stats_brawler_id_day ON brawler_stats (brawler_id, day);
+
+-- Brawler vs brawler wins and games per mode, stored as compressed NumPy
+-- matrices and updated incrementally as battles are loaded (etl/matchup.py)
+CREATE TABLE matchup_matrix (
+  mode TEXT NOT NULL,
+  wins BYTEA NOT NULL,
+  games BYTEA NOT NULL,
+  last_updated TIMESTAMPTZ DEFAULT NOW(),
+  PRIMARY KEY (mode)
+);
+
+-- Wins and games of each 3v3 team composition (sorted brawler triple
+-- encoded as an integer) per map, score is the lower bound of the win
+-- rate confidence interval (etl/composition.py)
+CREATE TABLE team_composition_stats (
+  map TEXT NOT NULL,
+  composition_key INTEGER NOT NULL,
+  wins INTEGER NOT NULL,
+  games INTEGER NOT NULL,
+  score DOUBLE PRECISION NOT NULL,
+  PRIMARY KEY (map, composition_key)
+);
+
+CREATE INDEX idx_team_composition_stats_map_score ON team_composition_stats (map, score DESC);
@@ -0,0 +1,606 @@
+"""Storage backends for the ETL loads and large reads (SQLite and PostgreSQL)
+
+The ETLs load battles (with the brawler_stats, matchup_matrix and
+team_composition_stats aggregates), player snapshots and catalogue versions
+through the backend returned by get_load_backend. SQLite (dbpath) is always
+the ETL's working database (process log, roster, checkpoints and the state
+changes are generated from), with db_backend=postgres every load is also
+written to PostgreSQL, committed just before the SQLite transaction. A load
+that fails after the PostgreSQL commit is written again by the next run,
+battles and catalogue versions already stored are skipped.
+
+Each backend runs SQL in its own placeholder style, ? for SQLite and %s for
+PostgreSQL."""
+
+import csv
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from io import StringIO
+from sqlite3 import DatabaseError
+from uuid import uuid4
+
+import psycopg2
+from psycopg2.extras import execute_batch, execute_values
+from pandas import DataFrame
+
+from db import ConnectionManager
+from stats import (get_new_battles, update_brawler_stats, aggregate_battle_stats,
+                   get_wilson_interval, STATS_KEY_COLUMNS, STATS_COUNTER_COLUMNS)
+from matchup import update_matchup_matrices, MatchupMatrix, array_to_blob, blob_to_array
+from composition import update_team_compositions, aggregate_compositions
+from load import (dataframe_to_rows, get_catalogue_version_rows, insert_brawler_db,
+                  insert_new_starpower_data, insert_new_gadget_data, insert_new_event_data,
+                  insert_player_snapshot_changes, insert_battle_log_db,
+                  CURRENT_VERSION_UPSERTS)
+from transform import PLAYER_SNAPSHOT_TABLES
+
+DEFAULT_READ_BATCH_SIZE = 10_000
+
+COPY_NULL = r"\N"
+
+BATTLE_COLUMNS = ["player_tag", "battle_time", "bs_event_id", "battle_type_id", "result",
+                  "duration", "trophy_change", "brawler_id", "star_player",
+                  "brawler_trophies"]
+
+SNAPSHOT_COLUMNS = {"player_exp": ["player_id", "exp_level", "exp_points"],
+                    "player_trophies": ["player_id", "trophies", "highest_trophies"],
+                    "player_victories": ["player_id", "_3vs3_victories", "solo_victories",
+                                         "duo_victories"]}
+
+CATALOGUE_COLUMNS = {"brawler": ["brawler_id", "brawler_version", "brawler_name"],
+                     "starpower": ["starpower_id", "starpower_version", "starpower_name",
+                                   "brawler_id", "brawler_version"],
+                     "gadget": ["gadget_id", "gadget_version", "gadget_name",
+                                "brawler_id", "brawler_version"],
+                     "bs_event": ["bs_event_id", "bs_event_version", "mode", "map"]}
+
+# SQLite loaders of each catalogue's changes (see load.get_catalogue_version_rows)
+CATALOGUE_LOADERS = {"brawler": insert_brawler_db,
+                     "starpower": insert_new_starpower_data,
+                     "gadget": insert_new_gadget_data,
+                     "bs_event": insert_new_event_data}
+
+# Upserts keeping the PostgreSQL <table>_current tables on the latest version
+# (load.CURRENT_VERSION_UPSERTS are the SQLite ones)
+POSTGRES_CURRENT_VERSION_UPSERTS = {
+    "brawler": """INSERT INTO brawler_current
+               (brawler_id, brawler_version, brawler_name)
+               VALUES (%s, %s, %s)
+               ON CONFLICT (brawler_id) DO UPDATE SET
+               brawler_version = excluded.brawler_version,
+               brawler_name = excluded.brawler_name
+               WHERE excluded.brawler_version > brawler_current.brawler_version;""",
+    "starpower": """INSERT INTO starpower_current
+                 (starpower_id, starpower_version, starpower_name,
+                 brawler_id, brawler_version, brawler_name)
+                 SELECT %s, %s, %s, brawler_id, brawler_version, brawler_name
+                 FROM brawler
+                 WHERE brawler_id = %s AND brawler_version = %s
+                 ON CONFLICT (starpower_id) DO UPDATE SET
+                 starpower_version = excluded.starpower_version,
+                 starpower_name = excluded.starpower_name,
+                 brawler_id = excluded.brawler_id,
+                 brawler_version = excluded.brawler_version,
+                 brawler_name = excluded.brawler_name
+                 WHERE excluded.starpower_version > starpower_current.starpower_version;""",
+    "gadget": """INSERT INTO gadget_current
+              (gadget_id, gadget_version, gadget_name,
+              brawler_id, brawler_version, brawler_name)
+              SELECT %s, %s, %s, brawler_id, brawler_version, brawler_name
+              FROM brawler
+              WHERE brawler_id = %s AND brawler_version = %s
+              ON CONFLICT (gadget_id) DO UPDATE SET
+              gadget_version = excluded.gadget_version,
+              gadget_name = excluded.gadget_name,
+              brawler_id = excluded.brawler_id,
+              brawler_version = excluded.brawler_version,
+              brawler_name = excluded.brawler_name
+              WHERE excluded.gadget_version > gadget_current.gadget_version;""",
+    "bs_event": """INSERT INTO bs_event_current
+                (bs_event_id, bs_event_version, mode, map)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (bs_event_id) DO UPDATE SET
+                bs_event_version = excluded.bs_event_version,
+                mode = excluded.mode,
+                map = excluded.map
+                WHERE excluded.bs_event_version > bs_event_current.bs_event_version;"""}
+
+POSTGRES_BRAWLER_STATS_UPSERT = """INSERT INTO brawler_stats
+    (brawler_id, mode, map, trophy_bracket, day,
+    games, wins, losses, star_players, trophy_change_sum)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON CONFLICT (mode, map, trophy_bracket, day, brawler_id) DO UPDATE SET
+      games = brawler_stats.games + excluded.games,
+      wins = brawler_stats.wins + excluded.wins,
+      losses = brawler_stats.losses + excluded.losses,
+      star_players = brawler_stats.star_players + excluded.star_players,
+      trophy_change_sum = brawler_stats.trophy_change_sum + excluded.trophy_change_sum;"""
+
+
+class StorageBackend(ABC):
+    """Loading and batched reading on top of a database.
+
+    Backends implement transaction, bulk_insert, upsert_current_versions,
+    iter_query, close and the ETL loads (load_battles, load_player_snapshots
+    and load_catalogue_changes), which run on a connection of the backend
+    inside the caller's transaction"""
+
+    @abstractmethod
+    def transaction(self):
+        """Context manager yielding a connection inside one transaction"""
+
+    @abstractmethod
+    def bulk_insert(self, db_conn, table: str, columns: list[str], rows: list[tuple],
+                    conflict_columns: list[str] = None) -> None:
+        """Inserts rows, skipping rows that conflict on conflict_columns"""
+
+    @abstractmethod
+    def upsert_current_versions(self, db_conn, table: str, rows: list[tuple]) -> None:
+        """Updates a <table>_current table with newly loaded catalogue versions"""
+
+    @abstractmethod
+    def iter_query(self, sql: str, parameters=(), batch_size: int = DEFAULT_READ_BATCH_SIZE):
+        """Yields the rows of a read query (in the backend's placeholder style)
+        in batches of batch_size"""
+
+    @abstractmethod
+    def load_battles(self, db_conn, battle_log_data: DataFrame) -> DataFrame:
+        """Loads a transformed battle log (see transform_battle_log_api),
+        skipping battles already stored, and counts the new battles into
+        brawler_stats, matchup_matrix and team_composition_stats.
+        Returns the new battles"""
+
+    @abstractmethod
+    def load_player_snapshots(self, db_conn, player_id: int, player_data: dict,
+                              tables: list[str]) -> None:
+        """Loads a transformed player's player_exp, player_trophies or
+        player_victories rows (the player must already be stored)"""
+
+    @abstractmethod
+    def close(self) -> None:
+        """Closes the backend's connections"""
+
+    def read_query(self, sql: str, parameters=()) -> list[tuple]:
+        """Returns every row of a (small) read query"""
+
+        return [row for batch in self.iter_query(sql, parameters) for row in batch]
+
+    def load_catalogue_changes(self, db_conn, table: str, changes_data: DataFrame) -> None:
+        """Loads brawler, starpower, gadget or bs_event changes (see
+        load.get_catalogue_version_rows) as new versions, skipping versions
+        already stored, and updates the current table"""
+
+        if table not in CATALOGUE_COLUMNS:
+            raise ValueError(f"Error: {table} is not a catalogue table!")
+        if changes_data.empty:
+            return
+
+        columns = CATALOGUE_COLUMNS[table]
+        catalogue_rows = get_catalogue_version_rows(table, changes_data)
+
+        self.bulk_insert(db_conn, table, columns, catalogue_rows,
+                         conflict_columns=columns[:2])
+        self.upsert_current_versions(db_conn, table, catalogue_rows)
+
+
+class SQLiteBackend(StorageBackend):
+    """SQLite backend using executemany on the ConnectionManager's writer
+    (the ETL loads run on the connection they are given)"""
+
+    def __init__(self, config_env, db_manager: ConnectionManager = None):
+        self.db_manager = db_manager or ConnectionManager(config_env)
+
+    @contextmanager
+    def transaction(self):
+        with self.db_manager.transaction() as db_conn:
+            yield db_conn
+
+    def bulk_insert(self, db_conn, table: str, columns: list[str], rows: list[tuple],
+                    conflict_columns: list[str] = None) -> None:
+        on_conflict = (f" ON CONFLICT ({', '.join(conflict_columns)}) DO NOTHING"
+                       if conflict_columns else "")
+
+        cur = db_conn.cursor()
+        try:
+            cur.executemany(f"""INSERT INTO {table}
+                            ({', '.join(columns)})
+                            VALUES ({', '.join('?' * len(columns))}){on_conflict};""", rows)
+
+        except Exception as exc:
+            raise DatabaseError(f"Error: Unable to insert {table} data!") from exc
+
+        finally:
+            cur.close()
+
+    def upsert_current_versions(self, db_conn, table: str, rows: list[tuple]) -> None:
+        db_conn.executemany(CURRENT_VERSION_UPSERTS[table], rows)
+
+    def iter_query(self, sql: str, parameters=(), batch_size: int = DEFAULT_READ_BATCH_SIZE):
+        with self.db_manager.reader() as db_conn:
+            cur = db_conn.cursor()
+
+            try:
+                cur.execute(sql, parameters)
+                while batch := cur.fetchmany(batch_size):
+                    yield batch
+
+            finally:
+                cur.close()
+
+    def load_battles(self, db_conn, battle_log_data: DataFrame) -> DataFrame:
+        new_battle_log_data = get_new_battles(db_conn, battle_log_data)
+        insert_battle_log_db(db_conn, new_battle_log_data)
+        update_brawler_stats(db_conn, new_battle_log_data)
+        update_matchup_matrices(db_conn, new_battle_log_data)
+        update_team_compositions(db_conn, new_battle_log_data)
+
+        return new_battle_log_data
+
+    def load_player_snapshots(self, db_conn, player_id: int, player_data: dict,
+                              tables: list[str]) -> None:
+        insert_player_snapshot_changes(db_conn, player_id, player_data, tables)
+
+    def load_catalogue_changes(self, db_conn, table: str, changes_data: DataFrame) -> None:
+        if table not in CATALOGUE_LOADERS:
+            raise ValueError(f"Error: {table} is not a catalogue table!")
+
+        CATALOGUE_LOADERS[table](db_conn, changes_data)
+
+    def close(self) -> None:
+        self.db_manager.close()
+
+
+class PostgresBackend(StorageBackend):
+    """PostgreSQL backend. Bulk loads are streamed with COPY FROM STDIN
+    (through a temporary staging table when conflicts must be skipped) and
+    large reads use server side cursors so results are not held in memory.
+    Players are matched by player tag, player IDs are not shared with SQLite"""
+
+    def __init__(self, config_env, db_conn=None):
+        self.config_env = config_env
+        self.db_conn = db_conn or get_postgres_connection(config_env)
+        self.in_transaction = False
+
+    @contextmanager
+    def transaction(self):
+        self.in_transaction = True
+
+        try:
+            yield self.db_conn
+
+        except Exception:
+            self.db_conn.rollback()
+            raise
+
+        finally:
+            self.in_transaction = False
+
+        self.db_conn.commit()
+
+    def bulk_insert(self, db_conn, table: str, columns: list[str], rows: list[tuple],
+                    conflict_columns: list[str] = None) -> None:
+        if not rows:
+            return
+
+        column_list = ", ".join(columns)
+
+        try:
+            with db_conn.cursor() as cur:
+                if not conflict_columns:
+                    copy_rows(cur, table, column_list, rows)
+                    return
+
+                staging_table = stage_rows(cur, table, column_list, rows)
+                cur.execute(f"""INSERT INTO {table} ({column_list})
+                            SELECT {column_list} FROM {staging_table}
+                            ON CONFLICT ({', '.join(conflict_columns)}) DO NOTHING;
+                            TRUNCATE {staging_table};""")
+
+        except Exception as exc:
+            raise DatabaseError(f"Error: Unable to insert {table} data!") from exc
+
+    def upsert_current_versions(self, db_conn, table: str, rows: list[tuple]) -> None:
+        with db_conn.cursor() as cur:
+            execute_batch(cur, POSTGRES_CURRENT_VERSION_UPSERTS[table], rows)
+
+    def iter_query(self, sql: str, parameters=(), batch_size: int = DEFAULT_READ_BATCH_SIZE):
+        # The read is committed once exhausted (unless it is part of a transaction)
+        # so the connection is not left idle in transaction
+        try:
+            with self.db_conn.cursor(name=f"etl_read_{uuid4().hex}") as cur:
+                cur.itersize = batch_size
+                cur.execute(sql, parameters)
+                while batch := cur.fetchmany(batch_size):
+                    yield batch
+
+        finally:
+            if not self.in_transaction:
+                self.db_conn.commit()
+
+    def load_battles(self, db_conn, battle_log_data: DataFrame) -> DataFrame:
+        if battle_log_data.empty:
+            return battle_log_data
+
+        self.bulk_insert(db_conn, "battle_type", ["battle_type_name"],
+                         [(battle_type,) for battle_type in
+                          battle_log_data["battle_type"].dropna().unique()],
+                         conflict_columns=["battle_type_name"])
+
+        try:
+            with db_conn.cursor() as cur:
+                cur.execute("SELECT battle_type_id, battle_type_name FROM battle_type;")
+                battle_type_ids = dict((name, battle_type_id)
+                                       for battle_type_id, name in cur.fetchall())
+
+                battle_data = battle_log_data.assign(
+                    battle_type_id=battle_log_data["battle_type"].map(
+                        battle_type_ids).astype("Int64"),
+                    star_player=battle_log_data["star_player"].astype("boolean")
+                ).rename(columns={"event_id": "bs_event_id",
+                                  "brawler_played_id": "brawler_id"})
+                column_list = ", ".join(BATTLE_COLUMNS)
+
+                staging_table = stage_rows(cur, "battle", column_list,
+                                           dataframe_to_rows(battle_data, BATTLE_COLUMNS))
+                cur.execute(f"""INSERT INTO battle ({column_list})
+                            SELECT {column_list} FROM {staging_table}
+                            ON CONFLICT (player_tag, battle_time) DO NOTHING
+                            RETURNING player_tag,
+                              to_char(battle_time, 'YYYY-MM-DD HH24:MI:SS');""")
+                new_battles = set(cur.fetchall())
+                cur.execute(f"TRUNCATE {staging_table};")
+
+        except Exception as exc:
+            raise DatabaseError("Error: Unable to insert battle log data!") from exc
+
+        new_battle_log_data = battle_log_data.drop_duplicates(["player_tag", "battle_time"])
+        new_battle_log_data = new_battle_log_data[[
+            battle_key in new_battles for battle_key in
+            zip(new_battle_log_data["player_tag"], new_battle_log_data["battle_time"])]]
+
+        self.update_brawler_stats(db_conn, new_battle_log_data)
+        self.update_matchup_matrices(db_conn, new_battle_log_data)
+        self.update_team_compositions(db_conn, new_battle_log_data)
+
+        return new_battle_log_data
+
+    def update_brawler_stats(self, db_conn, new_battle_data: DataFrame) -> None:
+        """Adds new battles to brawler_stats (see stats.update_brawler_stats)"""
+
+        stats_data = aggregate_battle_stats(new_battle_data)
+
+        if stats_data.empty:
+            return
+
+        try:
+            with db_conn.cursor() as cur:
+                execute_batch(cur, POSTGRES_BRAWLER_STATS_UPSERT,
+                              dataframe_to_rows(stats_data,
+                                                STATS_KEY_COLUMNS + STATS_COUNTER_COLUMNS))
+
+        except Exception as exc:
+            raise DatabaseError("Error: Unable to insert brawler stats data!") from exc
+
+    def update_matchup_matrices(self, db_conn, new_battle_data: DataFrame) -> None:
+        """Adds new battles to the matchup matrix of each mode, locking each
+        stored matrix while it is updated (see matchup.update_matchup_matrices)"""
+
+        if new_battle_data.empty:
+            return
+
+        empty_blob = array_to_blob(MatchupMatrix("").games)
+
+        try:
+            with db_conn.cursor() as cur:
+                for mode in new_battle_data["event_mode"].dropna().unique():
+                    cur.execute("""INSERT INTO matchup_matrix (mode, wins, games)
+                                VALUES (%s, %s, %s)
+                                ON CONFLICT (mode) DO NOTHING;""",
+                                [mode, psycopg2.Binary(empty_blob),
+                                 psycopg2.Binary(empty_blob)])
+                    cur.execute("""SELECT wins, games
+                                FROM matchup_matrix
+                                WHERE mode = %s
+                                FOR UPDATE;""", [mode])
+                    wins, games = cur.fetchone()
+
+                    matchup_matrix = MatchupMatrix(mode)
+                    matchup_matrix.wins = blob_to_array(bytes(wins))
+                    matchup_matrix.games = blob_to_array(bytes(games))
+
+                    if matchup_matrix.add_battles(new_battle_data):
+                        cur.execute("""UPDATE matchup_matrix
+                                    SET wins = %s, games = %s, last_updated = NOW()
+                                    WHERE mode = %s;""",
+                                    [psycopg2.Binary(array_to_blob(matchup_matrix.wins)),
+                                     psycopg2.Binary(array_to_blob(matchup_matrix.games)),
+                                     mode])
+
+        except Exception as exc:
+            raise DatabaseError("Error: Unable to insert matchup data!") from exc
+
+    def update_team_compositions(self, db_conn, new_battle_data: DataFrame) -> None:
+        """Adds new battles to team_composition_stats and updates the score of
+        every composition changed (see composition.update_team_compositions)"""
+
+        if new_battle_data.empty:
+            return
+
+        composition_data = aggregate_compositions(new_battle_data)
+
+        if composition_data.empty:
+            return
+
+        try:
+            with db_conn.cursor() as cur:
+                updated_rows = execute_values(
+                    cur, """INSERT INTO team_composition_stats
+                         (map, composition_key, wins, games, score)
+                         VALUES %s
+                         ON CONFLICT (map, composition_key) DO UPDATE SET
+                           wins = team_composition_stats.wins + excluded.wins,
+                           games = team_composition_stats.games + excluded.games
+                         RETURNING map, composition_key, wins, games;""",
+                    dataframe_to_rows(composition_data.assign(score=0),
+                                      ["map", "composition_key", "wins", "games", "score"]),
+                    fetch=True)
+
+                updated_data = DataFrame(updated_rows, columns=["map", "composition_key",
+                                                                "wins", "games"])
+                updated_data["score"], _ = get_wilson_interval(updated_data["wins"],
+                                                               updated_data["games"])
+                execute_batch(cur, """UPDATE team_composition_stats
+                              SET score = %s
+                              WHERE map = %s AND composition_key = %s;""",
+                              dataframe_to_rows(updated_data,
+                                                ["score", "map", "composition_key"]))
+
+        except Exception as exc:
+            raise DatabaseError("Error: Unable to insert team composition data!") from exc
+
+    def load_player_snapshots(self, db_conn, player_id: int, player_data: dict,
+                              tables: list[str]) -> None:
+        try:
+            with db_conn.cursor() as cur:
+                cur.execute("""INSERT INTO player (player_tag, player_name)
+                            VALUES (%s, %s)
+                            ON CONFLICT (player_tag) DO NOTHING;""",
+                            [player_data["tag"], player_data["name"]])
+
+                for table in tables:
+                    values = [player_data[column] for column in PLAYER_SNAPSHOT_TABLES[table]]
+                    cur.execute(f"""INSERT INTO {table}
+                                ({', '.join(SNAPSHOT_COLUMNS[table])})
+                                SELECT player_id{', %s' * len(values)}
+                                FROM player
+                                WHERE player_tag = %s;""", values + [player_data["tag"]])
+
+        except Exception as exc:
+            raise DatabaseError("Error: Unable to insert player data!") from exc
+
+    def close(self) -> None:
+        self.db_conn.close()
+
+
+class MirroredBackend(StorageBackend):
+    """Loads into a primary backend on the caller's connection and into a
+    mirror backend in the mirror's own transaction, committed before the
+    caller's transaction. Reads are from the primary"""
+
+    def __init__(self, primary: StorageBackend, mirror: StorageBackend):
+        self.primary = primary
+        self.mirror = mirror
+
+    def transaction(self):
+        return self.primary.transaction()
+
+    def bulk_insert(self, db_conn, table: str, columns: list[str], rows: list[tuple],
+                    conflict_columns: list[str] = None) -> None:
+        self.primary.bulk_insert(db_conn, table, columns, rows, conflict_columns)
+        with self.mirror.transaction() as mirror_conn:
+            self.mirror.bulk_insert(mirror_conn, table, columns, rows, conflict_columns)
+
+    def upsert_current_versions(self, db_conn, table: str, rows: list[tuple]) -> None:
+        self.primary.upsert_current_versions(db_conn, table, rows)
+        with self.mirror.transaction() as mirror_conn:
+            self.mirror.upsert_current_versions(mirror_conn, table, rows)
+
+    def iter_query(self, sql: str, parameters=(), batch_size: int = DEFAULT_READ_BATCH_SIZE):
+        return self.primary.iter_query(sql, parameters, batch_size)
+
+    def load_battles(self, db_conn, battle_log_data: DataFrame) -> DataFrame:
+        new_battle_log_data = self.primary.load_battles(db_conn, battle_log_data)
+        with self.mirror.transaction() as mirror_conn:
+            self.mirror.load_battles(mirror_conn, battle_log_data)
+
+        return new_battle_log_data
+
+    def load_player_snapshots(self, db_conn, player_id: int, player_data: dict,
+                              tables: list[str]) -> None:
+        self.primary.load_player_snapshots(db_conn, player_id, player_data, tables)
+        with self.mirror.transaction() as mirror_conn:
+            self.mirror.load_player_snapshots(mirror_conn, player_id, player_data, tables)
+
+    def load_catalogue_changes(self, db_conn, table: str, changes_data: DataFrame) -> None:
+        self.primary.load_catalogue_changes(db_conn, table, changes_data)
+        with self.mirror.transaction() as mirror_conn:
+            self.mirror.load_catalogue_changes(mirror_conn, table, changes_data)
+
+    def close(self) -> None:
+        self.primary.close()
+        self.mirror.close()
+
+
+def get_postgres_connection(config_env):
+    """Establishes connection with the PostgreSQL database
+    (pg_dsn, or the db_name/user/password/host/port .env values)"""
+
+    try:
+        if config_env.get("pg_dsn"):
+            return psycopg2.connect(config_env["pg_dsn"])
+
+        return psycopg2.connect(dbname=config_env["db_name"], user=config_env["user"],
+                                password=config_env["password"], host=config_env["host"],
+                                port=config_env["port"])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Cannot establish connection to database!") from exc
+
+
+def rows_to_csv(rows: list[tuple]) -> StringIO:
+    """Returns rows as a CSV buffer for COPY (None is written as \\N)"""
+
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    for row in rows:
+        writer.writerow([COPY_NULL if value is None else value for value in row])
+
+    buffer.seek(0)
+    return buffer
+
+
+def copy_rows(cur, table: str, column_list: str, rows: list[tuple]) -> None:
+    """Streams rows into a table with COPY FROM STDIN"""
+
+    cur.copy_expert(f"""COPY {table} ({column_list})
+                    FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}');""", rows_to_csv(rows))
+
+
+def stage_rows(cur, table: str, column_list: str, rows: list[tuple]) -> str:
+    """Streams rows into a temporary staging table shaped like table
+    (dropped on commit, truncated by the caller once inserted).
+    Returns the staging table name"""
+
+    staging_table = f"staging_{table}"
+    cur.execute(f"""CREATE TEMPORARY TABLE IF NOT EXISTS {staging_table}
+                ON COMMIT DROP AS
+                SELECT {column_list} FROM {table} WITH NO DATA;""")
+    copy_rows(cur, staging_table, column_list, rows)
+
+    return staging_table
+
+
+def get_storage_backend(config_env) -> StorageBackend:
+    """Returns the storage backend set by db_backend (sqlite or postgres)"""
+
+    backend = config_env.get("db_backend", "sqlite")
+
+    if backend == "sqlite":
+        return SQLiteBackend(config_env)
+    if backend == "postgres":
+        return PostgresBackend(config_env)
+
+    raise ValueError(f"Error: Unknown storage backend '{backend}'!")
+
+
+def get_load_backend(config_env) -> StorageBackend:
+    """Returns the backend the ETLs load through: SQLite (dbpath), mirrored
+    to PostgreSQL when db_backend is postgres"""
+
+    storage = get_storage_backend(config_env)
+
+    if isinstance(storage, PostgresBackend):
+        return MirroredBackend(SQLiteBackend(config_env), storage)
+
+    return storage
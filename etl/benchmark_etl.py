@@ -0,0 +1,370 @@
+"""Benchmark suite for the ETL hot paths
+
+Runs the catalogue change detection (generate_*_changes), the API
+transforms (brawl_api_data_to_df, transform_battle_log_api) and the
+loaders (insert_*) on seeded synthetic data at several scales. Each
+benchmark records the best total time of its calls over repeats runs and
+the peak memory (tracemalloc) of a single call, and the results are
+written as JSON with the commit they were run on, so runs on different
+commits can be compared.
+
+The battle log transform is called once per player with a full battle log
+(the API returns BATTLE_LOG_WINDOW battles), as in the ETL, so its input is
+generated player by player instead of all held in memory.
+
+Usage: python ./etl/benchmark_etl.py run [scales] [results path]
+       python ./etl/benchmark_etl.py compare [baseline path] [results path]"""
+
+import sys
+import json
+import platform
+import subprocess
+import tracemalloc
+from datetime import datetime as dt, timedelta
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable, Iterable
+
+import numpy as np
+from pandas import DataFrame
+
+from db import WRITE_PROFILE
+from benchmark_load import get_benchmark_connection, generate_catalogue_frames
+from polling import BATTLE_LOG_WINDOW
+from transform import (brawl_api_data_to_df, transform_brawl_data_api, transform_battle_log_api,
+                       generate_brawler_changes, generate_starpower_changes,
+                       generate_gadget_changes, generate_event_changes)
+from load import (insert_brawler_db, insert_new_starpower_data, insert_new_gadget_data,
+                  insert_new_event_data, insert_battle_log_db)
+
+DEFAULT_SEED = 42
+
+DEFAULT_REPEATS = 3
+
+# Brawlers (each with 2 starpowers and 2 gadgets), events, players and battles
+SCALES = {"small": {"brawlers": 50, "events": 100, "players": 100, "battles": 10_000},
+          "medium": {"brawlers": 200, "events": 500, "players": 1_000, "battles": 100_000},
+          "large": {"brawlers": 1_000, "events": 2_000, "players": 10_000,
+                    "battles": 1_000_000}}
+
+DEFAULT_SCALES = ["small", "medium"]
+
+# Fraction of catalogue rows changed between the database and the API
+CHANGED_FRACTION = 0.05
+
+PLAYER_TAG_CHARACTERS = list("0289PYLQGRJCUV")
+
+EVENT_MODES = ["brawlBall", "gemGrab", "heist", "bounty", "knockout", "hotZone"]
+
+BATTLE_RESULTS = ["victory", "defeat", "draw"]
+
+BATTLE_START_TIME = dt(2025, 4, 13, 12, 0, 0)
+
+
+def generate_brawl_data_api(rng: np.random.Generator, brawlers: int) -> list[dict]:
+    """Returns brawler API data for a catalogue of brawlers, each with two
+    starpowers and two gadgets"""
+
+    return [{"id": 16000000 + brawler_index,
+             "name": f"BRAWLER {brawler_index}",
+             "starPowers": [{"id": 23000000 + 2 * brawler_index + offset,
+                             "name": f"STARPOWER {rng.integers(1_000_000)}"}
+                            for offset in range(2)],
+             "gadgets": [{"id": 23100000 + 2 * brawler_index + offset,
+                          "name": f"GADGET {rng.integers(1_000_000)}"}
+                         for offset in range(2)]}
+            for brawler_index in range(brawlers)]
+
+
+def generate_catalogue_database(rng: np.random.Generator, catalogue_api_df: DataFrame,
+                                name_column: str) -> DataFrame:
+    """Returns a database copy of an API catalogue dataframe with
+    CHANGED_FRACTION of its names changed"""
+
+    catalogue_db_df = catalogue_api_df.copy()
+    changed_rows = rng.random(len(catalogue_db_df)) < CHANGED_FRACTION
+    catalogue_db_df.loc[changed_rows, name_column] = catalogue_db_df.loc[
+        changed_rows, name_column] + " (old)"
+
+    return catalogue_db_df
+
+
+def generate_events(rng: np.random.Generator, events: int) -> DataFrame:
+    """Returns events with random modes"""
+
+    return DataFrame({"event_id": np.arange(15000000, 15000000 + events),
+                      "event_version": None,
+                      "mode": rng.choice(EVENT_MODES, events),
+                      "map": [f"Map {event_index}" for event_index in range(events)]})
+
+
+def generate_player_tags(rng: np.random.Generator, players: int) -> list[str]:
+    """Returns unique player tags"""
+
+    player_tags = set()
+
+    while len(player_tags) < players:
+        player_tags.add("#" + "".join(rng.choice(PLAYER_TAG_CHARACTERS, 9)))
+
+    return sorted(player_tags)
+
+
+def generate_battle_log_api(rng: np.random.Generator, player_tag: str, battles: int,
+                            brawler_ids: np.ndarray, events: list[dict]) -> dict:
+    """Returns battle log API data of a player's 3v3 battles, newest first"""
+
+    items = []
+
+    for battle_index in range(battles):
+        event = events[rng.integers(len(events))]
+        team_brawler_ids = rng.choice(brawler_ids, 6)
+        teams = [[{"tag": player_tag if player_index == 0 else
+                   f"#{''.join(rng.choice(PLAYER_TAG_CHARACTERS, 9))}",
+                   "name": f"Player {player_index}",
+                   "brawler": {"id": int(team_brawler_ids[3 * team_index + player_index]),
+                               "name": "BRAWLER", "power": 11,
+                               "trophies": int(rng.integers(0, 1000))}}
+                  for player_index in range(3)]
+                 for team_index in range(2)]
+        items.append({
+            "battleTime": (BATTLE_START_TIME - timedelta(minutes=3 * battle_index)
+                           ).strftime("%Y%m%dT%H%M%S.000Z"),
+            "event": {"id": int(event["event_id"]), "mode": event["mode"],
+                      "map": event["map"]},
+            "battle": {"mode": event["mode"], "type": "ranked",
+                       "result": rng.choice(BATTLE_RESULTS),
+                       "duration": int(rng.integers(60, 180)),
+                       "trophyChange": int(rng.integers(-8, 9)),
+                       "starPlayer": teams[0][0], "teams": teams}})
+
+    return {"items": items}
+
+
+def generate_battle_log_df(rng: np.random.Generator, player_tags: list[str], battles: int,
+                           brawler_ids: np.ndarray, events: DataFrame) -> DataFrame:
+    """Returns transformed battles spread over the players, as loaded by
+    insert_battle_log_db"""
+
+    battle_minutes = rng.permutation(battles)
+
+    return DataFrame({
+        "player_tag": rng.choice(player_tags, battles),
+        "battle_time": [(BATTLE_START_TIME - timedelta(minutes=int(minute))).strftime(
+            "%Y-%m-%d %H:%M:%S") for minute in battle_minutes],
+        "event_id": rng.choice(events["event_id"].to_numpy(), battles),
+        "battle_type": "Ranked",
+        "result": rng.choice(["Victory", "Defeat", "Draw"], battles),
+        "duration": rng.integers(60, 180, battles),
+        "trophy_change": rng.integers(-8, 9, battles),
+        "brawler_played_id": rng.choice(brawler_ids, battles),
+        "star_player": rng.random(battles) < 1 / 6,
+        "brawler_trophies": rng.integers(0, 1000, battles)})
+
+
+def measure_benchmark(function: Callable, get_calls: Callable[[], Iterable[tuple]],
+                      repeats: int = DEFAULT_REPEATS) -> dict:
+    """Returns the best total time of the function's calls (arguments from
+    a fresh get_calls each repeat, prepared outside the timing) and the
+    peak memory of a single call, traced on a separate run"""
+
+    best_seconds = None
+
+    for _ in range(repeats):
+        seconds, calls = 0.0, 0
+        for call_args in get_calls():
+            start = perf_counter()
+            function(*call_args)
+            seconds += perf_counter() - start
+            calls += 1
+        best_seconds = seconds if best_seconds is None else min(best_seconds, seconds)
+
+    peak_memory = 0
+    tracemalloc.start()
+
+    try:
+        for call_args in get_calls():
+            tracemalloc.reset_peak()
+            baseline_memory = tracemalloc.get_traced_memory()[0]
+            function(*call_args)
+            peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1] - baseline_memory)
+
+    finally:
+        tracemalloc.stop()
+
+    return {"calls": calls, "seconds": best_seconds, "peak_memory_bytes": peak_memory}
+
+
+def get_loader_calls(tmp_dir: Path, loader_name: str, data: DataFrame) -> Iterable[tuple]:
+    """Yields a fresh database connection created from the schema and the data to load"""
+
+    db_conn = get_benchmark_connection(tmp_dir / f"{loader_name}.db", WRITE_PROFILE)
+
+    try:
+        yield db_conn, data
+
+    finally:
+        db_conn.close()
+        for db_file in tmp_dir.glob(f"{loader_name}.db*"):
+            db_file.unlink()
+
+
+def load_and_commit(loader: Callable) -> Callable:
+    """Returns the loader followed by a commit, so the commit is timed with it"""
+
+    def run_loader(db_conn, data):
+        loader(db_conn, data)
+        db_conn.commit()
+
+    return run_loader
+
+
+def get_benchmarks(scale: dict, seed: int, tmp_dir: Path) -> dict:
+    """Returns each benchmark's function, the function yielding its calls'
+    arguments and its number of records, for a scale"""
+
+    rng = np.random.default_rng(seed)
+    brawl_data_api = transform_brawl_data_api(generate_brawl_data_api(rng, scale["brawlers"]))
+    brawler_df = brawl_api_data_to_df(brawl_data_api)
+    starpower_df = brawl_api_data_to_df(brawl_data_api, "star_powers")
+    gadget_df = brawl_api_data_to_df(brawl_data_api, "gadgets")
+    brawler_db_df = generate_catalogue_database(rng, brawler_df, "brawler_name")
+    starpower_db_df = generate_catalogue_database(rng, starpower_df, "starpower_name")
+    gadget_db_df = generate_catalogue_database(rng, gadget_df, "gadget_name")
+    events = generate_events(rng, scale["events"])
+    event_db_df = events.iloc[:int(len(events) * (1 - CHANGED_FRACTION))]
+    player_tags = generate_player_tags(rng, scale["players"])
+    brawler_ids = brawler_df["brawler_id"].to_numpy()
+    catalogue_frames = generate_catalogue_frames(scale["brawlers"])
+    battle_log_df = generate_battle_log_df(rng, player_tags, scale["battles"], brawler_ids,
+                                           events)
+
+    event_records = events.to_dict("records")
+
+    def get_battle_log_calls():
+        battle_rng = np.random.default_rng(seed)
+        db_conn = get_benchmark_connection(":memory:", {})
+        try:
+            for player_tag in player_tags:
+                yield db_conn, generate_battle_log_api(battle_rng, player_tag,
+                                                       BATTLE_LOG_WINDOW, brawler_ids,
+                                                       event_records), player_tag
+        finally:
+            db_conn.close()
+
+    return {
+        "brawl_api_data_to_df": (
+            lambda brawl_data: (brawl_api_data_to_df(brawl_data),
+                                brawl_api_data_to_df(brawl_data, "star_powers"),
+                                brawl_api_data_to_df(brawl_data, "gadgets")),
+            lambda: [(brawl_data_api,)], scale["brawlers"]),
+        "generate_brawler_changes": (generate_brawler_changes,
+                                     lambda: [(brawler_db_df, brawler_df.copy())],
+                                     len(brawler_df)),
+        "generate_starpower_changes": (generate_starpower_changes,
+                                       lambda: [(starpower_db_df, starpower_df.copy())],
+                                       len(starpower_df)),
+        "generate_gadget_changes": (generate_gadget_changes,
+                                    lambda: [(gadget_db_df, gadget_df.copy())],
+                                    len(gadget_df)),
+        "generate_event_changes": (generate_event_changes,
+                                   lambda: [(event_db_df, events.copy())], len(events)),
+        "transform_battle_log_api": (transform_battle_log_api, get_battle_log_calls,
+                                     len(player_tags) * BATTLE_LOG_WINDOW),
+        "insert_brawler_db": (
+            load_and_commit(insert_brawler_db),
+            lambda: get_loader_calls(tmp_dir, "brawler", catalogue_frames["brawler"]),
+            scale["brawlers"]),
+        "insert_new_starpower_data": (
+            load_and_commit(insert_new_starpower_data),
+            lambda: get_loader_calls(tmp_dir, "starpower", catalogue_frames["starpower"]),
+            scale["brawlers"]),
+        "insert_new_gadget_data": (
+            load_and_commit(insert_new_gadget_data),
+            lambda: get_loader_calls(tmp_dir, "gadget", catalogue_frames["gadget"]),
+            scale["brawlers"]),
+        "insert_new_event_data": (
+            load_and_commit(insert_new_event_data),
+            lambda: get_loader_calls(tmp_dir, "event", events.assign(event_version=1)),
+            len(events)),
+        "insert_battle_log_db": (
+            load_and_commit(insert_battle_log_db),
+            lambda: get_loader_calls(tmp_dir, "battle", battle_log_df), scale["battles"])}
+
+
+def get_commit() -> str:
+    """Returns the git commit of the working tree (None outside a git repository)"""
+
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True,
+                              cwd=Path(__file__).resolve().parent).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(scales: dict, seed: int = DEFAULT_SEED,
+                   repeats: int = DEFAULT_REPEATS) -> dict:
+    """Runs every benchmark at every scale. Returns the results with the
+    commit, seed and Python version they were run with"""
+
+    results = []
+
+    for scale_name, scale in scales.items():
+        with TemporaryDirectory() as tmp_dir:
+            benchmarks = get_benchmarks(scale, seed, Path(tmp_dir))
+
+            for benchmark_name, (function, get_calls, records) in benchmarks.items():
+                measurement = measure_benchmark(function, get_calls, repeats)
+                results.append({"benchmark": benchmark_name, "scale": scale_name,
+                                "records": records, **measurement,
+                                "records_per_sec": round(records / measurement["seconds"])
+                                if measurement["seconds"] else None})
+
+    return {"commit": get_commit(), "created_at": dt.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(), "seed": seed, "repeats": repeats,
+            "scales": scales, "results": results}
+
+
+def compare_results(baseline: dict, current: dict) -> list[dict]:
+    """Returns the time and peak memory of each benchmark and scale in both
+    result sets, as ratios of current to baseline"""
+
+    baseline_results = {(result["benchmark"], result["scale"]): result
+                        for result in baseline["results"]}
+
+    return [{"benchmark": result["benchmark"], "scale": result["scale"],
+             "seconds_ratio": round(result["seconds"] / baseline_result["seconds"], 3),
+             "peak_memory_ratio": round(result["peak_memory_bytes"]
+                                        / max(baseline_result["peak_memory_bytes"], 1), 3)}
+            for result in current["results"]
+            if (baseline_result := baseline_results.get((result["benchmark"], result["scale"])))]
+
+
+if __name__ == "__main__":
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "run"
+
+    if command == "compare":
+        with open(sys.argv[2], encoding="utf-8") as baseline_file, \
+                open(sys.argv[3], encoding="utf-8") as results_file:
+            comparisons = compare_results(json.load(baseline_file), json.load(results_file))
+        for comparison in comparisons:
+            print(f"{comparison['benchmark']:<28} {comparison['scale']:<7} "
+                  f"time={comparison['seconds_ratio']}x "
+                  f"peak_memory={comparison['peak_memory_ratio']}x")
+
+    else:
+        scale_names = sys.argv[2].split(",") if len(sys.argv) > 2 else DEFAULT_SCALES
+        results_path = sys.argv[3] if len(sys.argv) > 3 else "benchmark_results.json"
+
+        benchmark_results = run_benchmarks({scale_name: SCALES[scale_name]
+                                            for scale_name in scale_names})
+
+        with open(results_path, "w", encoding="utf-8") as results_file:
+            json.dump(benchmark_results, results_file, indent=2)
+
+        for result in benchmark_results["results"]:
+            print(f"{result['benchmark']:<28} {result['scale']:<7} "
+                  f"records={result['records']} seconds={result['seconds']:.4f} "
+                  f"peak_memory={result['peak_memory_bytes'] / 2 ** 20:.1f}MiB")
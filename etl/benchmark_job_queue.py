@@ -0,0 +1,111 @@
+"""Benchmark for the roster job queue
+
+Runs the roster player jobs of a seeded synthetic roster on 1, 2 and 4
+workers against a mocked API that answers each request after a fixed
+latency, and prints jobs per second for each worker count. Workers are
+forked processes with their own connections, as run by job_queue.py work,
+and inherit the mocked API. Each worker count is run on a fresh database.
+
+Usage: python ./etl/benchmark_job_queue.py [players] [api latency ms]"""
+
+import sys
+from multiprocessing import get_context
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+from unittest.mock import patch
+
+import numpy as np
+
+from db import ConnectionManager
+from benchmark_load import get_benchmark_connection
+from benchmark_etl import (generate_player_tags, generate_battle_log_api, generate_events,
+                           DEFAULT_SEED)
+from polling import BATTLE_LOG_WINDOW
+from job_queue import enqueue_jobs, run_worker_process, ROSTER_JOB_TYPE
+
+WORKER_COUNTS = (1, 2, 4)
+
+DEFAULT_PLAYERS = 400
+
+DEFAULT_API_LATENCY_MS = 50
+
+
+def get_mock_api(seed: int, latency_seconds: float) -> tuple:
+    """Returns mock get_api_player_data and get_api_player_battle_log
+    functions answering after latency_seconds"""
+
+    rng = np.random.default_rng(seed)
+    brawler_ids = np.arange(16000000, 16000050)
+    events = generate_events(rng, 20).to_dict("records")
+
+    def get_api_player_data(_api_token, player_tag):
+        sleep(latency_seconds)
+        return {"tag": player_tag, "name": "Player", "trophies": 500,
+                "highestTrophies": 600, "expLevel": 50, "expPoints": 5000,
+                "3vs3Victories": 100, "soloVictories": 10, "duoVictories": 10}
+
+    def get_api_player_battle_log(_api_token, player_tag):
+        sleep(latency_seconds)
+        return generate_battle_log_api(np.random.default_rng(seed), player_tag,
+                                       BATTLE_LOG_WINDOW, brawler_ids, events)
+
+    return get_api_player_data, get_api_player_battle_log
+
+
+def measure_workers(tmp_dir: Path, player_tags: list[str], workers: int) -> float:
+    """Runs every player's job on workers workers. Returns jobs per second"""
+
+    db_path = tmp_dir / f"workers_{workers}.db"
+    with get_benchmark_connection(db_path, {}) as db_conn:
+        enqueue_jobs(db_conn, ROSTER_JOB_TYPE, player_tags)
+    db_conn.close()
+
+    config = {"api_token": "token", "dbpath": str(db_path)}
+    worker_processes = [get_context("fork").Process(target=run_worker_process, args=(config,))
+                        for _ in range(workers)]
+
+    start = perf_counter()
+    for worker_process in worker_processes:
+        worker_process.start()
+    for worker_process in worker_processes:
+        worker_process.join()
+    elapsed = perf_counter() - start
+
+    db_manager = ConnectionManager(config)
+    with db_manager.reader() as db_reader:
+        jobs_done = db_reader.execute("""SELECT COUNT(*)
+                                      FROM job_queue
+                                      WHERE job_status = 'done';""").fetchone()[0]
+    db_manager.close()
+
+    return jobs_done / elapsed
+
+
+def run_benchmark(players: int, api_latency_ms: float,
+                  seed: int = DEFAULT_SEED) -> list[dict]:
+    """Returns jobs per second of the roster jobs at each worker count"""
+
+    player_tags = generate_player_tags(np.random.default_rng(seed), players)
+    get_api_player_data, get_api_player_battle_log = get_mock_api(seed, api_latency_ms / 1000)
+    results = []
+
+    with TemporaryDirectory() as tmp_dir, patch("roster.get_api_player_data",
+                                                get_api_player_data):
+        with patch("roster.get_api_player_battle_log", get_api_player_battle_log):
+            for workers in WORKER_COUNTS:
+                results.append({"workers": workers, "jobs": players,
+                                "jobs_per_sec": round(measure_workers(
+                                    Path(tmp_dir), player_tags, workers), 1)})
+
+    return results
+
+
+if __name__ == "__main__":
+
+    benchmark_players = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_PLAYERS
+    benchmark_latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_API_LATENCY_MS
+
+    for result in run_benchmark(benchmark_players, benchmark_latency_ms):
+        print(f"workers={result['workers']} jobs={result['jobs']} "
+              f"jobs_per_sec={result['jobs_per_sec']}")
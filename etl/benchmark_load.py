@@ -0,0 +1,170 @@
+"""Benchmark for the catalogue loaders in load.py
+
+Compares the executemany loaders against the previous iterrows loaders
+(one cursor and one execute per row), and the sqlite defaults against the
+write profile in db.py, and prints rows per second.
+
+Usage: python ./etl/benchmark_load.py [rows]"""
+
+import sys
+import sqlite3
+from sqlite3 import Connection, Cursor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from pandas import DataFrame
+
+from db import WRITE_PROFILE, apply_pragmas
+from load import (insert_brawler_db, insert_new_starpower_data, insert_new_gadget_data,
+                  insert_new_event_data)
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "database" / "schema.sql"
+
+
+def get_benchmark_connection(db_path: Path, pragmas: dict) -> Connection:
+    """Returns a connection to a fresh database created from the schema"""
+
+    db_conn = sqlite3.connect(database=db_path, timeout=10)
+    apply_pragmas(db_conn, pragmas)
+    db_conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+
+    return db_conn
+
+
+def generate_catalogue_frames(rows: int) -> dict[str, DataFrame]:
+    """Returns synthetic brawler, starpower, gadget and event dataframes"""
+
+    ids = range(rows)
+
+    return {
+        "brawler": DataFrame({"brawler_id": [16000000 + i for i in ids],
+                              "brawler_name": [f"Brawler {i}" for i in ids],
+                              "brawler_version": [0] * rows}),
+        "starpower": DataFrame({"starpower_id": [23000000 + i for i in ids],
+                                "starpower_name": [f"Starpower {i}" for i in ids],
+                                "starpower_version": [0] * rows,
+                                "brawler_id": [16000000 + i for i in ids],
+                                "brawler_version": [1] * rows}),
+        "gadget": DataFrame({"gadget_id": [23100000 + i for i in ids],
+                             "gadget_name": [f"Gadget {i}" for i in ids],
+                             "gadget_version": [0] * rows,
+                             "brawler_id": [16000000 + i for i in ids],
+                             "brawler_version": [1] * rows}),
+        "event": DataFrame({"event_id": [15000000 + i for i in ids],
+                            "event_version": [1] * rows,
+                            "mode": ["Brawl Ball"] * rows,
+                            "map": [f"Map {i}" for i in ids]})
+    }
+
+
+def iterrows_insert_brawler_db(db_conn: Connection, brawler_data: DataFrame):
+    """Previous row by row brawler loader"""
+
+    for _, brawler in brawler_data.iterrows():
+        cur = db_conn.cursor(factory=Cursor)
+        cur.execute("""INSERT INTO brawler
+                    (brawler_id, brawler_version, brawler_name)
+                    VALUES (?, ?, ?);""", [int(brawler["brawler_id"]),
+                                           int(brawler["brawler_version"]) + 1,
+                                           brawler["brawler_name"]])
+
+
+def iterrows_insert_starpower_data(db_conn: Connection, starpower_data: DataFrame):
+    """Previous row by row starpower loader"""
+
+    for _, starpower in starpower_data.iterrows():
+        cur = db_conn.cursor(factory=Cursor)
+        cur.execute("""INSERT INTO starpower
+                    (starpower_id, starpower_version, starpower_name, brawler_id, brawler_version)
+                    VALUES (?, ?, ?, ?, ?);""",
+                    [int(starpower["starpower_id"]),
+                     int(starpower["starpower_version"]) + 1,
+                     starpower["starpower_name"],
+                     int(starpower["brawler_id"]),
+                     int(starpower["brawler_version"])])
+
+
+def iterrows_insert_gadget_data(db_conn: Connection, gadget_data: DataFrame):
+    """Previous row by row gadget loader"""
+
+    for _, gadget in gadget_data.iterrows():
+        cur = db_conn.cursor(factory=Cursor)
+        cur.execute("""INSERT INTO gadget
+                    (gadget_id, gadget_version, gadget_name, brawler_id, brawler_version)
+                    VALUES (?, ?, ?, ?, ?);""",
+                    [int(gadget["gadget_id"]),
+                     int(gadget["gadget_version"]) + 1,
+                     gadget["gadget_name"],
+                     int(gadget["brawler_id"]),
+                     int(gadget["brawler_version"])])
+
+
+def iterrows_insert_event_data(db_conn: Connection, event_data: DataFrame):
+    """Previous row by row event loader"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    for _, event in event_data.iterrows():
+        cur.execute("""INSERT INTO bs_event
+                    (bs_event_id, bs_event_version, mode, map)
+                    VALUES (?, ?, ?, ?);""",
+                    [int(event["event_id"]), int(event["event_version"]),
+                     event["mode"], event["map"]])
+
+
+def time_loader(db_path: Path, loader, data: DataFrame, pragmas: dict) -> float:
+    """Returns rows per second for a loader run in a single transaction"""
+
+    db_conn = get_benchmark_connection(db_path, pragmas)
+
+    try:
+        start = perf_counter()
+        loader(db_conn, data)
+        db_conn.commit()
+        elapsed = perf_counter() - start
+
+    finally:
+        db_conn.close()
+
+    return len(data) / elapsed
+
+
+def run_benchmark(rows: int) -> list[dict]:
+    """Runs every loader on both paths and returns the results"""
+
+    frames = generate_catalogue_frames(rows)
+    loaders = {
+        "brawler": (iterrows_insert_brawler_db, insert_brawler_db),
+        "starpower": (iterrows_insert_starpower_data, insert_new_starpower_data),
+        "gadget": (iterrows_insert_gadget_data, insert_new_gadget_data),
+        "event": (iterrows_insert_event_data, insert_new_event_data)
+    }
+    results = []
+
+    with TemporaryDirectory() as tmp_dir:
+        for table, (iterrows_loader, bulk_loader) in loaders.items():
+            iterrows_rate = time_loader(Path(tmp_dir) / f"{table}_iterrows.db",
+                                        iterrows_loader, frames[table], {})
+            bulk_rate = time_loader(Path(tmp_dir) / f"{table}_bulk.db",
+                                    bulk_loader, frames[table], {})
+            tuned_rate = time_loader(Path(tmp_dir) / f"{table}_tuned.db",
+                                     bulk_loader, frames[table], WRITE_PROFILE)
+            results.append({"table": table, "rows": rows,
+                            "iterrows_rows_per_sec": round(iterrows_rate),
+                            "executemany_rows_per_sec": round(bulk_rate),
+                            "write_profile_rows_per_sec": round(tuned_rate),
+                            "speedup": round(tuned_rate / iterrows_rate, 2)})
+
+    return results
+
+
+if __name__ == "__main__":
+
+    benchmark_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    for result in run_benchmark(benchmark_rows):
+        print(f"{result['table']:<10} rows={result['rows']} "
+              f"iterrows={result['iterrows_rows_per_sec']}/s "
+              f"executemany={result['executemany_rows_per_sec']}/s "
+              f"write_profile={result['write_profile_rows_per_sec']}/s "
+              f"speedup={result['speedup']}x")
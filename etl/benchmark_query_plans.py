@@ -0,0 +1,217 @@
+"""Query plan benchmark for the database queries in extract.py and main.py
+
+Seeds a database with large synthetic version, player and process log
+histories, runs every query function, records the EXPLAIN QUERY PLAN and
+run time of each statement it executes, and exits with status 1 if any
+statement scans a full table without an index.
+
+Usage: python ./etl/benchmark_query_plans.py [versions]"""
+
+import sys
+import json
+import random
+import inspect
+import sqlite3
+from sqlite3 import Connection
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import extract
+import main
+from load import rebuild_current_tables
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "database" / "schema.sql"
+
+SEED = 36
+
+DEFAULT_VERSIONS = 20
+
+ENTITIES = 500
+
+PLAYERS = 1_000
+
+# Functions that return every row of a (constant size) current table
+# by design, their full scans are expected
+FULL_READ_FUNCTIONS = {"get_starpowers_latest_version", "get_gadgets_latest_version",
+                       "get_brawlers_latest_version", "get_events_latest_version",
+                       "get_distinct_event_ids"}
+
+# Functions taking a connection that only call other query functions
+NOT_QUERY_FUNCTIONS = {"etl_brawler", "load_player_data", "load_player_batch",
+                       "load_player_batch_checkpointed", "etl_player",
+                       "etl_player_rollup", "etl_battle_log", "extract_catalogue_database",
+                       "extract_brawler_etl_data", "load_brawler_etl_data"}
+
+QUERY_CALLS = [
+    (extract.get_starpowers_latest_version, ()),
+    (extract.get_gadgets_latest_version, ()),
+    (extract.get_brawlers_latest_version, ()),
+    (extract.get_events_latest_version, ()),
+    (extract.get_brawler_latest_version_id, (16000042,)),
+    (extract.get_most_recent_battle_log_time, ("#PLAYER42",)),
+    (extract.get_distinct_battle_types, ()),
+    (extract.get_distinct_event_ids, ()),
+    (extract.get_starpower_latest_version_id, (23000042,)),
+    (extract.get_gadget_latest_version_id, (23100042,)),
+    (extract.get_player_id, ({"tag": "#PLAYER42"},)),
+    (extract.get_player_latest_snapshot, (42,)),
+    (extract.get_player_snapshot_at, (42, "2025-01-15 00:00:00")),
+    (main.get_process_id, ("Player ETL",)),
+    (main.update_process_log, (2, "Start")),
+    (main.get_last_process_id_run, (2,)),
+]
+
+
+def seed_history(db_conn: Connection, versions: int) -> None:
+    """Seeds versions of every brawler, starpower, gadget and event,
+    player snapshots, battles and process log runs"""
+
+    rng = random.Random(SEED)
+    entities = range(ENTITIES)
+
+    db_conn.executemany("INSERT INTO brawler (brawler_id, brawler_version, brawler_name) "
+                        "VALUES (?, ?, ?);",
+                        [(16000000 + i, v, f"Brawler {i}.{v}")
+                         for i in entities for v in range(1, versions + 1)])
+    for table, id_start in (("starpower", 23000000), ("gadget", 23100000)):
+        db_conn.executemany(f"INSERT INTO {table} ({table}_id, {table}_version, {table}_name, "
+                            "brawler_id, brawler_version) VALUES (?, ?, ?, ?, ?);",
+                            [(id_start + i, v, f"{table} {i}.{v}", 16000000 + i, v)
+                             for i in entities for v in range(1, versions + 1)])
+    db_conn.executemany("INSERT INTO bs_event (bs_event_id, bs_event_version, mode, map) "
+                        "VALUES (?, ?, ?, ?);",
+                        [(15000000 + i, v, "Brawl Ball", f"Map {i}.{v}")
+                         for i in entities for v in range(1, versions + 1)])
+
+    db_conn.executemany("INSERT INTO player (player_id, player_tag, player_name) "
+                        "VALUES (?, ?, ?);",
+                        [(i, f"#PLAYER{i}", f"Player {i}") for i in range(PLAYERS)])
+    for table, columns in (("player_exp", "exp_level, exp_points"),
+                           ("player_trophies", "trophies, highest_trophies")):
+        db_conn.executemany(f"INSERT INTO {table} (player_id, {columns}, created_at) "
+                            "VALUES (?, ?, ?, ?);",
+                            [(i, rng.randint(1, 500), rng.randint(1, 50_000),
+                              f"2025-01-{day:02d} 00:00:00")
+                             for i in range(PLAYERS) for day in range(1, versions + 1)])
+    db_conn.executemany("INSERT INTO player_victories (player_id, _3vs3_victories, "
+                        "solo_victories, duo_victories, created_at) VALUES (?, ?, ?, ?, ?);",
+                        [(i, rng.randint(1, 9_000), rng.randint(1, 900), rng.randint(1, 900),
+                          f"2025-01-{day:02d} 00:00:00")
+                         for i in range(PLAYERS) for day in range(1, versions + 1)])
+
+    db_conn.executemany("INSERT INTO battle_type (battle_type_name) VALUES (?);",
+                        [("ranked",), ("soloRanked",), ("friendly",)])
+    db_conn.executemany("INSERT INTO battle (player_tag, battle_time, bs_event_id, "
+                        "battle_type_id, result, brawler_id) VALUES (?, ?, ?, ?, ?, ?);",
+                        [(f"#PLAYER{i}", f"2025-01-01 00:{minute:02d}:00",
+                          15000000 + rng.randrange(ENTITIES), rng.randint(1, 3), "victory",
+                          16000000 + rng.randrange(ENTITIES))
+                         for i in range(PLAYERS) for minute in range(versions)])
+    db_conn.executemany("INSERT INTO process_log (process_id, process_status, last_updated) "
+                        "VALUES (?, ?, ?);",
+                        [(process_id, status, f"2025-01-{day:02d} {hour:02d}:00:00")
+                         for process_id in (1, 2, 3) for day in range(1, 29)
+                         for hour in range(24) for status in ("Start", "End")])
+    db_conn.commit()
+
+    rebuild_current_tables(db_conn)
+    db_conn.execute("ANALYZE;")
+
+
+def get_uncovered_query_functions() -> list[str]:
+    """Returns query functions in extract.py and main.py that take a
+    connection but are missing from QUERY_CALLS"""
+
+    covered = {function.__name__ for function, _ in QUERY_CALLS} | NOT_QUERY_FUNCTIONS
+    uncovered = []
+
+    for module in (extract, main):
+        for name, function in inspect.getmembers(module, inspect.isfunction):
+            if function.__module__ != module.__name__ or name in covered:
+                continue
+
+            parameters = list(inspect.signature(function).parameters.values())
+            if parameters and parameters[0].annotation is Connection:
+                uncovered.append(name)
+
+    return uncovered
+
+
+def explain_query_plan(db_conn: Connection, sql: str) -> list[str]:
+    """Returns the EXPLAIN QUERY PLAN details of a statement"""
+
+    return [row[3] for row in db_conn.execute(f"EXPLAIN QUERY PLAN {sql}").fetchall()]
+
+
+def is_full_scan(plan_detail: str) -> bool:
+    """Returns true if a query plan step scans a table without an index"""
+
+    return (plan_detail.startswith("SCAN ") and " USING " not in plan_detail
+            and plan_detail != "SCAN CONSTANT ROW")
+
+
+def run_query_plan_benchmark(db_conn: Connection) -> list[dict]:
+    """Runs every query function and returns the statements it executed
+    with their query plan, run time and full scan failures"""
+
+    results = []
+
+    for function, arguments in QUERY_CALLS:
+        statements = []
+        db_conn.set_trace_callback(statements.append)
+        start = perf_counter()
+
+        try:
+            function(db_conn, *arguments)
+
+        finally:
+            seconds = perf_counter() - start
+            db_conn.set_trace_callback(None)
+
+        for sql in statements:
+            if not sql.lstrip().upper().startswith(("SELECT", "WITH", "INSERT",
+                                                    "UPDATE", "DELETE")):
+                continue
+
+            plan = explain_query_plan(db_conn, sql)
+            full_scans = [detail for detail in plan if is_full_scan(detail)]
+
+            results.append({"function": function.__name__,
+                            "sql": " ".join(sql.split()),
+                            "plan": plan,
+                            "seconds": round(seconds, 6),
+                            "full_scans": full_scans,
+                            "failed": bool(full_scans)
+                                      and function.__name__ not in FULL_READ_FUNCTIONS})
+
+    return results
+
+
+def run_benchmark(versions: int) -> list[dict]:
+    """Seeds a temporary database and returns the query plan results"""
+
+    with TemporaryDirectory() as tmp_dir:
+        db_conn = sqlite3.connect(database=Path(tmp_dir) / "benchmark.db")
+        db_conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+
+        try:
+            seed_history(db_conn, versions)
+            return run_query_plan_benchmark(db_conn)
+
+        finally:
+            db_conn.close()
+
+
+if __name__ == "__main__":
+
+    benchmark_versions = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_VERSIONS
+    benchmark_results = run_benchmark(benchmark_versions)
+    uncovered_functions = get_uncovered_query_functions()
+
+    print(json.dumps({"versions": benchmark_versions,
+                      "uncovered_functions": uncovered_functions,
+                      "queries": benchmark_results}, indent=2))
+
+    if uncovered_functions or any(result["failed"] for result in benchmark_results):
+        sys.exit(1)
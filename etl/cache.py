@@ -0,0 +1,167 @@
+"""Read side cache of query results for the frontend
+
+The stored data only changes when an ETL commits, so instead of expiring
+entries on a timer every ETL bumps the data generation (data_generation
+table) in the transaction that writes its data. Each cached result
+records the generation it was read at and is only served while that is
+still the current generation. Results and generations are kept per
+database file, as shards have their own generation and the same query
+parameters (e.g. a player ID) mean different rows on each shard. The cache
+holds at most max_entries results, evicting the least recently used.
+
+Frontend reads go through a CachedReader, which runs the query functions
+on a ConnectionManager's pooled readers through its QueryCache."""
+
+from collections import OrderedDict
+from sqlite3 import Connection, Cursor, DatabaseError
+from threading import Lock
+from typing import Callable
+
+from db import ConnectionManager, transaction
+
+DEFAULT_MAX_CACHED_QUERIES = 1024
+
+
+def get_data_generation(db_conn: Connection) -> int:
+    """Returns the current data generation"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""SELECT generation
+                    FROM data_generation
+                    WHERE data_generation_id = 1;""")
+
+        return (cur.fetchone() or [0])[0]
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+
+def bump_data_generation(db_conn: Connection) -> None:
+    """Starts a new data generation (joins the open transaction if there is
+    one, so the new generation is committed together with the data)"""
+
+    try:
+        with transaction(db_conn):
+            db_conn.execute("""UPDATE data_generation
+                            SET generation = generation + 1,
+                              last_updated = datetime('now')
+                            WHERE data_generation_id = 1;""")
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to update data generation!") from exc
+
+
+def get_database_identity(db_conn: Connection) -> str:
+    """Returns the file of a connection's main database (in memory databases
+    are identified by their connection)"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("PRAGMA database_list;")
+
+        database_file = next(database[2] for database in cur.fetchall()
+                             if database[1] == "main")
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    return database_file or f":memory:{id(db_conn)}"
+
+
+def copy_result(result):
+    """Returns a copy of a result that can be modified (e.g. a DataFrame)"""
+
+    return result.copy() if hasattr(result, "copy") else result
+
+
+class QueryCache:
+    """LRU cache of query function results, keyed by the database, the
+    function and its parameters and invalidated when the database's data
+    generation changes"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_CACHED_QUERIES):
+        self.max_entries = max_entries
+        self.generations = {}
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, db_conn: Connection, query_function: Callable, *args, **kwargs):
+        """Returns query_function(db_conn, *args, **kwargs), from the cache if
+        it was read at the current data generation. DataFrame results are
+        copied so callers can modify them"""
+
+        database = get_database_identity(db_conn)
+        key = (database, query_function.__module__, query_function.__qualname__,
+               args, tuple(sorted(kwargs.items())))
+        generation = get_data_generation(db_conn)
+
+        with self._lock:
+            if generation != self.generations.get(database):
+                stale_keys = [entry_key for entry_key in self._entries
+                              if entry_key[0] == database]
+                if stale_keys:
+                    self._stats["invalidations"] += 1
+                for stale_key in stale_keys:
+                    del self._entries[stale_key]
+                self.generations[database] = generation
+
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return copy_result(self._entries[key])
+
+            self._stats["misses"] += 1
+
+        result = query_function(db_conn, *args, **kwargs)
+
+        with self._lock:
+            # Not cached if a new generation was seen while the query ran
+            if generation == self.generations.get(database):
+                self._entries[key] = result
+                self._entries.move_to_end(key)
+                if len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    self._stats["evictions"] += 1
+
+        return copy_result(result)
+
+    def clear(self) -> None:
+        """Removes every cached result"""
+
+        with self._lock:
+            self._entries.clear()
+            self.generations = {}
+
+    def stats(self) -> dict:
+        """Returns cache hit, miss, eviction and invalidation counts"""
+
+        with self._lock:
+            hits, misses = self._stats["hits"], self._stats["misses"]
+
+            return {**self._stats,
+                    "entries": len(self._entries),
+                    "generations": dict(self.generations),
+                    "hit_rate": round(hits / (hits + misses), 4) if hits + misses else 0.0}
+
+
+class CachedReader:
+    """Runs read query functions on a ConnectionManager's readers, serving
+    results from its QueryCache while the data is unchanged"""
+
+    def __init__(self, db_manager: ConnectionManager, query_cache: QueryCache = None):
+        self.db_manager = db_manager
+        self.query_cache = query_cache or QueryCache()
+
+    def read(self, query_function: Callable, *args, **kwargs):
+        """Returns query_function(reader, *args, **kwargs), cached"""
+
+        with self.db_manager.reader() as db_reader:
+            return self.query_cache.get(db_reader, query_function, *args, **kwargs)
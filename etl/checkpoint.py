@@ -0,0 +1,101 @@
+"""Checkpoints of batched process runs
+
+A batched stage (e.g. one shard of the roster ETL) runs over its players
+in tag order and records the tag of the last player of each batch in
+process_checkpoint, in the same database and transaction as the batch's
+data. The checkpoints are cleared when the run ends, so a run that failed
+or was killed leaves them behind and the next run skips the players
+already committed instead of extracting them from the API again.
+
+Checkpoints hold a player tag rather than a batch number, so players
+added to or removed from the roster between the runs do not shift what
+is skipped. Checkpoints older than checkpoint_max_age_hours (default 24)
+are left over from a run that was abandoned and are ignored."""
+
+from sqlite3 import Connection, Cursor, DatabaseError
+
+from extract import format_player_tag
+
+DEFAULT_CHECKPOINT_MAX_AGE_HOURS = 24
+
+
+def get_checkpoint_max_age_hours(config_env) -> float:
+    """Returns the age in hours after which a checkpoint is ignored"""
+
+    return float(config_env.get("checkpoint_max_age_hours", DEFAULT_CHECKPOINT_MAX_AGE_HOURS))
+
+
+def sort_player_tags(player_tags: list[str]) -> list[str]:
+    """Returns player tags formatted and in the order checkpointed stages run them"""
+
+    return sorted(f"#{format_player_tag(player_tag)}" for player_tag in player_tags)
+
+
+def get_last_checkpoint(db_conn: Connection, process_id: int, stage: str,
+                        max_age_hours: float = DEFAULT_CHECKPOINT_MAX_AGE_HOURS) -> str:
+    """Returns the tag of the last player of a stage committed by an unfinished
+    run of a process, or None if there is no checkpoint newer than max_age_hours"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""SELECT last_player_tag
+                    FROM process_checkpoint
+                    WHERE process_id = ?
+                    AND process_stage = ?
+                    AND last_updated >= datetime('now', ?);""",
+                    [process_id, stage, f"-{max_age_hours} hours"])
+
+        return (cur.fetchone() or [None])[0]
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+
+def get_remaining_player_tags(player_tags: list[str], last_player_tag: str = None) -> list[str]:
+    """Returns the sorted player tags after the last checkpointed player tag"""
+
+    player_tags = sort_player_tags(player_tags)
+
+    if last_player_tag is None:
+        return player_tags
+
+    return [player_tag for player_tag in player_tags if player_tag > last_player_tag]
+
+
+def record_checkpoint(db_conn: Connection, process_id: int, stage: str,
+                      last_player_tag: str) -> None:
+    """Records the last player of a stage committed (in the batch's transaction)"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""INSERT INTO process_checkpoint
+                    (process_id, process_stage, last_player_tag)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (process_id, process_stage) DO UPDATE SET
+                      last_player_tag = excluded.last_player_tag,
+                      last_updated = datetime('now');""",
+                    [process_id, stage, f"#{format_player_tag(last_player_tag)}"])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert checkpoint data!") from exc
+
+    finally:
+        cur.close()
+
+
+def clear_checkpoints(db_conn: Connection, process_id: int) -> None:
+    """Removes the checkpoints of a process once a run has ended"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""DELETE FROM process_checkpoint
+                    WHERE process_id = ?;""", [process_id])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to delete checkpoint data!") from exc
+
+    finally:
+        cur.close()
@@ -0,0 +1,165 @@
+"""Team composition wins and games per map for 3v3 battles
+
+Each team is stored as its sorted brawler triple encoded in one integer
+(see encode_compositions). Both teams of every new decided battle are
+counted as it is loaded, and each composition's score (the lower bound
+of its win rate confidence interval) is kept up to date, so the best
+compositions on a map are read from the (map, score) index."""
+
+from sqlite3 import Connection, Cursor, DatabaseError
+
+import numpy as np
+from pandas import DataFrame, concat
+
+from load import dataframe_to_rows
+from matchup import get_brawler_index, BRAWLER_ID_OFFSET, DECIDED_RESULTS
+from stats import get_wilson_interval
+
+TEAM_SIZE = 3
+
+# Each brawler index takes 10 bits of the composition key
+COMPOSITION_BASE = 1024
+
+DEFAULT_TOP_COMPOSITIONS = 10
+
+
+def encode_compositions(team_brawler_ids: np.ndarray) -> np.ndarray:
+    """Returns the composition key of each row of a (teams, 3) brawler id array,
+    the same for any order of the brawlers"""
+
+    brawler_index = np.sort(get_brawler_index(team_brawler_ids), axis=1)
+
+    if (brawler_index >= COMPOSITION_BASE).any():
+        raise ValueError("Error: Brawler id is too large for a composition key!")
+
+    return (brawler_index[:, 0] * COMPOSITION_BASE ** 2
+            + brawler_index[:, 1] * COMPOSITION_BASE + brawler_index[:, 2])
+
+
+def decode_composition(composition_key: int) -> tuple[int, int, int]:
+    """Returns the (sorted) brawler ids of a composition key"""
+
+    return tuple(int(composition_key // COMPOSITION_BASE ** position % COMPOSITION_BASE
+                     + BRAWLER_ID_OFFSET) for position in (2, 1, 0))
+
+
+def aggregate_compositions(battle_log_data: DataFrame) -> DataFrame:
+    """Returns wins and games per (map, composition) of both teams of
+    decided 3v3 battles"""
+
+    battle_data = battle_log_data[battle_log_data["result"].isin(DECIDED_RESULTS)
+                                  & battle_log_data["event_map"].notna()]
+    battle_data = battle_data[(battle_data["team_brawler_ids"].map(len) == TEAM_SIZE)
+                              & (battle_data["opponent_brawler_ids"].map(len) == TEAM_SIZE)]
+
+    if battle_data.empty:
+        return DataFrame(columns=["map", "composition_key", "wins", "games"])
+
+    won = battle_data["result"].map(DECIDED_RESULTS).to_numpy()
+    team_keys = encode_compositions(np.array(battle_data["team_brawler_ids"].tolist()))
+    opponent_keys = encode_compositions(np.array(battle_data["opponent_brawler_ids"].tolist()))
+
+    composition_data = concat([
+        DataFrame({"map": battle_data["event_map"].to_numpy(), "composition_key": team_keys,
+                   "wins": won, "games": 1}),
+        DataFrame({"map": battle_data["event_map"].to_numpy(), "composition_key": opponent_keys,
+                   "wins": 1 - won, "games": 1})], ignore_index=True)
+
+    return composition_data.groupby(["map", "composition_key"], as_index=False)[
+        ["wins", "games"]].sum()
+
+
+def upsert_composition_stats(db_conn: Connection, composition_data: DataFrame) -> None:
+    """Adds wins and games to team_composition_stats and updates the
+    score of every composition changed. The changes are staged in a
+    temporary table so the changed rows are upserted and read back in one
+    statement each"""
+
+    composition_rows = dataframe_to_rows(composition_data,
+                                         ["map", "composition_key", "wins", "games"])
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""CREATE TEMPORARY TABLE IF NOT EXISTS composition_changes
+                    (map TEXT NOT NULL, composition_key INTEGER NOT NULL,
+                    wins INTEGER NOT NULL, games INTEGER NOT NULL);""")
+        cur.execute("DELETE FROM composition_changes;")
+        cur.executemany("""INSERT INTO composition_changes
+                        (map, composition_key, wins, games)
+                        VALUES (?, ?, ?, ?);""", composition_rows)
+
+        # WHERE true resolves the parsing ambiguity of an upsert from a SELECT
+        cur.execute("""INSERT INTO team_composition_stats
+                    (map, composition_key, wins, games, score)
+                    SELECT map, composition_key, wins, games, 0
+                    FROM composition_changes
+                    WHERE true
+                    ON CONFLICT (map, composition_key) DO UPDATE SET
+                      wins = wins + excluded.wins,
+                      games = games + excluded.games;""")
+
+        cur.execute("""SELECT map, composition_key, stats.wins, stats.games
+                    FROM team_composition_stats AS stats
+                    JOIN composition_changes USING (map, composition_key);""")
+        updated_data = DataFrame(cur.fetchall(), columns=["map", "composition_key",
+                                                          "wins", "games"])
+
+        updated_data["score"], _ = get_wilson_interval(updated_data["wins"],
+                                                       updated_data["games"])
+        cur.executemany("""UPDATE team_composition_stats
+                        SET score = ?
+                        WHERE map = ? AND composition_key = ?;""",
+                        dataframe_to_rows(updated_data, ["score", "map", "composition_key"]))
+        cur.execute("DELETE FROM composition_changes;")
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert team composition data!") from exc
+
+    finally:
+        cur.close()
+
+
+def update_team_compositions(db_conn: Connection, new_battle_data: DataFrame) -> int:
+    """Counts new battles (see stats.get_new_battles) into team_composition_stats.
+    Returns the number of team results counted"""
+
+    if new_battle_data.empty:
+        return 0
+
+    composition_data = aggregate_compositions(new_battle_data)
+
+    if composition_data.empty:
+        return 0
+
+    upsert_composition_stats(db_conn, composition_data)
+
+    return int(composition_data["games"].sum())
+
+
+def get_top_compositions(db_conn: Connection, map_name: str,
+                         top_k: int = DEFAULT_TOP_COMPOSITIONS) -> DataFrame:
+    """Returns the top_k compositions on a map by score, with their brawler ids"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""SELECT composition_key, wins, games, score
+                    FROM team_composition_stats
+                    WHERE map = ?
+                    ORDER BY score DESC
+                    LIMIT ?;""", [map_name, top_k])
+
+        top_compositions = cur.fetchall()
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    top_compositions_df = DataFrame(top_compositions,
+                                    columns=["composition_key", "wins", "games", "score"])
+    top_compositions_df["brawler_ids"] = top_compositions_df["composition_key"].map(
+        decode_composition)
+    top_compositions_df["win_rate"] = top_compositions_df["wins"] / top_compositions_df["games"]
+
+    return top_compositions_df
@@ -1,8 +1,36 @@
 """Pytest fixtures file"""
 
+import sqlite3
+from pathlib import Path
+
 import pytest
 import pandas as pd
 
+from db import ConnectionManager
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "database" / "schema.sql"
+
+@pytest.fixture
+def schema_db_conn():
+    """Returns an in memory database created from the schema"""
+
+    db_conn = sqlite3.connect(":memory:")
+    db_conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+    yield db_conn
+    db_conn.close()
+
+
+@pytest.fixture
+def schema_db_manager(tmp_path):
+    """Returns a connection manager for a database file created from the schema"""
+
+    db_manager = ConnectionManager({"dbpath": str(tmp_path / "test.db")})
+    with db_manager.writer() as db_conn:
+        db_conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+    yield db_manager
+    db_manager.close()
+
+
 @pytest.fixture
 def empty_dataframe():
     """Returns an empty dataframe"""
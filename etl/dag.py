@@ -0,0 +1,88 @@
+"""Runs ETL stages as a dependency graph on a thread pool
+
+A stage is a function and the names of the stages it depends on. Each
+stage starts as soon as every stage it depends on has finished and is
+called with their results as keyword arguments, so independent stages
+(e.g. API calls and database reads) run concurrently and ordering is only
+kept where a stage needs another's result. Stages sharing a database
+connection should depend on each other (or be one stage), as a sqlite3
+connection runs one statement at a time.
+
+If a stage fails no further stages are started, the running stages are
+waited for and ChildProcessError is raised from the stage's error.
+
+Stages run in a copy of the caller's context, so context variables (e.g.
+the current run's metrics, see metrics.py) are seen by every stage."""
+
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextvars import copy_context
+from typing import Callable
+
+DEFAULT_MAX_WORKERS = 4
+
+
+def get_stage_order(stages: dict[str, tuple[Callable, tuple[str, ...]]]) -> list[str]:
+    """Returns stage names in an order where every stage comes after the
+    stages it depends on. Raises ValueError for unknown stages or cycles"""
+
+    for stage_name, (_, dependencies) in stages.items():
+        unknown_stages = set(dependencies) - set(stages)
+        if unknown_stages:
+            raise ValueError(f"Error: Stage '{stage_name}' depends on unknown stages "
+                             f"{sorted(unknown_stages)}!")
+
+    stage_order = []
+    remaining = dict(stages)
+
+    while remaining:
+        ready_stages = [stage_name for stage_name, (_, dependencies) in remaining.items()
+                        if set(dependencies) <= set(stage_order)]
+        if not ready_stages:
+            raise ValueError(f"Error: Stages {sorted(remaining)} have a dependency cycle!")
+
+        for stage_name in ready_stages:
+            stage_order.append(stage_name)
+            del remaining[stage_name]
+
+    return stage_order
+
+
+def run_stages(stages: dict[str, tuple[Callable, tuple[str, ...]]],
+               max_workers: int = DEFAULT_MAX_WORKERS) -> dict:
+    """Runs (function, dependencies) stages concurrently where their
+    dependencies allow. Returns the result of every stage by name"""
+
+    get_stage_order(stages)
+
+    results = {}
+    remaining = dict(stages)
+    running = {}
+    failure = None
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="etl-stage") as executor:
+        while remaining or running:
+            if failure is None:
+                for stage_name, (function, dependencies) in list(remaining.items()):
+                    if all(dependency in results for dependency in dependencies):
+                        stage_run = executor.submit(copy_context().run, function,
+                                                    **{dependency: results[dependency]
+                                                       for dependency in dependencies})
+                        running[stage_run] = stage_name
+                        del remaining[stage_name]
+
+            if not running:
+                break
+
+            finished_runs, _ = wait(running, return_when=FIRST_COMPLETED)
+
+            for stage_run in finished_runs:
+                stage_name = running.pop(stage_run)
+                try:
+                    results[stage_name] = stage_run.result()
+                except Exception as exc:
+                    failure = failure or (stage_name, exc)
+
+    if failure:
+        raise ChildProcessError(f"Error: Stage '{failure[0]}' failed!") from failure[1]
+
+    return results
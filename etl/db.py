@@ -0,0 +1,266 @@
+"""Database connection configuration shared by the extract, load and main scripts"""
+
+import sqlite3
+from collections import OrderedDict
+from contextlib import contextmanager
+from queue import LifoQueue, Empty
+from sqlite3 import Connection, Cursor, DatabaseError
+from threading import Lock, RLock
+
+# High throughput profile for the ETL writer. WAL lets readers (the frontend)
+# keep reading while the ETL writes, and synchronous=NORMAL only syncs on
+# checkpoints which is still crash safe in WAL mode.
+WRITE_PROFILE = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY"
+}
+
+READ_PROFILE = {
+    "cache_size": -16384,
+    "mmap_size": 268435456,
+    "temp_store": "MEMORY",
+    "query_only": "ON"
+}
+
+PROFILES = {"write": WRITE_PROFILE, "read": READ_PROFILE}
+
+DEFAULT_READERS = 2
+
+DEFAULT_CACHED_STATEMENTS = 256
+
+
+def get_connection_pragmas(config_env, profile: str = "write") -> dict:
+    """Returns pragmas for a profile with any overrides from the config
+    (e.g. db_cache_size, db_mmap_size)"""
+
+    if profile not in PROFILES:
+        raise ValueError(f"Error: Unknown connection profile '{profile}'!")
+
+    pragmas = dict(PROFILES[profile])
+
+    for pragma in pragmas:
+        if config_env.get(f"db_{pragma}"):
+            pragmas[pragma] = config_env[f"db_{pragma}"]
+
+    return pragmas
+
+
+def apply_pragmas(db_conn: Connection, pragmas: dict) -> None:
+    """Applies pragmas to a database connection"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        for pragma, value in pragmas.items():
+            cur.execute(f"PRAGMA {pragma} = {value};")
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to configure database connection!") from exc
+
+    finally:
+        cur.close()
+
+
+@contextmanager
+def transaction(db_conn: Connection):
+    """Runs the enclosed statements in one explicit transaction,
+    joining the current transaction if one is already open"""
+
+    if db_conn.in_transaction:
+        yield db_conn
+        return
+
+    db_conn.execute("BEGIN IMMEDIATE;")
+
+    try:
+        yield db_conn
+
+    except Exception:
+        db_conn.rollback()
+        raise
+
+    db_conn.commit()
+
+
+@contextmanager
+def savepoint(db_conn: Connection, name: str):
+    """Runs the enclosed statements in a savepoint of the open transaction.
+    On error only the savepoint's statements are rolled back"""
+
+    db_conn.execute(f"SAVEPOINT {name};")
+
+    try:
+        yield db_conn
+
+    except Exception:
+        db_conn.execute(f"ROLLBACK TO SAVEPOINT {name};")
+        db_conn.execute(f"RELEASE SAVEPOINT {name};")
+        raise
+
+    db_conn.execute(f"RELEASE SAVEPOINT {name};")
+
+
+class StatementTrackingCursor(Cursor):
+    """Cursor that records each statement it runs on its connection's statement cache"""
+
+    def execute(self, sql, parameters=()):
+        self.connection.record_statement(sql)
+        return super().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        self.connection.record_statement(sql)
+        return super().executemany(sql, seq_of_parameters)
+
+
+class ManagedConnection(Connection):
+    """Connection handed out by the ConnectionManager.
+
+    sqlite3 keeps an LRU cache of prepared statements (cached_statements) per
+    connection but does not expose it, so the same LRU is mirrored here to
+    report statement cache hits and misses. Cursors are always created as
+    StatementTrackingCursors so statements run through them are counted"""
+
+    def __init__(self, *args, cached_statements: int = DEFAULT_CACHED_STATEMENTS, **kwargs):
+        super().__init__(*args, cached_statements=cached_statements, **kwargs)
+        self.cached_statements = cached_statements
+        self.statement_cache = OrderedDict()
+        self.statement_cache_hits = 0
+        self.statement_cache_misses = 0
+
+    def record_statement(self, sql: str) -> None:
+        """Records a statement run on the connection as a cache hit or miss"""
+
+        if sql in self.statement_cache:
+            self.statement_cache.move_to_end(sql)
+            self.statement_cache_hits += 1
+            return
+
+        self.statement_cache_misses += 1
+        self.statement_cache[sql] = True
+        if len(self.statement_cache) > self.cached_statements:
+            self.statement_cache.popitem(last=False)
+
+    def cursor(self, factory=StatementTrackingCursor):
+        if factory is Cursor:
+            factory = StatementTrackingCursor
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class ConnectionManager:
+    """Owns the configured sqlite3 connections used by the ETL:
+    one writer (shared under a lock) and a small pool of readers"""
+
+    def __init__(self, config_env, readers: int = DEFAULT_READERS,
+                 cached_statements: int = DEFAULT_CACHED_STATEMENTS):
+        self.config_env = config_env
+        self.max_readers = readers
+        self.cached_statements = cached_statements
+        self._writer = None
+        self._writer_lock = RLock()
+        self._readers = LifoQueue()
+        self._all_readers = []
+        self._readers_lock = Lock()
+        self._pool_stats = {"writer_checkouts": 0, "reader_checkouts": 0,
+                            "reader_waits": 0, "connections_opened": 0}
+
+    def _connect(self, profile: str) -> ManagedConnection:
+        """Opens a new configured connection"""
+
+        try:
+            db_conn = sqlite3.connect(database=self.config_env["dbpath"],
+                                      timeout=10,
+                                      factory=ManagedConnection,
+                                      cached_statements=self.cached_statements,
+                                      check_same_thread=False)
+
+        except Exception as exc:
+            raise DatabaseError("Error: Cannot establish connection to database!") from exc
+
+        apply_pragmas(db_conn, get_connection_pragmas(self.config_env, profile))
+        self._pool_stats["connections_opened"] += 1
+
+        return db_conn
+
+    @contextmanager
+    def writer(self):
+        """Yields the writer connection, held exclusively by the caller"""
+
+        with self._writer_lock:
+            if self._writer is None:
+                self._writer = self._connect("write")
+
+            self._pool_stats["writer_checkouts"] += 1
+            yield self._writer
+
+    @contextmanager
+    def reader(self):
+        """Yields a read only connection from the pool, opening one if the
+        pool is below its size, otherwise waiting for one to be returned"""
+
+        try:
+            db_conn = self._readers.get_nowait()
+
+        except Empty:
+            with self._readers_lock:
+                open_reader = len(self._all_readers) < self.max_readers
+                if open_reader:
+                    db_conn = self._connect("read")
+                    self._all_readers.append(db_conn)
+
+            if not open_reader:
+                self._pool_stats["reader_waits"] += 1
+                db_conn = self._readers.get()
+
+        self._pool_stats["reader_checkouts"] += 1
+
+        try:
+            yield db_conn
+
+        finally:
+            if db_conn.in_transaction:
+                db_conn.rollback()
+            self._readers.put(db_conn)
+
+    @contextmanager
+    def transaction(self):
+        """Yields the writer connection inside one explicit transaction"""
+
+        with self.writer() as db_conn, transaction(db_conn):
+            yield db_conn
+
+    def stats(self) -> dict:
+        """Returns pool and statement cache statistics"""
+
+        connections = self._all_readers + ([self._writer] if self._writer else [])
+        hits = sum(db_conn.statement_cache_hits for db_conn in connections)
+        misses = sum(db_conn.statement_cache_misses for db_conn in connections)
+
+        return {**self._pool_stats,
+                "readers_open": len(self._all_readers),
+                "readers_idle": self._readers.qsize(),
+                "statement_cache_hits": hits,
+                "statement_cache_misses": misses,
+                "statement_cache_hit_rate": round(hits / (hits + misses), 4)
+                                            if hits + misses else 0.0}
+
+    def close(self) -> None:
+        """Closes every connection owned by the manager"""
+
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+        with self._readers_lock:
+            for db_conn in self._all_readers:
+                db_conn.close()
+            self._all_readers = []
+            self._readers = LifoQueue()
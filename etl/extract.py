@@ -1,12 +1,65 @@
 """Extract script to extract data from brawl API and database"""
 
 from os import environ
-import sqlite3
 from sqlite3 import Connection, Cursor, DatabaseError
 
 import requests
 import pandas as pd
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from db import ConnectionManager
+from metrics import record_api_response
+
+API_MAX_RETRIES = 3
+
+# Connections kept alive per host (the requests default)
+DEFAULT_API_POOL_SIZE = 10
+
+
+def get_api_adapter(pool_maxsize: int = DEFAULT_API_POOL_SIZE) -> HTTPAdapter:
+    """Returns the API's HTTPS adapter keeping up to pool_maxsize connections alive.
+    Rate limited and server error responses are retried with backoff, the last
+    response is still returned when every retry fails"""
+
+    return HTTPAdapter(pool_maxsize=pool_maxsize, max_retries=Retry(
+        total=API_MAX_RETRIES, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+        raise_on_status=False))
+
+
+# Shared so the HTTPS connection to the API is kept alive and reused
+# between requests (and between runs of the scheduler daemon). API calls,
+# bytes and retries are counted in the current ETL stage's metrics (see metrics.py)
+API_SESSION = requests.Session()
+API_SESSION.mount("https://", get_api_adapter())
+API_SESSION.hooks["response"].append(record_api_response)
+
+
+def size_api_session_pool(pool_maxsize: int) -> None:
+    """Grows the API session's connection pool to pool_maxsize, so each of
+    that many concurrent requests keeps its connection alive (call before
+    the requests start, the pool is replaced)"""
+
+    if (API_SESSION.get_adapter("https://").poolmanager.connection_pool_kw["maxsize"]
+            < pool_maxsize):
+        API_SESSION.mount("https://", get_api_adapter(pool_maxsize))
+
+PLAYER_SNAPSHOT_KEYS = ("exp_level", "exp_points", "trophies", "highest_trophies",
+                        "3vs3_victories", "solo_victories", "duo_victories")
+
+# Snapshot key -> (raw snapshot table, primary key column, value column)
+PLAYER_SNAPSHOT_COLUMNS = {"exp_level": ("player_exp", "player_exp_id", "exp_level"),
+                           "exp_points": ("player_exp", "player_exp_id", "exp_points"),
+                           "trophies": ("player_trophies", "player_trophies_id", "trophies"),
+                           "highest_trophies": ("player_trophies", "player_trophies_id",
+                                                "highest_trophies"),
+                           "3vs3_victories": ("player_victories", "player_victories_id",
+                                              "_3vs3_victories"),
+                           "solo_victories": ("player_victories", "player_victories_id",
+                                              "solo_victories"),
+                           "duo_victories": ("player_victories", "player_victories_id",
+                                             "duo_victories")}
 
 
 ## Non extraction functions
@@ -40,46 +93,25 @@ def check_player_tag(player_tag: str) -> bool:
 
 
 ## Database Extraction
-def get_db_connection(config_env) -> Connection:
-    """Establishes connection with the sqlite3 database"""
-
-    try:
-        db_connection = sqlite3.connect(database = config_env["dbpath"],
-                                        timeout = 10)
-
-    except Exception as exc:
-        raise DatabaseError("Error: Cannot establish connection to database!") from exc
-
-    return db_connection
-
-
 def get_starpowers_latest_version(db_connection: Connection) -> pd.DataFrame:
     """Get lastest version of all starpowers from database"""
 
 
+    cur = db_connection.cursor(factory=Cursor)
     try:
-        cur = db_connection.cursor(factory=Cursor)
         cur.execute("""
-           WITH latest_starpowers AS (
-              SELECT 
-                *,
-                ROW_NUMBER() OVER (PARTITION BY starpower_id ORDER BY starpower_version DESC) rn
-                FROM starpower
-            )
-            SELECT 
-              lsp.starpower_id, lsp.starpower_version, lsp.starpower_name,
-                b.brawler_id, b.brawler_name
-            FROM latest_starpowers lsp
-            INNER JOIN brawler b
-            ON lsp.brawler_id = b.brawler_id AND lsp.brawler_version = b.brawler_version
-            WHERE rn = 1
-            ORDER BY lsp.starpower_id;""")
+            SELECT brawler_id, brawler_name, starpower_id, starpower_version, starpower_name
+            FROM starpower_current
+            ORDER BY starpower_id;""")
 
         starpowers_latest_version = cur.fetchall()
 
     except Exception as exc:
         raise DatabaseError("Error: Unable to retrieve data from database!") from exc
 
+    finally:
+        cur.close()
+
     starpowers_latest_version_df = pd.DataFrame(data=starpowers_latest_version,
                                                 columns=("brawler_id", "brawler_name",
                                                          "starpower_id", "starpower_version", 
@@ -91,29 +123,21 @@ def get_starpowers_latest_version(db_connection: Connection) -> pd.DataFrame:
 def get_gadgets_latest_version(db_connection: Connection) -> pd.DataFrame:
     """Get latest version of all gadgets from database"""
 
+    cur = db_connection.cursor(factory=Cursor)
     try:
-        cur = db_connection.cursor(factory=Cursor)
         cur.execute("""
-           WITH latest_gadgets AS (
-              SELECT 
-                *,
-                ROW_NUMBER() OVER (PARTITION BY gadget_id ORDER BY gadget_version DESC) rn
-                FROM gadget
-            )
-            SELECT 
-              lg.gadget_id, lg.gadget_version, lg.gadget_name,
-                b.brawler_id, b.brawler_name
-            FROM latest_gadgets lg
-            INNER JOIN brawler b
-            ON lg.brawler_id = b.brawler_id AND lg.brawler_version = b.brawler_version
-            WHERE rn = 1
-            ORDER BY lg.gadget_id;""")
+            SELECT brawler_id, brawler_name, gadget_id, gadget_version, gadget_name
+            FROM gadget_current
+            ORDER BY gadget_id;""")
 
         gadgets_latest_version = cur.fetchall()
 
     except Exception as exc:
         raise DatabaseError("Error: Unable to retrieve data from database!") from exc
 
+    finally:
+        cur.close()
+
     gadgets_latest_version_df = pd.DataFrame(data=gadgets_latest_version,
                                              columns=("brawler_id", "brawler_name",
                                                       "gadget_id", "gadget_version",
@@ -125,16 +149,11 @@ def get_gadgets_latest_version(db_connection: Connection) -> pd.DataFrame:
 def get_brawlers_latest_version(db_connection: Connection) -> pd.DataFrame:
     """Get latest version of all brawlers from database"""
 
+    cur = db_connection.cursor(factory=Cursor)
     try:
-        cur = db_connection.cursor(factory=Cursor)
         cur.execute("""
-            WITH latest_brawlers AS (
-              SELECT *, ROW_NUMBER() OVER (PARTITION BY brawler_id ORDER BY brawler_version DESC) rn
-              FROM brawler
-            )
-            SELECT lb.brawler_id, lb.brawler_name
-            FROM latest_brawlers lb
-            WHERE rn = 1
+            SELECT brawler_id, brawler_name
+            FROM brawler_current
             ORDER BY brawler_id;""")
 
         brawlers_latest_version = cur.fetchall()
@@ -142,6 +161,9 @@ def get_brawlers_latest_version(db_connection: Connection) -> pd.DataFrame:
     except Exception as exc:
         raise DatabaseError("Error: Unable to retrieve data from database!") from exc
 
+    finally:
+        cur.close()
+
     brawlers_latest_version_df = pd.DataFrame(data=brawlers_latest_version,
                                                columns=("brawler_id", "brawler_name"))
     return brawlers_latest_version_df
@@ -150,23 +172,21 @@ def get_brawlers_latest_version(db_connection: Connection) -> pd.DataFrame:
 def get_events_latest_version(db_connection: Connection) -> pd.DataFrame:
     """Get latest version of all events from the database"""
 
+    cur = db_connection.cursor(factory=Cursor)
     try:
-        cur = db_connection.cursor(factory=Cursor)
         cur.execute("""
-            WITH latest_events AS (
-              SELECT *, ROW_NUMBER() OVER (PARTITION BY bs_event_id ORDER BY bs_event_version DESC) rn
-              FROM bs_event
-            )
-            SELECT le.bs_event_id, le.bs_event_version, le.mode, le.map
-            FROM latest_events le
-            WHERE rn = 1
-            ORDER BY le.bs_event_id;""")
+            SELECT bs_event_id, bs_event_version, mode, map
+            FROM bs_event_current
+            ORDER BY bs_event_id;""")
 
         event_data_latest_version = cur.fetchall()
 
     except Exception as exc:
         raise DatabaseError("Error: Cannot retrieve event data from database!") from exc
 
+    finally:
+        cur.close()
+
     event_data_latest_version_df = pd.DataFrame(data=event_data_latest_version,
                                                 columns=("bs_event_id", "bs_event_version",
                                                          "mode", "map")).rename(columns={
@@ -182,73 +202,84 @@ def get_brawler_latest_version_id(db_connection: Connection, brawler_id: int) ->
     if not isinstance(brawler_id, int):
         raise TypeError("Error: Brawler ID is not an integer!")
 
+    cur = db_connection.cursor(factory=Cursor)
     try:
-        cur = db_connection.cursor(factory=Cursor)
         cur.execute("""
-            SELECT MAX(brawler_version)
-            FROM brawler
+            SELECT brawler_version
+            FROM brawler_current
             WHERE brawler_id = ?;""",[brawler_id])
 
-        brawler_latest_version = cur.fetchone()[0]
+        brawler_latest_version = (cur.fetchone() or [0])[0]
 
     except Exception as exc:
         raise DatabaseError("Error: Unable to retrieve data from database!") from exc
 
+    finally:
+        cur.close()
+
     if not brawler_latest_version:
         return 0
 
     return brawler_latest_version
 
 
-#TODO fix this
-def get_most_recent_battle_log_time(db_connection: Connection, player_tag: str):
+def get_most_recent_battle_log_time(db_connection: Connection, player_tag: str) -> str:
     """Returns most recent battle log time for a 
     given player tag from the database"""
 
-    with db_connection.cursor(factory=Cursor) as cur:
-        try:
-            cur.execute("""SELECT MAX(battle_time) AS most_recent_battle_time
-                        FROM battle
-                        WHERE player_tag = %s
-                        LIMIT 1;""", [player_tag])
+    cur = db_connection.cursor(factory=Cursor)
+    try:
+        cur.execute("""SELECT MAX(battle_time) AS most_recent_battle_time
+                    FROM battle
+                    WHERE player_tag = ?;""", [player_tag])
 
-        except Exception as exc:
-            raise DatabaseError("Error: Unable to retrieve data from database!") from exc
-        else:
-            most_recent_battle_log_time = cur.fetchone()
-            return most_recent_battle_log_time["most_recent_battle_time"]
+        most_recent_battle_log_time = cur.fetchone()[0]
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    return most_recent_battle_log_time
 
 
 def get_distinct_battle_types(db_connection: Connection) -> list[str]:
     """Returns distinct battle types from the database"""
 
-    with db_connection.cursor() as cur:
-        try:
-            cur.execute("""SELECT DISTINCT battle_type_name
-                        FROM battle_type;""")
+    cur = db_connection.cursor(factory=Cursor)
+    try:
+        cur.execute("""SELECT DISTINCT battle_type_name
+                    FROM battle_type;""")
+
+        battle_types = cur.fetchall()
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
 
-        except Exception as exc:
-            raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+    finally:
+        cur.close()
 
-        else:
-            battle_types = cur.fetchall()
-            return battle_types
+    return [battle_type[0] for battle_type in battle_types]
 
 
 def get_distinct_event_ids(db_connection: Connection) -> list[int]:
     """Returns distinct event ids from the database"""
 
-    with db_connection.cursor() as cur:
-        try:
-            cur.execute("""SELECT DISTINCT bs_event_id
-                        FROM bs_event;""")
+    cur = db_connection.cursor(factory=Cursor)
+    try:
+        cur.execute("""SELECT bs_event_id
+                    FROM bs_event_current;""")
+
+        bs_event_ids = cur.fetchall()
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
 
-        except Exception as exc:
-            raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+    finally:
+        cur.close()
 
-        else:
-            bs_event_ids = cur.fetchall()
-            return bs_event_ids
+    return [bs_event_id[0] for bs_event_id in bs_event_ids]
 
 
 def extract_brawler_data_database(config_env) -> list[dict]:
@@ -263,18 +294,21 @@ def get_starpower_latest_version_id(db_connection: Connection, starpower_id: int
     if not isinstance(starpower_id, int):
         raise TypeError("Error: StarpowerID is not an integer!")
 
+    cur = db_connection.cursor(factory=Cursor)
     try:
-        cur = db_connection.cursor(factory=Cursor)
         cur.execute("""
-            SELECT MAX(starpower_version)
-            FROM starpower
+            SELECT starpower_version
+            FROM starpower_current
             WHERE starpower_id = ?;""",[starpower_id])
 
-        starpower_latest_version_id = cur.fetchone()[0]
+        starpower_latest_version_id = (cur.fetchone() or [0])[0]
 
     except Exception as exc:
         raise DatabaseError("Error: Unable to retrieve data from database!") from exc
 
+    finally:
+        cur.close()
+
     if not starpower_latest_version_id:
         return 0
     return starpower_latest_version_id
@@ -286,17 +320,20 @@ def get_gadget_latest_version_id(db_connection: Connection, gadget_id: int) -> i
     if not isinstance(gadget_id, int):
         raise TypeError("Error: Gadget ID is not an integer!")
 
+    cur = db_connection.cursor(factory=Cursor)
     try:
-        cur = db_connection.cursor(factory=Cursor)
         cur.execute("""
-            SELECT MAX(gadget_version)
-            FROM gadget
+            SELECT gadget_version
+            FROM gadget_current
             WHERE gadget_id = ?;""", [gadget_id])
-        gadget_latest_version_id = cur.fetchone()[0]
+        gadget_latest_version_id = (cur.fetchone() or [0])[0]
 
     except Exception as exc:
         raise DatabaseError("Error: Unable to retrieve data from database!") from exc
 
+    finally:
+        cur.close()
+
     if not gadget_latest_version_id:
         return 0
 
@@ -306,8 +343,8 @@ def get_gadget_latest_version_id(db_connection: Connection, gadget_id: int) -> i
 def get_player_id(db_connection: Connection, player_data: dict) -> int:
     """Get player ID from database given the player data received from the API"""
 
+    cur = db_connection.cursor(factory=Cursor)
     try:
-        cur = db_connection.cursor(factory=Cursor)
         cur.execute("""
             SELECT player_id
             FROM player
@@ -329,6 +366,84 @@ def get_player_id(db_connection: Connection, player_data: dict) -> int:
     return player_id[0]
 
 
+def get_player_latest_snapshot(db_connection: Connection, player_id: int,
+                               snapshot_cache: dict = None) -> dict:
+    """Returns the last stored exp, trophies and victories of a player
+    (values are None if nothing is stored). Results are kept in
+    snapshot_cache (keyed by player ID) for the rest of the run"""
+
+    if snapshot_cache is not None and player_id in snapshot_cache:
+        return snapshot_cache[player_id]
+
+    cur = db_connection.cursor(factory=Cursor)
+    try:
+        cur.execute("""
+            SELECT
+              (SELECT exp_level FROM player_exp WHERE player_id = :player_id
+               ORDER BY created_at DESC, player_exp_id DESC LIMIT 1),
+              (SELECT exp_points FROM player_exp WHERE player_id = :player_id
+               ORDER BY created_at DESC, player_exp_id DESC LIMIT 1),
+              (SELECT trophies FROM player_trophies WHERE player_id = :player_id
+               ORDER BY created_at DESC, player_trophies_id DESC LIMIT 1),
+              (SELECT highest_trophies FROM player_trophies WHERE player_id = :player_id
+               ORDER BY created_at DESC, player_trophies_id DESC LIMIT 1),
+              (SELECT _3vs3_victories FROM player_victories WHERE player_id = :player_id
+               ORDER BY created_at DESC, player_victories_id DESC LIMIT 1),
+              (SELECT solo_victories FROM player_victories WHERE player_id = :player_id
+               ORDER BY created_at DESC, player_victories_id DESC LIMIT 1),
+              (SELECT duo_victories FROM player_victories WHERE player_id = :player_id
+               ORDER BY created_at DESC, player_victories_id DESC LIMIT 1);""",
+                    {"player_id": player_id})
+
+        player_snapshot = cur.fetchone()
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    player_snapshot = dict(zip(PLAYER_SNAPSHOT_KEYS, player_snapshot))
+
+    if snapshot_cache is not None:
+        snapshot_cache[player_id] = player_snapshot
+
+    return player_snapshot
+
+
+def get_player_snapshot_at(db_connection: Connection, player_id: int, timestamp: str) -> dict:
+    """Returns the exp, trophies and victories of a player at a timestamp.
+    Snapshots are only stored when a value changes, so the value at a
+    timestamp is the last row stored at or before it. Raw rows older than the
+    retention period are compacted (see rollup.py), so those values are read
+    from the hourly rollups instead, as the last value of the hour"""
+
+    snapshot_values = ",\n".join(
+        f"""COALESCE((SELECT {value_column} FROM {table}
+                        WHERE player_id = :player_id AND created_at <= :timestamp
+                        ORDER BY created_at DESC, {id_column} DESC LIMIT 1),
+                       (SELECT last_value FROM player_stat_rollup
+                        WHERE player_id = :player_id AND stat_name = '{key}'
+                        AND granularity = 'hour' AND bucket_start <= :timestamp
+                        ORDER BY bucket_start DESC LIMIT 1))"""
+        for key, (table, id_column, value_column) in PLAYER_SNAPSHOT_COLUMNS.items())
+
+    cur = db_connection.cursor(factory=Cursor)
+    try:
+        cur.execute(f"SELECT {snapshot_values};",
+                    {"player_id": player_id, "timestamp": timestamp})
+
+        player_snapshot = cur.fetchone()
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    return dict(zip(PLAYER_SNAPSHOT_COLUMNS, player_snapshot))
+
+
 ## API Extraction
 def get_api_header(api_token: str) -> dict:
     """Returns api header data"""
@@ -345,8 +460,8 @@ def get_all_brawler_data(api_header_data: dict) -> list[dict]:
     """Returns all brawler data"""
 
     try:
-        response = requests.get("https://api.brawlstars.com/v1/brawlers",
-                                headers=api_header_data, timeout=5)
+        response = API_SESSION.get("https://api.brawlstars.com/v1/brawlers",
+                                   headers=api_header_data, timeout=5)
         response_data = response.json()
 
     except Exception as exc:
@@ -366,7 +481,7 @@ def get_api_player_data(api_token: str, player_tag: str) -> dict:
         raise ValueError("Error: Player tag is invlaid!")
 
     try:
-        response = requests.get(f"https://api.brawlstars.com/v1/players/%23{player_tag}",
+        response = API_SESSION.get(f"https://api.brawlstars.com/v1/players/%23{player_tag}",
                           headers=api_header_data, timeout=5)
         response_data = response.json()
 
@@ -386,8 +501,9 @@ def get_api_player_battle_log(api_token: str, player_tag: str) -> dict:
         raise ValueError("Error: Player tag is invlaid!")
 
     try:
-        response = requests.get(f"https://api.brawlstars.com/v1/players/%23{player_tag}/battlelog",
-                          headers=api_header_data, timeout=5)
+        response = API_SESSION.get(
+            f"https://api.brawlstars.com/v1/players/%23{player_tag}/battlelog",
+            headers=api_header_data, timeout=5)
         response_data = response.json()
 
     except Exception as exc:
@@ -400,7 +516,7 @@ def get_api_event_rotation_data(api_header_data: str) -> dict:
     """Sends get request to brawl stars api for event rotation data"""
 
     try:
-        response = requests.get("https://api.brawlstars.com/v1/events/rotation",
+        response = API_SESSION.get("https://api.brawlstars.com/v1/events/rotation",
                     headers=api_header_data, timeout=5)
         response_data = response.json()
 
@@ -437,8 +553,7 @@ def extract_player_data_api(config_env: dict, player_tag: str) -> list[dict]:
     """Extracts brawler data by get request to the brawl API"""
 
     token = config_env["api_token"]
-    api_header_data = get_api_header(token)
-    all_player_data = get_api_player_data(api_header_data, player_tag)
+    all_player_data = get_api_player_data(token, player_tag)
 
     return all_player_data
 
@@ -448,8 +563,7 @@ def extract_player_battle_log_api(config_env: dict, player_tag: str) -> list[dic
     """Extracts brawler data by get request to the brawl API"""
 
     token = config_env["api_token"]
-    api_header_data = get_api_header(token)
-    all_player_data = get_api_player_battle_log(api_header_data, player_tag)
+    all_player_data = get_api_player_battle_log(token, player_tag)
 
     return all_player_data
 
@@ -460,21 +574,21 @@ if __name__ =="__main__":
 
     config = environ
 
-    conn = get_db_connection(config)
+    db_manager = ConnectionManager(config)
 
     # Extract - Brawler data database
-    brawlers_db_df = get_brawlers_latest_version(conn)
-    starpowers_db_df = get_starpowers_latest_version(conn)
-    gadgets_db_df = get_gadgets_latest_version(conn)
-    events_db_df = get_events_latest_version(conn)
+    with db_manager.reader() as conn:
+        brawlers_db_df = get_brawlers_latest_version(conn)
+        starpowers_db_df = get_starpowers_latest_version(conn)
+        gadgets_db_df = get_gadgets_latest_version(conn)
+        events_db_df = get_events_latest_version(conn)
 
     # Extract - Brawler data api
-    api_header = get_api_header(config["api_token"])
     bs_player_tag  = config["player_tag"]
 
     brawler_data_api = extract_brawler_data_api(config)
 
-    player_data = get_api_player_data(api_header, bs_player_tag)
-    player_battle_log = get_api_player_battle_log(api_header, bs_player_tag)
+    player_data = get_api_player_data(config["api_token"], bs_player_tag)
+    player_battle_log = get_api_player_battle_log(config["api_token"], bs_player_tag)
 
-    conn.close()
+    db_manager.close()
@@ -0,0 +1,362 @@
+"""Job queue for running the roster ETL on many worker processes
+
+Jobs are rows of job_queue, one per job type and key. A roster player job
+fetches, transforms and loads one player (see roster.py). Workers on one
+machine, or on several sharing the database, claim a batch of pending jobs
+in one write transaction, so no two workers hold the same job. Claimed
+jobs are leased to the worker for job_lease_seconds and the worker's
+heartbeat extends the lease while it works on them.
+
+A worker that dies stops its heartbeat, so its leases expire and the jobs
+are claimed again by another worker, up to job_max_attempts attempts. Only
+the worker holding a job's lease can complete or fail it, so a worker that
+finishes after its lease was taken over does not change the job (the
+roster load skips battles already stored, so loading a player twice is
+harmless).
+
+Usage: python ./etl/job_queue.py [enqueue|work|status] [player tags|worker processes]"""
+
+import os
+import sys
+import socket
+from os import environ
+from datetime import datetime as dt, timedelta
+from multiprocessing import Process
+from sqlite3 import Connection, Cursor, DatabaseError
+from threading import Event, Thread
+
+from dotenv import load_dotenv
+
+from db import ConnectionManager, transaction
+from shard import ShardRouter, get_shard_count
+from extract import format_player_tag
+from polling import get_utc_now, POLL_TIME_FORMAT
+from roster import etl_roster, get_roster_player_tags
+from metrics import run_with_metrics
+
+ROSTER_JOB_TYPE = "roster_player"
+
+DEFAULT_JOB_BATCH_SIZE = 50
+
+DEFAULT_LEASE_SECONDS = 300
+
+DEFAULT_MAX_ATTEMPTS = 3
+
+DEFAULT_POLL_SECONDS = 5
+
+
+def get_worker_id() -> str:
+    """Returns an id for this worker process, unique across machines"""
+
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def enqueue_jobs(db_conn: Connection, job_type: str, job_keys: list[str]) -> None:
+    """Adds jobs as pending. Jobs already pending or leased are left as they
+    are and finished jobs are queued again"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""INSERT INTO job_queue (job_type, job_key)
+                        VALUES (?, ?)
+                        ON CONFLICT (job_type, job_key) DO UPDATE SET
+                          job_status = 'pending',
+                          attempts = 0,
+                          worker_id = NULL,
+                          lease_expires_at = NULL,
+                          last_error = NULL,
+                          last_updated = datetime('now')
+                        WHERE job_queue.job_status IN ('done', 'failed');""",
+                        [(job_type, job_key) for job_key in job_keys])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert job data!") from exc
+
+    finally:
+        cur.close()
+
+
+def claim_jobs(db_conn: Connection, job_type: str, worker_id: str, limit: int,
+               lease_seconds: float = DEFAULT_LEASE_SECONDS,
+               max_attempts: int = DEFAULT_MAX_ATTEMPTS, now: dt = None) -> dict[int, str]:
+    """Leases up to limit pending jobs (or jobs whose lease has expired) to
+    the worker, oldest first, in one write transaction. Returns the key of
+    each job claimed by job id"""
+
+    now = now or get_utc_now()
+    lease_expires_at = (now + timedelta(seconds=lease_seconds)).strftime(POLL_TIME_FORMAT)
+    now = now.strftime(POLL_TIME_FORMAT)
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+
+        with transaction(db_conn):
+            # Jobs whose worker died on their last attempt are not claimed again
+            cur.execute("""UPDATE job_queue
+                        SET job_status = 'failed',
+                          last_error = 'Lease expired',
+                          last_updated = datetime('now')
+                        WHERE job_type = ?
+                        AND job_status = 'leased'
+                        AND lease_expires_at < ?
+                        AND attempts >= ?;""", [job_type, now, max_attempts])
+
+            cur.execute("""SELECT job_id, job_key
+                        FROM job_queue
+                        WHERE job_type = ?
+                        AND (job_status = 'pending'
+                          OR (job_status = 'leased' AND lease_expires_at < ?))
+                        ORDER BY job_id
+                        LIMIT ?;""", [job_type, now, limit])
+            claimed_jobs = dict(cur.fetchall())
+
+            cur.executemany("""UPDATE job_queue
+                            SET job_status = 'leased',
+                              attempts = attempts + 1,
+                              worker_id = ?,
+                              lease_expires_at = ?,
+                              last_updated = datetime('now')
+                            WHERE job_id = ?;""",
+                            [(worker_id, lease_expires_at, job_id) for job_id in claimed_jobs])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to claim jobs!") from exc
+
+    finally:
+        cur.close()
+
+    return claimed_jobs
+
+
+def extend_leases(db_conn: Connection, worker_id: str, job_ids: list[int],
+                  lease_seconds: float = DEFAULT_LEASE_SECONDS, now: dt = None) -> int:
+    """Extends the worker's leases of the jobs. Returns the number of jobs
+    the worker still holds"""
+
+    now = now or get_utc_now()
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""UPDATE job_queue
+                        SET lease_expires_at = ?,
+                          last_updated = datetime('now')
+                        WHERE job_id = ?
+                        AND worker_id = ?
+                        AND job_status = 'leased';""",
+                        [((now + timedelta(seconds=lease_seconds)).strftime(POLL_TIME_FORMAT),
+                          job_id, worker_id) for job_id in job_ids])
+
+        return cur.rowcount
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to update job data!") from exc
+
+    finally:
+        cur.close()
+
+
+def complete_jobs(db_conn: Connection, worker_id: str, job_ids: list[int]) -> int:
+    """Marks the worker's leased jobs as done. Jobs the worker no longer
+    holds are left as they are. Returns the number of jobs completed"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""UPDATE job_queue
+                        SET job_status = 'done',
+                          lease_expires_at = NULL,
+                          last_error = NULL,
+                          last_updated = datetime('now')
+                        WHERE job_id = ?
+                        AND worker_id = ?
+                        AND job_status = 'leased';""",
+                        [(job_id, worker_id) for job_id in job_ids])
+
+        return cur.rowcount
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to update job data!") from exc
+
+    finally:
+        cur.close()
+
+
+def fail_jobs(db_conn: Connection, worker_id: str, job_errors: dict[int, str],
+              max_attempts: int = DEFAULT_MAX_ATTEMPTS) -> int:
+    """Returns the worker's leased jobs to pending with their error, or marks
+    them failed after max_attempts. Returns the number of jobs updated"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""UPDATE job_queue
+                        SET job_status = CASE WHEN attempts >= ? THEN 'failed'
+                                              ELSE 'pending' END,
+                          lease_expires_at = NULL,
+                          last_error = ?,
+                          last_updated = datetime('now')
+                        WHERE job_id = ?
+                        AND worker_id = ?
+                        AND job_status = 'leased';""",
+                        [(max_attempts, job_error, job_id, worker_id)
+                         for job_id, job_error in job_errors.items()])
+
+        return cur.rowcount
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to update job data!") from exc
+
+    finally:
+        cur.close()
+
+
+def get_job_counts(db_conn: Connection, job_type: str) -> dict[str, int]:
+    """Returns the number of jobs of a type in each status"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""SELECT job_status, COUNT(*)
+                    FROM job_queue
+                    WHERE job_type = ?
+                    GROUP BY job_status;""", [job_type])
+
+        job_counts = dict(cur.fetchall())
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    return job_counts
+
+
+class LeaseHeartbeat:
+    """Extends a worker's leases every third of the lease on a background
+    thread while the worker works on its jobs. The heartbeat writes on its
+    own connection, as the worker's writer is held for whole roster loads"""
+
+    def __init__(self, db_manager: ConnectionManager, worker_id: str, job_ids: list[int],
+                 lease_seconds: float = DEFAULT_LEASE_SECONDS):
+        self.db_manager = ConnectionManager(db_manager.config_env, readers=0)
+        self.worker_id = worker_id
+        self.job_ids = job_ids
+        self.lease_seconds = lease_seconds
+        self.stop_event = Event()
+        self.thread = Thread(target=self._run, name="job-heartbeat", daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop_event.set()
+        self.thread.join()
+        self.db_manager.close()
+
+    def _run(self) -> None:
+        while not self.stop_event.wait(self.lease_seconds / 3):
+            # A missed beat is retried on the next, before the lease expires
+            try:
+                with self.db_manager.transaction() as db_conn:
+                    extend_leases(db_conn, self.worker_id, self.job_ids, self.lease_seconds)
+            except DatabaseError as exc:
+                print(f"Lease heartbeat of {self.worker_id} failed at {dt.now()}. {exc}")
+
+
+def run_worker(db_manager: ConnectionManager, config_parameters: dict,
+               shard_router: ShardRouter = None, worker_id: str = None,
+               stop_event: Event = None) -> dict:
+    """Claims and runs batches of roster player jobs until the queue is empty
+    (or, given stop_event, until it is set, waiting for new jobs when the
+    queue is empty). Returns the jobs completed and failed by the worker"""
+
+    worker_id = worker_id or get_worker_id()
+    batch_size = int(config_parameters.get("job_batch_size", DEFAULT_JOB_BATCH_SIZE))
+    lease_seconds = float(config_parameters.get("job_lease_seconds", DEFAULT_LEASE_SECONDS))
+    max_attempts = int(config_parameters.get("job_max_attempts", DEFAULT_MAX_ATTEMPTS))
+    poll_seconds = float(config_parameters.get("job_poll_seconds", DEFAULT_POLL_SECONDS))
+    worker_summary = {"jobs_completed": 0, "jobs_failed": 0}
+
+    while not (stop_event and stop_event.is_set()):
+        with db_manager.writer() as conn:
+            claimed_jobs = claim_jobs(conn, ROSTER_JOB_TYPE, worker_id, batch_size,
+                                      lease_seconds, max_attempts)
+
+        if not claimed_jobs:
+            if stop_event is None:
+                break
+            stop_event.wait(poll_seconds)
+            continue
+
+        job_ids = {player_tag: job_id for job_id, player_tag in claimed_jobs.items()}
+
+        try:
+            with LeaseHeartbeat(db_manager, worker_id, list(claimed_jobs), lease_seconds):
+                roster_summary = run_with_metrics(db_manager, config_parameters, "Roster ETL",
+                                                  etl_roster, db_manager, config_parameters,
+                                                  shard_router, list(claimed_jobs.values()))
+            job_errors = {job_ids[player_tag]: str(error)
+                          for player_tag, error in roster_summary["failures"].items()}
+
+        except Exception as exc:
+            job_errors = dict.fromkeys(claimed_jobs, str(exc.__cause__ or exc))
+
+        with db_manager.transaction() as conn:
+            worker_summary["jobs_completed"] += complete_jobs(
+                conn, worker_id, [job_id for job_id in claimed_jobs if job_id not in job_errors])
+            worker_summary["jobs_failed"] += fail_jobs(conn, worker_id, job_errors,
+                                                       max_attempts)
+
+    return worker_summary
+
+
+def run_worker_process(config_env) -> None:
+    """Runs a worker in its own process, with its own connections, until
+    the queue is empty"""
+
+    shard_router = ShardRouter(config_env) if get_shard_count(config_env) else None
+    db_manager = shard_router.catalogue if shard_router else ConnectionManager(config_env)
+
+    try:
+        worker_summary = run_worker(db_manager, config_env, shard_router)
+        print(f"Worker {get_worker_id()} completed {worker_summary['jobs_completed']} jobs "
+              f"and failed {worker_summary['jobs_failed']} jobs")
+
+    finally:
+        if shard_router:
+            shard_router.close()
+        else:
+            db_manager.close()
+
+
+if __name__ == "__main__":
+
+    load_dotenv()
+
+    config = dict(environ)
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "status"
+
+    if command == "work":
+        workers = [Process(target=run_worker_process, args=(config,))
+                   for _ in range(int(sys.argv[2]) if len(sys.argv) > 2 else 1)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    else:
+        # Jobs are kept in the catalogue database when storage is sharded
+        manager = ConnectionManager(config)
+
+        try:
+            if command == "enqueue":
+                with manager.transaction() as db_conn:
+                    enqueue_jobs(db_conn, ROSTER_JOB_TYPE,
+                                 [f"#{format_player_tag(player_tag)}"
+                                  for player_tag in sys.argv[2:]]
+                                 or get_roster_player_tags(db_conn))
+            with manager.reader() as db_reader:
+                print(get_job_counts(db_reader, ROSTER_JOB_TYPE))
+
+        finally:
+            manager.close()
@@ -1,24 +1,130 @@
 """Load file for loading changes into database"""
 
+import sys
 from os import environ
-import sqlite3
-from sqlite3 import Connection, Cursor, DatabaseError, Error
+from sqlite3 import Connection, Cursor, DatabaseError
 
 from dotenv import load_dotenv
 from pandas import DataFrame
 
-
-def get_db_connection(config_env) -> Connection:
-    """Establish connection with the sqlite3 database"""
-
-    try:
-        db_conn = sqlite3.connect(database=config_env["dbpath"],
-                                  timeout=10)
-
-    except Exception as exc:
-        raise Error("Error: Cannot establish connection to database!") from exc
-
-    return db_conn
+from db import ConnectionManager, transaction
+
+# Upserts keeping the <table>_current tables on the latest version, the
+# parameters are the rows inserted into the versioned table
+CURRENT_VERSION_UPSERTS = {
+    "brawler": """INSERT INTO brawler_current
+               (brawler_id, brawler_version, brawler_name)
+               VALUES (?, ?, ?)
+               ON CONFLICT (brawler_id) DO UPDATE SET
+               brawler_version = excluded.brawler_version,
+               brawler_name = excluded.brawler_name
+               WHERE excluded.brawler_version > brawler_current.brawler_version;""",
+    "starpower": """INSERT INTO starpower_current
+                 (starpower_id, starpower_version, starpower_name,
+                 brawler_id, brawler_version, brawler_name)
+                 SELECT ?, ?, ?, brawler_id, brawler_version, brawler_name
+                 FROM brawler
+                 WHERE brawler_id = ? AND brawler_version = ?
+                 ON CONFLICT (starpower_id) DO UPDATE SET
+                 starpower_version = excluded.starpower_version,
+                 starpower_name = excluded.starpower_name,
+                 brawler_id = excluded.brawler_id,
+                 brawler_version = excluded.brawler_version,
+                 brawler_name = excluded.brawler_name
+                 WHERE excluded.starpower_version > starpower_current.starpower_version;""",
+    "gadget": """INSERT INTO gadget_current
+              (gadget_id, gadget_version, gadget_name,
+              brawler_id, brawler_version, brawler_name)
+              SELECT ?, ?, ?, brawler_id, brawler_version, brawler_name
+              FROM brawler
+              WHERE brawler_id = ? AND brawler_version = ?
+              ON CONFLICT (gadget_id) DO UPDATE SET
+              gadget_version = excluded.gadget_version,
+              gadget_name = excluded.gadget_name,
+              brawler_id = excluded.brawler_id,
+              brawler_version = excluded.brawler_version,
+              brawler_name = excluded.brawler_name
+              WHERE excluded.gadget_version > gadget_current.gadget_version;""",
+    "bs_event": """INSERT INTO bs_event_current
+                (bs_event_id, bs_event_version, mode, map)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (bs_event_id) DO UPDATE SET
+                bs_event_version = excluded.bs_event_version,
+                mode = excluded.mode,
+                map = excluded.map
+                WHERE excluded.bs_event_version > bs_event_current.bs_event_version;"""}
+
+# Columns of each catalogue changes dataframe in the column order of its
+# versioned table, and the version column to increment for the new version
+# (events carry their new version already)
+CATALOGUE_CHANGE_COLUMNS = {
+    "brawler": (["brawler_id", "brawler_version", "brawler_name"], "brawler_version"),
+    "starpower": (["starpower_id", "starpower_version", "starpower_name",
+                   "brawler_id", "brawler_version"], "starpower_version"),
+    "gadget": (["gadget_id", "gadget_version", "gadget_name",
+                "brawler_id", "brawler_version"], "gadget_version"),
+    "bs_event": (["event_id", "event_version", "mode", "map"], None)}
+
+# Rebuilds a <table>_current table from the full version history
+CURRENT_VERSION_REBUILDS = {
+    "brawler": """INSERT INTO brawler_current
+               (brawler_id, brawler_version, brawler_name)
+               SELECT brawler_id, brawler_version, brawler_name
+               FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY brawler_id
+                                                  ORDER BY brawler_version DESC) rn
+                     FROM brawler)
+               WHERE rn = 1;""",
+    "starpower": """INSERT INTO starpower_current
+                 (starpower_id, starpower_version, starpower_name,
+                 brawler_id, brawler_version, brawler_name)
+                 SELECT sp.starpower_id, sp.starpower_version, sp.starpower_name,
+                 b.brawler_id, b.brawler_version, b.brawler_name
+                 FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY starpower_id
+                                                    ORDER BY starpower_version DESC) rn
+                       FROM starpower) sp
+                 INNER JOIN brawler b
+                 ON sp.brawler_id = b.brawler_id AND sp.brawler_version = b.brawler_version
+                 WHERE rn = 1;""",
+    "gadget": """INSERT INTO gadget_current
+              (gadget_id, gadget_version, gadget_name,
+              brawler_id, brawler_version, brawler_name)
+              SELECT g.gadget_id, g.gadget_version, g.gadget_name,
+              b.brawler_id, b.brawler_version, b.brawler_name
+              FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY gadget_id
+                                                 ORDER BY gadget_version DESC) rn
+                    FROM gadget) g
+              INNER JOIN brawler b
+              ON g.brawler_id = b.brawler_id AND g.brawler_version = b.brawler_version
+              WHERE rn = 1;""",
+    "bs_event": """INSERT INTO bs_event_current
+                (bs_event_id, bs_event_version, mode, map)
+                SELECT bs_event_id, bs_event_version, mode, map
+                FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY bs_event_id
+                                                   ORDER BY bs_event_version DESC) rn
+                      FROM bs_event)
+                WHERE rn = 1;"""}
+
+
+def dataframe_to_rows(data: DataFrame, columns: list[str]) -> list[tuple]:
+    """Returns dataframe as a list of tuples ordered by columns
+    (values are plain python types, missing values are None)"""
+
+    ordered_data = data[columns].astype(object)
+    ordered_data = ordered_data.where(ordered_data.notna(), None)
+
+    return list(ordered_data.itertuples(index=False, name=None))
+
+
+def get_catalogue_version_rows(table: str, changes_data: DataFrame) -> list[tuple]:
+    """Returns the rows of the new versions of a catalogue changes dataframe,
+    in the column order of the versioned table"""
+
+    columns, version_column = CATALOGUE_CHANGE_COLUMNS[table]
+
+    if version_column:
+        changes_data = changes_data.assign(**{version_column: changes_data[version_column] + 1})
+
+    return dataframe_to_rows(changes_data, columns)
 
 
 def insert_brawler_db(db_conn: Connection, brawler_data: DataFrame):
@@ -29,30 +135,38 @@ def insert_brawler_db(db_conn: Connection, brawler_data: DataFrame):
     if brawler_data.empty:
         return
 
-    for index, brawler in brawler_data.iterrows():
-        try:
-            cur = db_conn.cursor(factory=Cursor)
-            cur.execute("""INSERT INTO brawler
+    brawler_rows = get_catalogue_version_rows("brawler", brawler_data)
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""INSERT INTO brawler
                         (brawler_id, brawler_version, brawler_name)
-                        VALUES (?, ?, ?);""", [brawler["brawler_id"],
-                                                  brawler["brawler_version"] + 1,
-                                                  brawler["brawler_name"]])
+                        VALUES (?, ?, ?);""", brawler_rows)
+        cur.executemany(CURRENT_VERSION_UPSERTS["brawler"], brawler_rows)
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert brawler data!") from exc
 
-        except Exception as exc:
-            raise DatabaseError("Error: Unable to insert brawler data!") from exc
+    finally:
+        cur.close()
 
 
-def insert_new_battle_type_data(db_conn: Connection, battle_type: str):
-    """Inserts new battle type data into the database"""
+def insert_new_battle_type_data(db_conn: Connection, battle_types: list[str]):
+    """Inserts battle types that are not already in the database"""
 
-    with db_conn.cursor(factory=Cursor) as cur:
-        try:
-            cur.execute("""INSERT INTO battle_type
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""INSERT INTO battle_type
                         (battle_type_name)
-                        VALUES (%s);""",[battle_type])
+                        VALUES (?)
+                        ON CONFLICT (battle_type_name) DO NOTHING;""",
+                        [(battle_type,) for battle_type in battle_types])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert data into database!") from exc
 
-        except Exception as exc:
-            raise DatabaseError("Error: Unable to insert data into database!") from exc
+    finally:
+        cur.close()
 
 
 def insert_new_starpower_data(db_conn: Connection, starpower_data: DataFrame):
@@ -63,20 +177,20 @@ def insert_new_starpower_data(db_conn: Connection, starpower_data: DataFrame):
     if starpower_data.empty:
         return
 
-    for index, starpower in starpower_data.iterrows():
-        try:
-            cur = db_conn.cursor(factory=Cursor)
-            cur.execute("""INSERT INTO starpower
+    starpower_rows = get_catalogue_version_rows("starpower", starpower_data)
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""INSERT INTO starpower
                         (starpower_id, starpower_version, starpower_name, brawler_id, brawler_version)
-                        VALUES (?, ?, ?, ?, ?);""",
-                        [starpower["starpower_id"],
-                          starpower["starpower_version"] + 1,
-                          starpower["starpower_name"],
-                          starpower["brawler_id"],
-                          starpower["brawler_version"]])
+                        VALUES (?, ?, ?, ?, ?);""", starpower_rows)
+        cur.executemany(CURRENT_VERSION_UPSERTS["starpower"], starpower_rows)
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert starpower data!") from exc
 
-        except Exception as exc:
-            raise DatabaseError("Error: Unable to insert starpower data!") from exc
+    finally:
+        cur.close()
 
 
 def insert_new_gadget_data(db_conn: Connection, gadget_data: DataFrame):
@@ -87,27 +201,27 @@ def insert_new_gadget_data(db_conn: Connection, gadget_data: DataFrame):
     if gadget_data.empty:
         return
 
-    for index, gadget in gadget_data.iterrows():
-        try:
-            cur = db_conn.cursor(factory=Cursor)
-            cur.execute("""INSERT INTO gadget
+    gadget_rows = get_catalogue_version_rows("gadget", gadget_data)
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""INSERT INTO gadget
                         (gadget_id, gadget_version, gadget_name, brawler_id, brawler_version)
-                        VALUES (?, ?, ?, ?, ?);""",
-                        [gadget["gadget_id"],
-                          gadget["gadget_version"] + 1,
-                          gadget["gadget_name"],
-                          gadget["brawler_id"],
-                          gadget["brawler_version"]])
+                        VALUES (?, ?, ?, ?, ?);""", gadget_rows)
+        cur.executemany(CURRENT_VERSION_UPSERTS["gadget"], gadget_rows)
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert gadget data!") from exc
 
-        except Exception as exc:
-            raise DatabaseError("Error: Unable to insert gadget data!") from exc
+    finally:
+        cur.close()
 
 
 def insert_new_player_db(db_conn: Connection, player_data: dict) -> None:
     """Insert player data into database"""
 
+    cur = db_conn.cursor(factory=Cursor)
     try:
-        cur =  db_conn.cursor(factory=Cursor)
         cur.execute("""INSERT INTO player
                     (player_tag, player_name)
                     VALUES
@@ -123,8 +237,8 @@ def insert_new_player_db(db_conn: Connection, player_data: dict) -> None:
 def insert_player_exp(db_conn: Connection, player_id: int, player_data: dict) -> None:
     """Insert data into player_exp table"""
 
+    cur = db_conn.cursor(factory=Cursor)
     try:
-        cur = db_conn.cursor(factory=Cursor)
         cur.execute("""INSERT INTO player_exp
                     (player_id, exp_level, exp_points)
                     VALUES
@@ -141,8 +255,8 @@ def insert_player_exp(db_conn: Connection, player_id: int, player_data: dict) ->
 def insert_player_trophies(db_conn: Connection, player_id: int, player_data: dict) -> None:
     """Insert data into player_trophies table"""
 
+    cur = db_conn.cursor(factory=Cursor)
     try:
-        cur = db_conn.cursor(factory=Cursor)
         cur.execute("""INSERT INTO player_trophies
                     (player_id, trophies, highest_trophies)
                     VALUES
@@ -159,8 +273,8 @@ def insert_player_trophies(db_conn: Connection, player_id: int, player_data: dic
 def insert_player_victories(db_conn: Connection, player_id: int, player_data: dict) -> None:
     """Insert data into player_victories table"""
 
+    cur = db_conn.cursor(factory=Cursor)
     try:
-        cur = db_conn.cursor(factory=Cursor)
         cur.execute("""INSERT INTO player_victories
                     (player_id, _3vs3_victories, solo_victories, duo_victories)
                     VALUES
@@ -175,21 +289,47 @@ def insert_player_victories(db_conn: Connection, player_id: int, player_data: di
         cur.close()
 
 
-def insert_battle_log_db(db_conn: Connection, battle_log_data: dict):
-    """Insert battle log data into database"""
+def insert_player_snapshot_changes(db_conn: Connection, player_id: int, player_data: dict,
+                                   changed_tables: list[str]) -> None:
+    """Insert player data into the snapshot tables that have changed"""
 
-    try:
-        cur = db_conn.cursor(factory=Cursor)
+    snapshot_loaders = {"player_exp": insert_player_exp,
+                        "player_trophies": insert_player_trophies,
+                        "player_victories": insert_player_victories}
+
+    for table in changed_tables:
+        snapshot_loaders[table](db_conn, player_id, player_data)
+
+
+def insert_battle_log_db(db_conn: Connection, battle_log_data: DataFrame) -> int:
+    """Insert battle log data into database, skipping battles already stored.
+    Returns the number of new battles inserted"""
+
+    if not isinstance(battle_log_data, DataFrame):
+        raise TypeError("Error: Battle log data is not a dataframe!")
+    if battle_log_data.empty:
+        return 0
+
+    insert_new_battle_type_data(db_conn, battle_log_data["battle_type"].dropna().unique())
+
+    battle_rows = dataframe_to_rows(battle_log_data,
+                                    ["player_tag", "battle_time", "event_id", "battle_type",
+                                     "result", "duration", "trophy_change",
+                                     "brawler_played_id", "star_player",
+                                     "brawler_trophies"])
+    total_changes = db_conn.total_changes
 
-        for battle in battle_log_data:
-            cur.execute("""INSERT INTO battle
-                        (player_tag, battle_time, event_id, result,
-                        duration, trophy_change, brawler_played_id, star_player)
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""INSERT INTO battle
+                        (player_tag, battle_time, bs_event_id, battle_type_id, result,
+                        duration, trophy_change, brawler_id, star_player,
+                        brawler_trophies)
                         VALUES
-                        (%s, %s, %s, %s, %s, %s, %s, %s);""",
-                        [battle["player_tag"], battle["time"], battle["event_id"],
-                          battle["result"], battle["duration"], battle["trophy_change"],
-                          battle["brawler_id"], battle["star_player"]])
+                        (?, ?, ?,
+                        (SELECT battle_type_id FROM battle_type WHERE battle_type_name = ?),
+                        ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (player_tag, battle_time) DO NOTHING;""", battle_rows)
 
     except Exception as exc:
         raise DatabaseError("Error: Unable to insert battle log data!") from exc
@@ -197,6 +337,8 @@ def insert_battle_log_db(db_conn: Connection, battle_log_data: dict):
     finally:
         cur.close()
 
+    return db_conn.total_changes - total_changes
+
 
 def insert_new_event_data(db_conn: Connection, event_log_data: DataFrame):
     """Insert event data into the database"""
@@ -206,20 +348,36 @@ def insert_new_event_data(db_conn: Connection, event_log_data: DataFrame):
     if event_log_data.empty:
         return
 
-    try:
-        cur = db_conn.cursor(factory=Cursor)
+    event_rows = get_catalogue_version_rows("bs_event", event_log_data)
 
-        for index, event in event_log_data.iterrows():
-            cur.execute("""INSERT INTO bs_event
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""INSERT INTO bs_event
                         (bs_event_id, bs_event_version, mode, map)
                         VALUES
-                        (?, ?, ?, ?);""",
-                        [event["event_id"], event["event_version"],
-                          event["mode"], event["map"]])
+                        (?, ?, ?, ?);""", event_rows)
+        cur.executemany(CURRENT_VERSION_UPSERTS["bs_event"], event_rows)
 
     except Exception as exc:
         raise DatabaseError("Error inserting event data into database!") from exc
 
+    finally:
+        cur.close()
+
+
+def rebuild_current_tables(db_conn: Connection) -> None:
+    """Rebuilds every <table>_current table from the version history
+    (for databases created before the current tables were added)"""
+
+    with transaction(db_conn):
+        for table, rebuild_sql in CURRENT_VERSION_REBUILDS.items():
+            try:
+                db_conn.execute(f"DELETE FROM {table}_current;")
+                db_conn.execute(rebuild_sql)
+
+            except Exception as exc:
+                raise DatabaseError(f"Error: Unable to rebuild {table}_current!") from exc
+
 
 if __name__ =="__main__":
 
@@ -227,6 +385,11 @@ if __name__ =="__main__":
 
     config = environ
 
-    conn = get_db_connection(config)
+    db_manager = ConnectionManager(config)
+
+    with db_manager.writer() as conn:
+        if len(sys.argv) > 1 and sys.argv[1] == "rebuild_current":
+            rebuild_current_tables(conn)
+        print(db_manager.stats())
 
-    conn.close()
+    db_manager.close()
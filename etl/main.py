@@ -1,25 +1,44 @@
-"""Main.py will on a schedule and will run ETLs"""
+"""Main.py will on a schedule and will run ETLs
 
+Usage: python ./etl/main.py [--profile stages]"""
+
+import sys
 from os import environ
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from contextvars import copy_context
 from sqlite3 import Connection, Cursor, DatabaseError
 from datetime import datetime as dt
+from functools import partial
 
 from dotenv import load_dotenv
-
+from pandas import DataFrame
+
+from db import transaction, ConnectionManager
+from backend import StorageBackend, get_load_backend
+from shard import ShardRouter, get_shard_count
+from pipeline import WriteBehindLoader, DEFAULT_MAX_QUEUED_BATCHES, DEFAULT_COMMIT_EVERY
+from rollup import rollup_player_history, compact_player_history, DEFAULT_RETENTION_DAYS
+from cache import bump_data_generation
+from checkpoint import (get_checkpoint_max_age_hours, get_last_checkpoint,
+                        get_remaining_player_tags, record_checkpoint, clear_checkpoints)
+from dag import run_stages
+from metrics import stage, timed_stage, run_with_metrics
+from profiler import get_profiled_stages, profile_stage
 from extract import (extract_brawler_data_api, get_brawlers_latest_version,
                      get_gadgets_latest_version, get_starpowers_latest_version,
                      get_events_latest_version, extract_player_battle_log_api,
-                     get_db_connection, extract_event_data_api, get_api_player_data,
-                     get_player_id)
+                     extract_event_data_api, get_api_player_data,
+                     get_player_id, get_player_latest_snapshot)
 from transform import (transform_brawl_data_api, generate_starpower_changes,
                        brawl_api_data_to_df, add_starpower_changes_version,
                        generate_gadget_changes, add_gadget_changes_version,
                        generate_brawler_changes, add_brawler_changes_version,
                        transform_player_data_api, transform_battle_log_api,
-                       transform_event_data_api, generate_event_changes)
-from load import (insert_brawler_db, insert_new_starpower_data, insert_new_gadget_data,
-                  insert_new_event_data, insert_new_player_db, insert_player_exp,
-                  insert_player_trophies, insert_player_victories)
+                       transform_event_data_api, generate_event_changes,
+                       transform_battle_log_events, get_changed_snapshot_tables,
+                       build_player_snapshot)
+from load import insert_new_player_db
 
 
 def get_process_id(conn: Connection, process_name: str) -> int:
@@ -40,21 +59,22 @@ def get_process_id(conn: Connection, process_name: str) -> int:
     except Exception as e:
         raise DatabaseError (f"Database error occurred: {e}") from e
 
+    finally:
+        cur.close()
 
-def update_process_log(conn: Connection, process_id: int, process_status: str) -> None:
-    """Update process log in database"""
 
-    cur = conn.cursor(factory = Cursor)
+def update_process_log(conn: Connection, process_id: int, process_status: str) -> None:
+    """Update process log in database (joins the open transaction if there is one,
+    so an 'End' entry is committed together with the data it records)"""
 
     try:
-        cur.execute(
-            """INSERT INTO process_log
-            (process_id, process_status)
-            VALUES (?, ?);""",
-            [process_id, process_status]
-        )
-
-        conn.commit()
+        with transaction(conn):
+            conn.execute(
+                """INSERT INTO process_log
+                (process_id, process_status)
+                VALUES (?, ?);""",
+                [process_id, process_status]
+            )
 
     except DatabaseError as e:
         raise DatabaseError (f"Database error occurred: {e}") from e
@@ -82,6 +102,9 @@ def get_last_process_id_run(conn: Connection, process_id: int) -> dt:
     except Exception as e:
         raise DatabaseError (f"Database error occurred: {e}") from e
 
+    finally:
+        cur.close()
+
 
 def run_etl(last_run: dt, threshold_mins: int) -> bool:
     """Return true if last run time is greater than or
@@ -95,72 +118,208 @@ def run_etl(last_run: dt, threshold_mins: int) -> bool:
     return True if time_diff >= threshold_mins else False
 
 
+def extract_catalogue_database(conn: Connection) -> tuple[DataFrame, ...]:
+    """Returns the latest version of every brawler, starpower, gadget and event"""
+
+    return (get_brawlers_latest_version(conn), get_starpowers_latest_version(conn),
+            get_gadgets_latest_version(conn), get_events_latest_version(conn))
+
+
+def extract_brawler_etl_data(conn: Connection, config_parameters: dict,
+                             load_events: bool = True) -> dict:
+    """Extracts and transforms the brawler data (and the event data if
+    load_events) from the API and the database. The API calls and the
+    database reads (one stage, as they share conn) run concurrently"""
+
+    stages = {
+        "brawl_data_api": (timed_stage("extract_brawler_data_api",
+                                       partial(extract_brawler_data_api, config_parameters)), ()),
+        "catalogue_database": (timed_stage("extract_catalogue_database",
+                                           partial(extract_catalogue_database, conn)), ()),
+        "brawler_data": (timed_stage("transform_brawler_data", transform_brawl_data_api),
+                         ("brawl_data_api",))}
+
+    if load_events:
+        stages.update({
+            "event_data_api": (timed_stage("extract_event_data_api",
+                                           partial(extract_event_data_api,
+                                                   config_parameters)), ()),
+            "event_data": (timed_stage("transform_event_data", transform_event_data_api),
+                           ("event_data_api",))})
+
+    stage_results = run_stages(stages)
+
+    return {"catalogue_database": stage_results["catalogue_database"],
+            "brawler_data": stage_results["brawler_data"],
+            "event_data": stage_results.get("event_data")}
+
+
+def load_brawler_etl_data(conn: Connection, brawler_etl_data: dict,
+                          storage: StorageBackend) -> None:
+    """Generates brawler, starpower, gadget and event changes (if event data
+    was extracted) and loads them through storage (in the caller's transaction)"""
+
+    (brawler_data_database_df, brawler_starpower_data_database_df,
+     brawler_gadget_data_database_df,
+     event_data_database_df) = brawler_etl_data["catalogue_database"]
+    brawler_data_api = brawler_etl_data["brawler_data"]
+    event_data_api = brawler_etl_data["event_data"]
+
+    brawler_data_api_df = brawl_api_data_to_df(brawler_data_api)
+    brawler_starpower_data_api_df = brawl_api_data_to_df(brawler_data_api, "star_powers")
+    brawler_gadget_data_api_df = brawl_api_data_to_df(brawler_data_api, "gadgets")
+
+    brawler_changes_df = generate_brawler_changes(brawler_data_database_df,
+                                                  brawler_data_api_df)
+    brawler_changes_df = add_brawler_changes_version(conn, brawler_changes_df)
+    # Insert brawler updates/new data
+    # This is required as brawler_version is pulled into
+    # other dataframes, so this should be updated first so the most recent version is pulled)
+    storage.load_catalogue_changes(conn, "brawler", brawler_changes_df)
+
+    starpower_changes_df = generate_starpower_changes(brawler_starpower_data_database_df,
+                                                    brawler_starpower_data_api_df)
+    starpower_changes_df = add_starpower_changes_version(conn, starpower_changes_df)
+
+    gadget_changes_df = generate_gadget_changes(brawler_gadget_data_database_df,
+                                                brawler_gadget_data_api_df)
+    gadget_changes_df = add_gadget_changes_version(conn, gadget_changes_df)
+
+    # Load
+    storage.load_catalogue_changes(conn, "starpower", starpower_changes_df)
+    storage.load_catalogue_changes(conn, "gadget", gadget_changes_df)
+
+    if event_data_api is not None:
+        storage.load_catalogue_changes(conn, "bs_event",
+                                       generate_event_changes(event_data_database_df,
+                                                              event_data_api))
+
+
 def etl_brawler(conn: Connection, config_parameters: dict):
     """ETL for brawler data"""
 
     #Update Process Log - Start
     process_id = get_process_id(conn, "Brawler ETL")
     update_process_log(conn, process_id, "Start")
-    conn.commit()
 
     try:
+        # Extract and Transform
+        brawler_etl_data = extract_brawler_etl_data(conn, config_parameters)
 
-        # Extract - Brawler data
-        brawler_data_database_df = get_brawlers_latest_version(conn)
-        brawler_starpower_data_database_df = get_starpowers_latest_version(conn)
-        brawler_gadget_data_database_df = get_gadgets_latest_version(conn)
-        event_data_database_df = get_events_latest_version(conn)
-        brawler_data_api = extract_brawler_data_api(config_parameters)
-        event_data_api = extract_event_data_api(config_parameters)
-
-        # Transform
-        brawler_data_api = transform_brawl_data_api(brawler_data_api)
-        brawler_data_api_df = brawl_api_data_to_df(brawler_data_api)
-        brawler_starpower_data_api_df = brawl_api_data_to_df(brawler_data_api, "star_powers")
-        brawler_gadget_data_api_df = brawl_api_data_to_df(brawler_data_api, "gadgets")
-        event_data_api = transform_event_data_api(event_data_api)
-
-        # Changes
-        brawler_changes_df = generate_brawler_changes(brawler_data_database_df, brawler_data_api_df)
-        brawler_changes_df = add_brawler_changes_version(conn, brawler_changes_df)
-        event_changes_df = generate_event_changes(event_data_database_df, event_data_api)
-        # Insert brawler updates/new data
-        # This is required as brawler_version is pulled into
-        # other dataframes, so this should be updated first so the most recent version is pulled)
-        insert_brawler_db(conn, brawler_changes_df)
-
-        starpower_changes_df = generate_starpower_changes(brawler_starpower_data_database_df,
-                                                        brawler_starpower_data_api_df)
-        starpower_changes_df = add_starpower_changes_version(conn, starpower_changes_df)
-
-        gadget_changes_df = generate_gadget_changes(brawler_gadget_data_database_df,
-                                                    brawler_gadget_data_api_df)
-        gadget_changes_df = add_gadget_changes_version(conn, gadget_changes_df)
-
-        # Load
-        insert_new_starpower_data(conn, starpower_changes_df)
-        insert_new_gadget_data(conn, gadget_changes_df)
-        insert_new_event_data(conn, event_changes_df)
-
-        #Update Process Log - End
-        update_process_log(conn, process_id, "End")
+        # Changes and load are written in one transaction
+        with closing(get_load_backend(config_parameters)) as storage:
+            with transaction(conn), stage("load_brawler_data", conn):
+                load_brawler_etl_data(conn, brawler_etl_data, storage)
+                bump_data_generation(conn)
+
+                #Update Process Log - End
+                update_process_log(conn, process_id, "End")
 
     except Exception as exc:
         conn.rollback()
         update_process_log(conn, process_id, "Failed")
         raise ChildProcessError("Error within Brawler ETL process!") from exc
 
-    finally:
-        conn.commit()
 
+def etl_brawler_managed(db_manager: ConnectionManager, config_parameters: dict,
+                        load_events: bool = True):
+    """ETL for brawler data that only holds the writer to log and load, reading
+    the catalogue on a reader, so other ETLs can write while it extracts.
+    Events are left out unless load_events"""
+
+    #Update Process Log - Start
+    with db_manager.writer() as conn:
+        process_id = get_process_id(conn, "Brawler ETL")
+        update_process_log(conn, process_id, "Start")
+
+    try:
+        # Extract and Transform
+        with db_manager.reader() as db_reader:
+            brawler_etl_data = extract_brawler_etl_data(db_reader, config_parameters,
+                                                        load_events)
+
+        # Changes and load are written in one transaction
+        with closing(get_load_backend(config_parameters)) as storage:
+            with db_manager.transaction() as conn, stage("load_brawler_data", conn):
+                load_brawler_etl_data(conn, brawler_etl_data, storage)
+                bump_data_generation(conn)
+
+                #Update Process Log - End
+                update_process_log(conn, process_id, "End")
+
+    except Exception as exc:
+        with db_manager.writer() as conn:
+            update_process_log(conn, process_id, "Failed")
+        raise ChildProcessError("Error within Brawler ETL process!") from exc
+
+
+def get_player_tags(config_parameters: dict) -> list[str]:
+    """Returns the player tags to run the player ETL for
+    (player_tags, comma separated, falls back to player_tag)"""
+
+    player_tags = config_parameters.get("player_tags") or config_parameters["player_tag"]
+
+    return [player_tag.strip() for player_tag in player_tags.split(",") if player_tag.strip()]
+
+
+def load_player_data(conn: Connection, player_data: dict, snapshot_cache: dict,
+                     storage: StorageBackend) -> tuple[int, dict]:
+    """Loads transformed player data. Inserts the player if new, and exp,
+    trophies and victories (through storage) only if they changed since
+    the last snapshot.
+    Returns the player ID and new snapshot, which callers may cache once
+    the load is committed"""
+
+    player_id = get_player_id(conn, player_data)
+
+    if player_id == 0:
+        insert_new_player_db(conn, player_data)
+        player_id = get_player_id(conn, player_data)
+
+    previous_snapshot = get_player_latest_snapshot(conn, player_id, snapshot_cache)
+    changed_tables = get_changed_snapshot_tables(previous_snapshot, player_data)
+    storage.load_player_snapshots(conn, player_id, player_data, changed_tables)
+
+    return player_id, build_player_snapshot(player_data)
+
+
+def load_player_batch(conn: Connection, player_data_batch: list[dict],
+                      snapshot_cache: dict, storage: StorageBackend) -> dict:
+    """Loads a batch of transformed player data. Returns the new snapshot of
+    each player ID, to be cached once the batch is committed"""
+
+    return dict(load_player_data(conn, player_data, snapshot_cache, storage)
+                for player_data in player_data_batch)
 
-def etl_player(conn: Connection, config_parameters: dict):
-    """ETL for player data"""
+
+def load_player_batch_checkpointed(conn: Connection, player_data_batch: list[dict],
+                                   snapshot_cache: dict, storage: StorageBackend,
+                                   process_id: int, stage_name: str,
+                                   last_player_tag: str) -> dict:
+    """Loads a batch of transformed player data and records its last player
+    as the stage's checkpoint, in the same transaction. Returns the new
+    snapshot of each player ID"""
+
+    with stage("load_player_data", conn) as stage_counts:
+        player_snapshots = load_player_batch(conn, player_data_batch, snapshot_cache,
+                                             storage)
+        record_checkpoint(conn, process_id, stage_name, last_player_tag)
+        stage_counts["records"] = len(player_data_batch)
+
+    return player_snapshots
+
+
+def etl_player(conn: Connection, config_parameters: dict, snapshot_cache: dict = None):
+    """ETL for player data. Exp, trophies and victories are only
+    written when they have changed since the last stored snapshot
+    (snapshot_cache is only updated once the load has committed)"""
+
+    if snapshot_cache is None:
+        snapshot_cache = {}
 
     #Update Process Log - Start
     process_id = get_process_id(conn, "Player ETL")
     update_process_log(conn, process_id, "Start")
-    conn.commit()
 
     #Get parameters from .env
     bs_player_tag = config_parameters["player_tag"]
@@ -168,41 +327,293 @@ def etl_player(conn: Connection, config_parameters: dict):
 
     try:
         #Extract
-        player_data_api = get_api_player_data(api_token, bs_player_tag)
-        player_id = get_player_id(conn, player_data_api)
+        with stage("extract_player_data") as stage_counts:
+            player_data_api = get_api_player_data(api_token, bs_player_tag)
+            stage_counts["records"] = 1
 
         #Transform
-        player_data_api = transform_player_data_api(player_data_api)
+        with stage("transform_player_data") as stage_counts:
+            player_data_api = transform_player_data_api(player_data_api)
+            stage_counts["records"] = 1
 
         #Load
-        if player_id == 0:
-            insert_new_player_db(conn, player_data_api)
+        with closing(get_load_backend(config_parameters)) as storage:
+            with transaction(conn), stage("load_player_data", conn) as stage_counts:
+                stage_counts["records"] = 1
+                player_id, player_snapshot = load_player_data(conn, player_data_api,
+                                                              snapshot_cache, storage)
+                bump_data_generation(conn)
 
-        insert_player_exp(conn, player_id, player_data_api)
-        insert_player_trophies(conn, player_id, player_data_api)
-        insert_player_victories(conn, player_id, player_data_api)
+                #Update Process Log - End
+                update_process_log(conn, process_id, "End")
 
-        #Update Process Log - End
-        update_process_log(conn, process_id, "End")
+        snapshot_cache[player_id] = player_snapshot
 
     except Exception as exc:
         conn.rollback()
         update_process_log(conn, process_id, "Failed")
         raise ChildProcessError("Error within Player ETL process!") from exc
 
-    finally:
-        conn.commit()
 
+def load_players_pipelined(db_manager: ConnectionManager, config_parameters: dict,
+                           player_tags: list[str], process_id: int,
+                           stage_name: str = "players") -> None:
+    """Extracts and transforms players in batches on this thread while a
+    write-behind loader thread loads earlier batches, so the API and
+    database work overlap. Players are run in tag order and the players
+    committed by an unfinished earlier run (see checkpoint.py) are skipped"""
 
-def etl_battle_log(conn: Connection, config_parameters: dict):
-    """ETL for player battle log"""
+    api_token = config_parameters["api_token"]
+    batch_size = int(config_parameters.get("pipeline_batch_size", 100))
+    max_queued_batches = int(config_parameters.get("pipeline_max_queued_batches",
+                                                   DEFAULT_MAX_QUEUED_BATCHES))
+    commit_every = int(config_parameters.get("db_commit_every", DEFAULT_COMMIT_EVERY))
+    snapshot_cache = {}
+
+    with db_manager.reader() as db_reader:
+        player_tags = get_remaining_player_tags(
+            player_tags, get_last_checkpoint(db_reader, process_id, stage_name,
+                                             get_checkpoint_max_age_hours(config_parameters)))
+
+    with closing(get_load_backend(config_parameters)) as storage:
+        # Snapshots are only cached once the loader has committed their batch
+        with WriteBehindLoader(db_manager, max_queued_batches, commit_every,
+                               on_commit=snapshot_cache.update) as loader:
+            for start in range(0, len(player_tags), batch_size):
+                batch_tags = player_tags[start:start + batch_size]
+
+                #Extract
+                with stage("extract_player_data") as stage_counts:
+                    player_data_api_batch = [get_api_player_data(api_token, player_tag)
+                                             for player_tag in batch_tags]
+                    stage_counts["records"] = len(player_data_api_batch)
+
+                #Transform
+                with stage("transform_player_data") as stage_counts:
+                    player_data_batch = [transform_player_data_api(player_data_api)
+                                         for player_data_api in player_data_api_batch]
+                    stage_counts["records"] = len(player_data_batch)
+
+                #Load (waits here if the loader is max_queued_batches behind)
+                loader.submit(load_player_batch_checkpointed, player_data_batch, snapshot_cache,
+                              storage, process_id, stage_name, batch_tags[-1])
+
+
+def etl_player_pipelined(db_manager: ConnectionManager, config_parameters: dict,
+                         player_tags: list[str]):
+    """ETL for player data over many players, pipelined"""
+
+    #Update Process Log - Start
+    with db_manager.writer() as conn:
+        process_id = get_process_id(conn, "Player ETL")
+        update_process_log(conn, process_id, "Start")
+
+    try:
+        load_players_pipelined(db_manager, config_parameters, player_tags, process_id)
+
+    except Exception as exc:
+        with db_manager.writer() as conn:
+            update_process_log(conn, process_id, "Failed")
+        raise ChildProcessError("Error within Player ETL process!") from exc
+
+    #Update Process Log - End
+    with db_manager.writer() as conn, transaction(conn):
+        clear_checkpoints(conn, process_id)
+        bump_data_generation(conn)
+        update_process_log(conn, process_id, "End")
+
+
+def etl_player_sharded(shard_router: ShardRouter, config_parameters: dict,
+                       player_tags: list[str]):
+    """ETL for player data with sharded storage. Each shard's players are
+    loaded pipelined by their own thread and writer, in parallel"""
+
+    #Update Process Log - Start (process log is kept in the catalogue database)
+    with shard_router.catalogue.writer() as conn:
+        process_id = get_process_id(conn, "Player ETL")
+        update_process_log(conn, process_id, "Start")
+
+    shard_player_tags = shard_router.group_player_tags(player_tags)
+
+    try:
+        # An empty tag list has no shard runs, but still rolls up every shard
+        with ThreadPoolExecutor(max_workers=max(1, len(shard_player_tags))) as executor:
+            shard_runs = [executor.submit(copy_context().run, load_players_pipelined,
+                                          shard_router.shards[shard_index],
+                                          config_parameters, shard_tags, process_id)
+                          for shard_index, shard_tags in shard_player_tags.items()]
+            for shard_run in shard_runs:
+                shard_run.result()
+
+        for shard in shard_router.shards:
+            with shard.writer() as conn:
+                etl_player_rollup(conn, config_parameters)
+                bump_data_generation(conn)
+
+        # Each shard's checkpoints are kept in the shard, with its batches
+        for shard in shard_router.shards:
+            with shard.transaction() as conn:
+                clear_checkpoints(conn, process_id)
+
+    except Exception as exc:
+        with shard_router.catalogue.writer() as conn:
+            update_process_log(conn, process_id, "Failed")
+        raise ChildProcessError("Error within Player ETL process!") from exc
+
+    #Update Process Log - End
+    with shard_router.catalogue.writer() as conn, transaction(conn):
+        bump_data_generation(conn)
+        update_process_log(conn, process_id, "End")
+
+
+def etl_player_rollup(conn: Connection, config_parameters: dict):
+    """Rolls up new player history into hourly/daily/weekly buckets
+    and compacts raw history older than the retention period"""
+
+    retention_days = int(config_parameters.get("player_history_retention_days",
+                                               DEFAULT_RETENTION_DAYS))
+
+    try:
+        with transaction(conn), stage("rollup_player_history", conn):
+            rollup_player_history(conn)
+            compact_player_history(conn, retention_days)
+
+    except Exception as exc:
+        raise ChildProcessError("Error within Player Rollup process!") from exc
+
+
+def etl_battle_log(conn: Connection, config_parameters: dict, battle_conn: Connection = None):
+    """ETL for player battle log. Events are loaded on conn and battles on
+    battle_conn (the player's shard when storage is sharded, otherwise conn)"""
+
+    if battle_conn is None:
+        battle_conn = conn
+
+    #Update Process Log - Start
+    process_id = get_process_id(conn, "Battle Log ETL")
+    update_process_log(conn, process_id, "Start")
 
     bs_player_tag = config_parameters["player_tag"]
 
-    player_battle_log_api = extract_player_battle_log_api(config_parameters, bs_player_tag)
-    player_battle_log_api = transform_battle_log_api(player_battle_log_api, bs_player_tag)
-    for battle in player_battle_log_api:
-        print(battle)
+    try:
+        #Extract
+        with stage("extract_battle_log") as stage_counts:
+            player_battle_log_api = extract_player_battle_log_api(config_parameters,
+                                                                  bs_player_tag)
+            event_data_database_df = get_events_latest_version(conn)
+            stage_counts["records"] = len(player_battle_log_api["items"])
+
+        #Transform (only battles newer than the last stored battle are kept)
+        with stage("transform_battle_log") as stage_counts:
+            battle_log_df = transform_battle_log_api(battle_conn, player_battle_log_api,
+                                                     bs_player_tag)
+            battle_event_df = transform_battle_log_events(battle_log_df)
+            stage_counts["records"] = len(battle_log_df)
+
+        #Load
+        with closing(get_load_backend(config_parameters)) as storage:
+            with transaction(conn), transaction(battle_conn), stage("load_battle_log", conn,
+                                                                    battle_conn) as stage_counts:
+                event_changes_df = generate_event_changes(event_data_database_df, battle_event_df)
+                storage.load_catalogue_changes(conn, "bs_event", event_changes_df)
+                new_battle_log_df = storage.load_battles(battle_conn, battle_log_df)
+                stage_counts["records"] = len(new_battle_log_df)
+                bump_data_generation(conn)
+                if battle_conn is not conn:
+                    bump_data_generation(battle_conn)
+
+                #Update Process Log - End
+                update_process_log(conn, process_id, "End")
+
+    except Exception as exc:
+        conn.rollback()
+        battle_conn.rollback()
+        update_process_log(conn, process_id, "Failed")
+        raise ChildProcessError("Error within Battle Log ETL process!") from exc
+
+
+def run_brawler_etl(db_manager: ConnectionManager, config_parameters: dict,
+                    load_events: bool = True) -> None:
+    """Runs the brawler ETL on the catalogue (with the events unless another
+    ETL, the event rotation ETL, loads them)"""
+
+    etl_brawler_managed(db_manager, config_parameters, load_events)
+
+
+def run_player_etl(db_manager: ConnectionManager, config_parameters: dict,
+                   shard_router: ShardRouter = None) -> None:
+    """Runs the player ETL for every configured player tag (pipelined when
+    more than one player tag is configured) and rolls up player history"""
+
+    bs_player_tags = get_player_tags(config_parameters)
+
+    if shard_router:
+        etl_player_sharded(shard_router, config_parameters, bs_player_tags)
+        return
+
+    if len(bs_player_tags) > 1:
+        etl_player_pipelined(db_manager, config_parameters, bs_player_tags)
+    else:
+        with db_manager.writer() as db_conn:
+            etl_player(db_conn, config_parameters)
+
+    with db_manager.writer() as db_conn:
+        etl_player_rollup(db_conn, config_parameters)
+
+
+def run_battle_log_etl(db_manager: ConnectionManager, config_parameters: dict,
+                       shard_router: ShardRouter = None) -> None:
+    """Runs the battle log ETL, loading battles into the player's shard
+    when storage is sharded"""
+
+    if shard_router:
+        battle_manager = shard_router.shard_for(config_parameters["player_tag"])
+    else:
+        battle_manager = db_manager
+
+    with db_manager.writer() as db_conn, battle_manager.writer() as battle_conn:
+        etl_battle_log(db_conn, config_parameters, battle_conn)
+
+
+ETL_STAGE_NAMES = ["brawler_etl", "player_etl", "battle_log_etl"]
+
+
+def get_etl_stages(db_manager: ConnectionManager, config_parameters: dict,
+                   process_names: set[str], shard_router: ShardRouter = None) -> dict:
+    """Returns the stages (see dag.run_stages) running the ETLs named. The
+    player ETL shares no data with the other ETLs so runs alongside them,
+    the battle log ETL loads events so runs after the brawler ETL. Each
+    run's stage metrics are saved (see metrics.py) and the stages named in
+    etl_profile are profiled (see profiler.py)"""
+
+    stages = {}
+    profiled_stages = get_profiled_stages(config_parameters, ETL_STAGE_NAMES)
+
+    def get_run_function(stage_name, run_function):
+        if stage_name in profiled_stages:
+            return profile_stage(stage_name, run_function, config_parameters)
+        return run_function
+
+    if "Brawler ETL" in process_names:
+        stages["brawler_etl"] = (partial(run_with_metrics, db_manager, config_parameters,
+                                         "Brawler ETL",
+                                         get_run_function("brawler_etl", run_brawler_etl),
+                                         db_manager, config_parameters), ())
+
+    if "Player ETL" in process_names:
+        stages["player_etl"] = (partial(run_with_metrics, db_manager, config_parameters,
+                                        "Player ETL",
+                                        get_run_function("player_etl", run_player_etl),
+                                        db_manager, config_parameters, shard_router), ())
+
+    if "Battle Log ETL" in process_names:
+        stages["battle_log_etl"] = (
+            lambda **_: run_with_metrics(db_manager, config_parameters, "Battle Log ETL",
+                                         get_run_function("battle_log_etl", run_battle_log_etl),
+                                         db_manager, config_parameters, shard_router),
+            ("brawler_etl",) if "brawler_etl" in stages else ())
+
+    return stages
 
 
 if __name__ =="__main__":
@@ -211,40 +622,58 @@ if __name__ =="__main__":
 
     config = environ
 
+    ## --profile [stages] profiles the ETLs named (see profiler.py)
+    if "--profile" in sys.argv[1:]:
+        profile_index = sys.argv.index("--profile") + 1
+        config = {**environ, "etl_profile": sys.argv[profile_index]
+                  if profile_index < len(sys.argv) else "all"}
+
     print(f"ETL started at {dt.now()}")
 
-    ## Establish DB Connection and get last process run times
-    try:
-        db_conn = get_db_connection(config)
+    ## Connection manager owns the writer and reader connections for the run
+    ## (with db_shards set, player and battle data are routed to shard databases)
+    shard_router = ShardRouter(config) if get_shard_count(config) else None
+    db_manager = shard_router.catalogue if shard_router else ConnectionManager(config)
 
-        brawl_process_id = get_process_id(db_conn, "Brawler ETL")
-        player_process_id = get_process_id(db_conn, "Player ETL")
+    ## Get last process run times
+    try:
+        with db_manager.reader() as db_reader:
+            brawl_process_id = get_process_id(db_reader, "Brawler ETL")
+            player_process_id = get_process_id(db_reader, "Player ETL")
+            battle_log_process_id = get_process_id(db_reader, "Battle Log ETL")
 
-        latest_brawler_etl = get_last_process_id_run(db_conn, brawl_process_id)
-        latest_player_etl = get_last_process_id_run(db_conn, player_process_id)
+            latest_brawler_etl = get_last_process_id_run(db_reader, brawl_process_id)
+            latest_player_etl = get_last_process_id_run(db_reader, player_process_id)
+            latest_battle_log_etl = get_last_process_id_run(db_reader, battle_log_process_id)
 
     except DatabaseError as exc:
+        db_manager.close()
         raise DatabaseError(f"Database connection failed: {exc}") from exc
 
-    ## Run ETLs based on last run times
-    ## Bralwer ETL - every 60 minutes
-    if run_etl(latest_brawler_etl, 60):
-        try:
-            etl_brawler(db_conn, config)
-        except Exception as exc:
-            raise ChildProcessError(f"ETL failed at {dt.now()}. {exc}") from exc
-    else:
-        print(f"Brawler ETL skipped at {dt.now()}. Last run was at {latest_brawler_etl}")
+    try:
+        ## Run ETLs based on last run times (every 60 minutes)
+        latest_etl_runs = {"Brawler ETL": latest_brawler_etl, "Player ETL": latest_player_etl,
+                           "Battle Log ETL": latest_battle_log_etl}
+        due_etls = {process_name for process_name, latest_run in latest_etl_runs.items()
+                    if run_etl(latest_run, 60)}
 
-    ## Player ETL - every 60 minutes
-    if run_etl(latest_player_etl, 60):
+        for process_name in latest_etl_runs.keys() - due_etls:
+            print(f"{process_name} skipped at {dt.now()}. "
+                  f"Last run was at {latest_etl_runs[process_name]}")
+
+        ## Independent ETLs run concurrently
         try:
-            etl_player(db_conn, config)
+            run_stages(get_etl_stages(db_manager, config, due_etls, shard_router))
         except Exception as exc:
-            raise ChildProcessError(f"ETL failed at {dt.now()}. {exc}") from exc
-    else:
-        print(f"Player ETL skipped at {dt.now()}. Last run was at {latest_player_etl}")
+            raise ChildProcessError(f"ETL failed at {dt.now()}. {exc.__cause__}") from exc
+
+    finally:
+        ## Close DB Connections
+        if shard_router:
+            print(f"Connection stats: {shard_router.stats()}")
+            shard_router.close()
+        else:
+            print(f"Connection stats: {db_manager.stats()}")
+            db_manager.close()
 
-    ## Close DB Connection
-    db_conn.close()
     print(f"ETL finished at {dt.now()}")
@@ -0,0 +1,212 @@
+"""Brawler vs brawler matchup matrices per mode
+
+wins[a, b] counts battles brawler a's team won against a team with
+brawler b, games[a, b] counts every decided battle between them (draws
+and showdown placements are not counted). Brawler ids are indexed by
+their offset from BRAWLER_ID_OFFSET, so a brawler's matchups are one row
+slice. Matrices are stored compressed in matchup_matrix (one row per
+mode) and only new battles are added to them.
+
+A battle logged by two tracked players is counted for each of them."""
+
+import zlib
+from io import BytesIO
+from sqlite3 import Connection, Cursor, DatabaseError
+
+import numpy as np
+from pandas import DataFrame
+
+BRAWLER_ID_OFFSET = 16000000
+
+MATRIX_DTYPE = np.int32
+
+DECIDED_RESULTS = {"Victory": 1, "Defeat": 0}
+
+
+def get_brawler_index(brawler_ids: np.ndarray) -> np.ndarray:
+    """Returns the matrix index of brawler ids"""
+
+    brawler_index = np.asarray(brawler_ids, dtype=np.int64) - BRAWLER_ID_OFFSET
+
+    if (brawler_index < 0).any():
+        raise ValueError(f"Error: Brawler ids must be at least {BRAWLER_ID_OFFSET}!")
+
+    return brawler_index
+
+
+def pad_brawler_ids(brawler_ids: list[list[int]]) -> np.ndarray:
+    """Returns team brawler ids as a (battles, team size) matrix index array,
+    padded with -1 for smaller teams"""
+
+    team_size = max((len(team) for team in brawler_ids), default=0)
+    padded = np.full((len(brawler_ids), team_size), -1, dtype=np.int64)
+
+    for row, team in enumerate(brawler_ids):
+        padded[row, :len(team)] = get_brawler_index(team)
+
+    return padded
+
+
+def array_to_blob(array: np.ndarray) -> bytes:
+    """Returns an array as compressed bytes"""
+
+    buffer = BytesIO()
+    np.save(buffer, array, allow_pickle=False)
+
+    return zlib.compress(buffer.getvalue())
+
+
+def blob_to_array(blob: bytes) -> np.ndarray:
+    """Returns the array stored by array_to_blob"""
+
+    return np.load(BytesIO(zlib.decompress(blob)), allow_pickle=False)
+
+
+class MatchupMatrix:
+    """Dense wins and games counts per brawler pair for one mode"""
+
+    def __init__(self, mode: str, size: int = 0):
+        self.mode = mode
+        self.wins = np.zeros((size, size), dtype=MATRIX_DTYPE)
+        self.games = np.zeros((size, size), dtype=MATRIX_DTYPE)
+
+    @property
+    def size(self) -> int:
+        """Number of brawler indexes the matrices cover"""
+
+        return self.games.shape[0]
+
+    def ensure_size(self, size: int) -> None:
+        """Grows the matrices (new brawlers) to at least size x size"""
+
+        if size <= self.size:
+            return
+
+        for name in ("wins", "games"):
+            grown = np.zeros((size, size), dtype=MATRIX_DTYPE)
+            grown[:self.size, :self.size] = getattr(self, name)
+            setattr(self, name, grown)
+
+    def add_battles(self, battle_log_data: DataFrame) -> int:
+        """Adds decided battles of this mode in one vectorised batch.
+        Returns the number of battles added"""
+
+        battle_data = battle_log_data[(battle_log_data["event_mode"] == self.mode)
+                                      & battle_log_data["result"].isin(DECIDED_RESULTS)]
+
+        if battle_data.empty:
+            return 0
+
+        teams = pad_brawler_ids(battle_data["team_brawler_ids"].tolist())
+        opponents = pad_brawler_ids(battle_data["opponent_brawler_ids"].tolist())
+        won = battle_data["result"].map(DECIDED_RESULTS).to_numpy(dtype=MATRIX_DTYPE)
+
+        # Every (team brawler, opponent brawler) pair of every battle
+        team_pairs = np.broadcast_to(teams[:, :, None],
+                                     (len(teams), teams.shape[1], opponents.shape[1]))
+        opponent_pairs = np.broadcast_to(opponents[:, None, :], team_pairs.shape)
+        won_pairs = np.broadcast_to(won[:, None, None], team_pairs.shape)
+        valid = (team_pairs >= 0) & (opponent_pairs >= 0)
+
+        team_index, opponent_index = team_pairs[valid], opponent_pairs[valid]
+        won_index = won_pairs[valid]
+        self.ensure_size(int(max(team_index.max(initial=-1),
+                                 opponent_index.max(initial=-1))) + 1)
+
+        np.add.at(self.games, (team_index, opponent_index), 1)
+        np.add.at(self.games, (opponent_index, team_index), 1)
+        np.add.at(self.wins, (team_index, opponent_index), won_index)
+        np.add.at(self.wins, (opponent_index, team_index), 1 - won_index)
+
+        return len(battle_data)
+
+    def merge(self, other: "MatchupMatrix") -> None:
+        """Adds the counts of another matrix of the same mode (e.g. another shard)"""
+
+        self.ensure_size(other.size)
+        self.wins[:other.size, :other.size] += other.wins
+        self.games[:other.size, :other.size] += other.games
+
+    def get_brawler_matchups(self, brawler_id: int) -> DataFrame:
+        """Returns games and win rate of a brawler against every opponent it has played"""
+
+        brawler_index = int(get_brawler_index([brawler_id])[0])
+
+        if brawler_index >= self.size:
+            return DataFrame(columns=["opponent_brawler_id", "games", "wins", "win_rate"])
+
+        games, wins = self.games[brawler_index], self.wins[brawler_index]
+        opponents = np.flatnonzero(games)
+
+        return DataFrame({"opponent_brawler_id": opponents + BRAWLER_ID_OFFSET,
+                          "games": games[opponents],
+                          "wins": wins[opponents],
+                          "win_rate": wins[opponents] / games[opponents]})
+
+
+def load_matchup_matrix(db_conn: Connection, mode: str) -> MatchupMatrix:
+    """Returns the stored matchup matrix of a mode (empty if none is stored)"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""SELECT wins, games
+                    FROM matchup_matrix
+                    WHERE mode = ?;""", [mode])
+
+        stored_matrix = cur.fetchone()
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    matchup_matrix = MatchupMatrix(mode)
+
+    if stored_matrix:
+        matchup_matrix.wins = blob_to_array(stored_matrix[0])
+        matchup_matrix.games = blob_to_array(stored_matrix[1])
+
+    return matchup_matrix
+
+
+def save_matchup_matrix(db_conn: Connection, matchup_matrix: MatchupMatrix) -> None:
+    """Stores a matchup matrix, replacing the stored matrix of its mode"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""INSERT INTO matchup_matrix
+                    (mode, wins, games)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (mode) DO UPDATE SET
+                      wins = excluded.wins,
+                      games = excluded.games,
+                      last_updated = datetime('now');""",
+                    [matchup_matrix.mode, array_to_blob(matchup_matrix.wins),
+                     array_to_blob(matchup_matrix.games)])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert matchup data!") from exc
+
+    finally:
+        cur.close()
+
+
+def update_matchup_matrices(db_conn: Connection, new_battle_data: DataFrame) -> int:
+    """Adds new battles (see stats.get_new_battles) to the stored matchup
+    matrix of each mode they were played in. Returns battles added"""
+
+    if new_battle_data.empty:
+        return 0
+
+    battles_added = 0
+
+    for mode in new_battle_data["event_mode"].dropna().unique():
+        matchup_matrix = load_matchup_matrix(db_conn, mode)
+        mode_battles_added = matchup_matrix.add_battles(new_battle_data)
+
+        if mode_battles_added:
+            save_matchup_matrix(db_conn, matchup_matrix)
+            battles_added += mode_battles_added
+
+    return battles_added
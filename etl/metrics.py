@@ -0,0 +1,268 @@
+"""Per-stage timings and counts of ETL runs
+
+An ETL run by run_with_metrics collects an EtlMetrics for the run. Each
+extract, transform and load stage of the ETL is run inside stage(), which
+times it and counts its calls, the records it handles, the rows it writes
+(from total_changes of the connections given) and the API calls, response
+bytes and retries made inside it (by a response hook on the API session).
+Outside run_with_metrics stage() does nothing, so the ETL functions can be
+run without metrics.
+
+The current run and stage are held in context variables, so stages running
+on other threads (DAG stages, the write-behind loader, the roster's
+extraction pool) must be started in a copy of the caller's context.
+
+When the run ends its metrics are saved to etl_metric, one row per stage
+plus a 'run' row for the whole run. Rows are keyed by a run id, so runs of
+the same process started at the same time (e.g. job queue workers) never
+overwrite each other. With metrics_textfile set the latest
+run of every process is also written to that file in the Prometheus text
+format, for node_exporter's textfile collector.
+
+Usage: python ./etl/metrics.py [textfile]"""
+
+import os
+import sys
+import uuid
+from os import environ
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime as dt
+from sqlite3 import Connection, Cursor, DatabaseError
+from threading import Lock
+from time import perf_counter
+from typing import Callable
+
+from dotenv import load_dotenv
+from pandas import DataFrame
+
+from db import ConnectionManager
+from polling import get_utc_now
+
+METRIC_NAMES = ["seconds", "calls", "records", "bytes", "api_calls", "retries", "rows_written"]
+
+RUN_STAGE = "run"
+
+RUN_TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+PROMETHEUS_PREFIX = "brawl_stars_etl"
+
+CURRENT_METRICS = ContextVar("current_metrics", default=None)
+
+CURRENT_STAGE = ContextVar("current_stage", default=None)
+
+
+class EtlMetrics:
+    """Timings and counts of the stages of one ETL run, updated under a lock
+    as stages may run concurrently"""
+
+    def __init__(self, process_name: str):
+        self.process_name = process_name
+        self.run_id = uuid.uuid4().hex
+        self.started_at = get_utc_now()
+        self.stages = {}
+        self.lock = Lock()
+
+    def add(self, stage_name: str, **counts) -> None:
+        """Adds counts (named as in METRIC_NAMES) to a stage"""
+
+        with self.lock:
+            stage_metrics = self.stages.setdefault(stage_name, dict.fromkeys(METRIC_NAMES, 0))
+            for metric_name, count in counts.items():
+                stage_metrics[metric_name] += count
+
+
+@contextmanager
+def stage(stage_name: str, *db_conns: Connection):
+    """Times the enclosed stage of the current run and counts the rows it
+    writes on db_conns. Yields a dict the stage can add its record count to"""
+
+    metrics = CURRENT_METRICS.get()
+    stage_counts = {"records": 0}
+
+    if metrics is None:
+        yield stage_counts
+        return
+
+    db_conns = list({id(db_conn): db_conn for db_conn in db_conns}.values())
+    total_changes = [db_conn.total_changes for db_conn in db_conns]
+    stage_token = CURRENT_STAGE.set(stage_name)
+    start = perf_counter()
+
+    try:
+        yield stage_counts
+
+    finally:
+        CURRENT_STAGE.reset(stage_token)
+        metrics.add(stage_name, seconds=perf_counter() - start, calls=1,
+                    records=stage_counts["records"],
+                    rows_written=sum(db_conn.total_changes - changes
+                                     for db_conn, changes in zip(db_conns, total_changes)))
+
+
+def get_record_count(result) -> int:
+    """Returns the number of records in a stage's result (0 if it has no length)"""
+
+    try:
+        return len(result)
+    except TypeError:
+        return 0
+
+
+def timed_stage(stage_name: str, function: Callable) -> Callable:
+    """Returns the function run as a stage, counting the records it returns"""
+
+    def run_stage(*args, **kwargs):
+        with stage(stage_name) as stage_counts:
+            result = function(*args, **kwargs)
+            stage_counts["records"] = get_record_count(result)
+
+        return result
+
+    return run_stage
+
+
+def record_api_response(response, *_args, **_kwargs):
+    """Response hook of the API session, counting the call, its bytes and
+    its retries in the current stage"""
+
+    metrics = CURRENT_METRICS.get()
+
+    if metrics is not None:
+        retries = getattr(getattr(response.raw, "retries", None), "history", ())
+        metrics.add(CURRENT_STAGE.get() or RUN_STAGE, api_calls=1,
+                    bytes=len(response.content), retries=len(retries))
+
+    return response
+
+
+def save_metrics(db_conn: Connection, metrics: EtlMetrics) -> None:
+    """Inserts the metrics of a run, one row per stage"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany(f"""INSERT INTO etl_metric
+                        (process_id, run_id, run_started_at, process_stage,
+                         {", ".join(METRIC_NAMES)})
+                        SELECT process_id, ?, ?, ?, {", ".join("?" * len(METRIC_NAMES))}
+                        FROM process
+                        WHERE process_name = ?;""",
+                        [(metrics.run_id, metrics.started_at.strftime(RUN_TIME_FORMAT), stage_name,
+                          *(stage_metrics[metric_name] for metric_name in METRIC_NAMES),
+                          metrics.process_name)
+                         for stage_name, stage_metrics in metrics.stages.items()])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert metric data!") from exc
+
+    finally:
+        cur.close()
+
+
+def get_latest_metrics(db_conn: Connection) -> DataFrame:
+    """Returns the stage metrics of the latest run of every process"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute(f"""SELECT p.process_name, em.process_stage,
+                      {", ".join(f"em.{metric_name}" for metric_name in METRIC_NAMES)}
+                    FROM etl_metric em
+                    INNER JOIN process p
+                    ON em.process_id = p.process_id
+                    WHERE em.run_id = (SELECT run_id
+                                       FROM etl_metric
+                                       WHERE process_id = em.process_id
+                                       ORDER BY run_started_at DESC, run_id DESC
+                                       LIMIT 1)
+                    ORDER BY p.process_name, em.process_stage;""")
+
+        latest_metrics_df = DataFrame(cur.fetchall(),
+                                      columns=["process_name", "process_stage", *METRIC_NAMES])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    return latest_metrics_df
+
+
+def to_prometheus_text(latest_metrics_df: DataFrame) -> str:
+    """Formats stage metrics as Prometheus text format gauges"""
+
+    lines = []
+
+    for metric_name in METRIC_NAMES:
+        prometheus_name = f"{PROMETHEUS_PREFIX}_stage_{metric_name}"
+        lines.append(f"# HELP {prometheus_name} {metric_name.replace('_', ' ').capitalize()} "
+                     f"of each ETL stage in the latest run")
+        lines.append(f"# TYPE {prometheus_name} gauge")
+        lines.extend(f'{prometheus_name}{{process="{process_name}",stage="{stage_name}"}} '
+                     f"{value}"
+                     for process_name, stage_name, value in latest_metrics_df[
+                         ["process_name", "process_stage", metric_name]].itertuples(
+                             index=False, name=None))
+
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus_textfile(db_conn: Connection, textfile_path: str) -> None:
+    """Writes the latest run metrics to a Prometheus textfile, replacing it in
+    one rename so node_exporter never reads a partly written file"""
+
+    temp_path = f"{textfile_path}.tmp"
+
+    with open(temp_path, "w", encoding="utf-8") as textfile:
+        textfile.write(to_prometheus_text(get_latest_metrics(db_conn)))
+
+    os.replace(temp_path, textfile_path)
+
+
+def run_with_metrics(db_manager: ConnectionManager, config_env, process_name: str,
+                     run_function: Callable, *args, **kwargs):
+    """Runs an ETL collecting its metrics, then saves them (whether the
+    run failed or not) and writes the Prometheus textfile if configured.
+    Returns the ETL's result"""
+
+    metrics = EtlMetrics(process_name)
+    metrics_token = CURRENT_METRICS.set(metrics)
+    start = perf_counter()
+
+    try:
+        return run_function(*args, **kwargs)
+
+    finally:
+        CURRENT_METRICS.reset(metrics_token)
+        metrics.add(RUN_STAGE, seconds=perf_counter() - start, calls=1)
+
+        # A failure to save metrics is reported without hiding the run's own error
+        try:
+            with db_manager.transaction() as db_conn:
+                save_metrics(db_conn, metrics)
+
+            if config_env.get("metrics_textfile"):
+                with db_manager.reader() as db_reader:
+                    write_prometheus_textfile(db_reader, config_env["metrics_textfile"])
+
+        except Exception as exc:
+            print(f"{process_name} metrics not saved at {dt.now()}. {exc}")
+
+
+if __name__ == "__main__":
+
+    load_dotenv()
+
+    config = environ
+
+    manager = ConnectionManager(config)
+
+    try:
+        with manager.reader() as reader_conn:
+            if len(sys.argv) > 1:
+                write_prometheus_textfile(reader_conn, sys.argv[1])
+            else:
+                print(get_latest_metrics(reader_conn).to_string(index=False))
+
+    finally:
+        manager.close()
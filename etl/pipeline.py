@@ -0,0 +1,113 @@
+"""Write-behind loading so extraction and loading can overlap"""
+
+from contextvars import copy_context
+from queue import Queue
+from threading import Thread
+from time import perf_counter
+from typing import Callable
+
+from db import ConnectionManager
+
+DEFAULT_MAX_QUEUED_BATCHES = 4
+
+DEFAULT_COMMIT_EVERY = 1
+
+_STOP = object()
+
+
+class WriteBehindLoader:
+    """Loads batches on a dedicated writer thread.
+
+    Extraction submits (load function, arguments) batches into a bounded
+    queue. The writer thread holds the ConnectionManager's writer connection,
+    calls each load function with it and commits every commit_every batches.
+    Once batches are committed, on_commit (if given) is called with each of
+    their load functions' results. submit() blocks while the queue is full, so at most max_queued_batches
+    extracted batches are held in memory. The writer thread runs in a copy
+    of the creating thread's context"""
+
+    def __init__(self, db_manager: ConnectionManager,
+                 max_queued_batches: int = DEFAULT_MAX_QUEUED_BATCHES,
+                 commit_every: int = DEFAULT_COMMIT_EVERY, on_commit: Callable = None):
+        self.db_manager = db_manager
+        self.commit_every = commit_every
+        self.on_commit = on_commit
+        self.batches = Queue(maxsize=max_queued_batches)
+        self.thread = Thread(target=copy_context().run, args=(self._run,),
+                             name="write-behind-loader", daemon=True)
+        self.error = None
+        self.batches_loaded = 0
+        self.load_seconds = 0.0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def start(self) -> None:
+        """Starts the writer thread"""
+
+        self.thread.start()
+
+    def submit(self, load_function, *args) -> None:
+        """Queues a batch to be loaded, waiting while the queue is full"""
+
+        if self.error is not None:
+            raise ChildProcessError("Error: Write-behind loader has failed!") from self.error
+
+        self.batches.put((load_function, args))
+
+    def close(self) -> None:
+        """Waits for every queued batch to be loaded and stops the writer thread"""
+
+        self.batches.put(_STOP)
+        self.thread.join()
+
+        if self.error is not None:
+            raise ChildProcessError("Error: Write-behind loader has failed!") from self.error
+
+    def _commit(self, db_conn, uncommitted_results: list) -> None:
+        """Commits the loaded batches and passes their results to on_commit"""
+
+        db_conn.commit()
+
+        if self.on_commit is not None:
+            for result in uncommitted_results:
+                self.on_commit(result)
+
+        uncommitted_results.clear()
+
+    def _run(self) -> None:
+        """Drains the queue, committing every commit_every batches.
+        After a failure the remaining batches are discarded"""
+
+        with self.db_manager.writer() as db_conn:
+            uncommitted_results = []
+
+            while True:
+                batch = self.batches.get()
+                if batch is _STOP:
+                    break
+                if self.error is not None:
+                    continue
+
+                load_function, args = batch
+                start = perf_counter()
+
+                try:
+                    uncommitted_results.append(load_function(db_conn, *args))
+                    self.batches_loaded += 1
+
+                    if len(uncommitted_results) >= self.commit_every:
+                        self._commit(db_conn, uncommitted_results)
+
+                except Exception as exc:
+                    db_conn.rollback()
+                    self.error = exc
+
+                self.load_seconds += perf_counter() - start
+
+            if self.error is None:
+                self._commit(db_conn, uncommitted_results)
@@ -0,0 +1,230 @@
+"""Adaptive battle log polling for roster players
+
+The battle log endpoint only returns a player's last BATTLE_LOG_WINDOW
+battles, so a player has to be polled before they play more than that or
+battles are missed. Each player's battle rate is estimated from their
+stored battles over the last poll_lookback_days and their next poll is
+set for when they are expected to have played poll_target_fill of the
+window (between poll_min_interval_mins and poll_max_interval_mins).
+Inactive players are polled rarely and active players often.
+
+The next poll time of every player is stored in the roster. PollQueue
+orders players by it (a heap) and RequestBudget limits the API requests
+made per hour, so when more players are due than the budget allows the
+most overdue are polled first."""
+
+import heapq
+from datetime import datetime as dt, timedelta, timezone
+from sqlite3 import Connection, Cursor, DatabaseError
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+BATTLE_LOG_WINDOW = 25
+
+# Player data and battle log
+REQUESTS_PER_POLL = 2
+
+DEFAULT_TARGET_FILL = 0.8
+
+DEFAULT_MIN_POLL_INTERVAL_MINS = 15
+
+DEFAULT_MAX_POLL_INTERVAL_MINS = 24 * 60
+
+DEFAULT_LOOKBACK_DAYS = 7
+
+DEFAULT_REQUESTS_PER_HOUR = 3600
+
+POLL_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+def get_utc_now() -> dt:
+    """Returns the current UTC time, naive like the stored battle times"""
+
+    return dt.now(timezone.utc).replace(tzinfo=None)
+
+
+def get_battle_rates(battle_conn: Connection, player_tags: list[str], now: dt,
+                     lookback_days: float = DEFAULT_LOOKBACK_DAYS) -> pd.Series:
+    """Returns each player's battles per hour since their first stored battle
+    in the lookback period (0 for players without battles in it)"""
+
+    battle_rates = pd.Series(0.0, index=pd.Index(player_tags, dtype=object), name="battle_rate")
+
+    if not player_tags:
+        return battle_rates
+
+    cur = battle_conn.cursor(factory=Cursor)
+    try:
+        cur.execute(f"""SELECT player_tag, COUNT(*), MIN(battle_time)
+                    FROM battle
+                    WHERE player_tag IN ({", ".join("?" * len(player_tags))})
+                    AND battle_time >= ?
+                    GROUP BY player_tag;""",
+                    [*player_tags,
+                     (now - timedelta(days=lookback_days)).strftime(POLL_TIME_FORMAT)])
+
+        player_battles = DataFrame(cur.fetchall(),
+                                   columns=["player_tag", "battles", "first_battle_time"])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    # At least an hour, so a burst of battles just before a poll is not over counted
+    hours = ((now - pd.to_datetime(player_battles["first_battle_time"]))
+             .dt.total_seconds() / 3600).clip(lower=1)
+    battle_rates.update(pd.Series((player_battles["battles"] / hours).to_numpy(),
+                                  index=player_battles["player_tag"]))
+
+    return battle_rates
+
+
+def get_poll_intervals(battle_rates: pd.Series, config_env) -> pd.Series:
+    """Returns the minutes until each player is expected to have played
+    poll_target_fill of the battle log window"""
+
+    target_battles = BATTLE_LOG_WINDOW * float(config_env.get("poll_target_fill",
+                                                               DEFAULT_TARGET_FILL))
+    min_interval = float(config_env.get("poll_min_interval_mins",
+                                        DEFAULT_MIN_POLL_INTERVAL_MINS))
+    max_interval = float(config_env.get("poll_max_interval_mins",
+                                        DEFAULT_MAX_POLL_INTERVAL_MINS))
+
+    with np.errstate(divide="ignore"):
+        poll_intervals = 60 * target_battles / battle_rates
+
+    return poll_intervals.clip(lower=min_interval, upper=max_interval)
+
+
+def get_next_poll_times(battle_conn: Connection, player_tags: list[str], config_env,
+                        now: dt) -> dict[str, str]:
+    """Returns the next poll time of each player from their battle rate"""
+
+    battle_rates = get_battle_rates(battle_conn, player_tags, now,
+                                    float(config_env.get("poll_lookback_days",
+                                                         DEFAULT_LOOKBACK_DAYS)))
+    poll_intervals = get_poll_intervals(battle_rates, config_env)
+
+    return {player_tag: (now + timedelta(minutes=interval)).strftime(POLL_TIME_FORMAT)
+            for player_tag, interval in poll_intervals.items()}
+
+
+def get_roster_polls(db_conn: Connection) -> dict[str, str]:
+    """Returns the next poll time of every active roster player
+    (None for players that have not been polled)"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""SELECT player_tag, next_poll_at
+                    FROM roster
+                    WHERE active = 1;""")
+
+        roster_polls = dict(cur.fetchall())
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    return roster_polls
+
+
+def update_roster_polls(db_conn: Connection, next_poll_times: dict[str, str],
+                        polled_at: dt) -> None:
+    """Records when players were polled and when they are next due"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""UPDATE roster
+                        SET last_polled_at = ?,
+                          next_poll_at = ?
+                        WHERE player_tag = ?;""",
+                        [(polled_at.strftime(POLL_TIME_FORMAT), next_poll_time, player_tag)
+                         for player_tag, next_poll_time in next_poll_times.items()])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to update roster data!") from exc
+
+    finally:
+        cur.close()
+
+
+class PollQueue:
+    """Priority queue of roster players ordered by next poll time.
+
+    Rescheduled or removed players leave their old heap entries behind,
+    they are skipped when popped (next_polls holds the current time)"""
+
+    def __init__(self):
+        self.heap = []
+        self.next_polls = {}
+
+    def __len__(self) -> int:
+        return len(self.next_polls)
+
+    def schedule(self, player_tag: str, next_poll_at: str) -> None:
+        """Sets a player's next poll time ('' to poll as soon as possible)"""
+
+        self.next_polls[player_tag] = next_poll_at
+        heapq.heappush(self.heap, (next_poll_at, player_tag))
+
+    def sync(self, roster_polls: dict[str, str]) -> None:
+        """Adds new and rescheduled roster players and drops removed players"""
+
+        for player_tag in self.next_polls.keys() - roster_polls.keys():
+            del self.next_polls[player_tag]
+
+        for player_tag, next_poll_at in roster_polls.items():
+            next_poll_at = next_poll_at or ""
+            if self.next_polls.get(player_tag) != next_poll_at:
+                self.schedule(player_tag, next_poll_at)
+
+        # Rebuilt when mostly stale entries, so the heap stays the size of the roster
+        if len(self.heap) > 2 * len(self.next_polls) + 1:
+            self.heap = [(next_poll_at, player_tag)
+                         for player_tag, next_poll_at in self.next_polls.items()]
+            heapq.heapify(self.heap)
+
+    def pop_due(self, now: dt, limit: int) -> list[str]:
+        """Removes and returns up to limit players due by now, most overdue first"""
+
+        now = now.strftime(POLL_TIME_FORMAT)
+        due_player_tags = []
+
+        while self.heap and len(due_player_tags) < limit and self.heap[0][0] <= now:
+            next_poll_at, player_tag = heapq.heappop(self.heap)
+            if self.next_polls.get(player_tag) == next_poll_at:
+                del self.next_polls[player_tag]
+                due_player_tags.append(player_tag)
+
+        return due_player_tags
+
+
+class RequestBudget:
+    """Token bucket of API requests, refilled at requests_per_hour and
+    holding at most one hour of requests"""
+
+    def __init__(self, requests_per_hour: float = DEFAULT_REQUESTS_PER_HOUR, now: dt = None):
+        self.requests_per_hour = requests_per_hour
+        self.available = requests_per_hour
+        self.refilled_at = now or get_utc_now()
+
+    def get_available(self, now: dt) -> int:
+        """Returns the requests that can be made now"""
+
+        hours = max((now - self.refilled_at).total_seconds() / 3600, 0)
+        self.available = min(self.available + hours * self.requests_per_hour,
+                             self.requests_per_hour)
+        self.refilled_at = now
+
+        return int(self.available)
+
+    def spend(self, requests: int) -> None:
+        """Takes requests made from the budget"""
+
+        self.available -= requests
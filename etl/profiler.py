@@ -0,0 +1,111 @@
+"""Opt-in profiling of ETL runs
+
+With etl_profile set to a comma separated list of ETL stages (brawler_etl,
+player_etl, battle_log_etl, or all), or main.py run with --profile [stages],
+each ETL named is run under cProfile and tracemalloc. Its profile is dumped
+to etl_profile_dir as a pstats file (which snakeviz, flameprof and
+gprof2dot read) next to a text file of its top allocation sites. When
+etl_profile is unset the ETLs are not wrapped at all, so profiling costs
+nothing.
+
+cProfile only follows the thread the ETL runs on (work the ETL hands to its
+thread pools shows up as waits on them), while tracemalloc traces every
+thread. As both are process wide in effect, profiled ETLs run one at a time.
+
+Usage: python ./etl/profiler.py [pstats path] [lines]"""
+
+import os
+import sys
+import cProfile
+import pstats
+import tracemalloc
+from datetime import datetime as dt
+from threading import Lock
+from typing import Callable
+
+PROFILE_ALL = "all"
+
+DEFAULT_PROFILE_DIR = "profiles"
+
+DEFAULT_TOP_ALLOCATIONS = 25
+
+DEFAULT_STATS_LINES = 30
+
+PROFILE_LOCK = Lock()
+
+
+def get_profiled_stages(config_env, stage_names: list[str]) -> set[str]:
+    """Returns the stages named in etl_profile (every stage for 'all')"""
+
+    profiled_stages = {stage_name.strip()
+                       for stage_name in config_env.get("etl_profile", "").split(",")
+                       if stage_name.strip()}
+
+    if PROFILE_ALL in profiled_stages:
+        return set(stage_names)
+
+    return profiled_stages & set(stage_names)
+
+
+def format_top_allocations(snapshot: tracemalloc.Snapshot, limit: int) -> str:
+    """Returns the source lines allocating the most memory still held"""
+
+    top_stats = snapshot.filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>")]).statistics("lineno")
+
+    return "\n".join(str(stat) for stat in top_stats[:limit]) + "\n"
+
+
+def profile_stage(stage_name: str, run_function: Callable, config_env) -> Callable:
+    """Returns the function run under cProfile and tracemalloc, dumping its
+    pstats and top allocation sites to etl_profile_dir"""
+
+    profile_dir = config_env.get("etl_profile_dir", DEFAULT_PROFILE_DIR)
+    top_allocations = int(config_env.get("etl_profile_top_allocations",
+                                         DEFAULT_TOP_ALLOCATIONS))
+
+    def run_profiled(*args, **kwargs):
+        with PROFILE_LOCK:
+            profile_path = os.path.join(profile_dir,
+                                        f"{stage_name}_{dt.now():%Y%m%dT%H%M%S}")
+            stage_profile = cProfile.Profile()
+            tracing = tracemalloc.is_tracing()
+
+            if not tracing:
+                tracemalloc.start()
+
+            tracemalloc.reset_peak()
+            stage_profile.enable()
+
+            # The profile of a failed run is still dumped
+            try:
+                return run_function(*args, **kwargs)
+
+            finally:
+                stage_profile.disable()
+                snapshot = tracemalloc.take_snapshot()
+                peak_memory = tracemalloc.get_traced_memory()[1]
+
+                if not tracing:
+                    tracemalloc.stop()
+
+                os.makedirs(profile_dir, exist_ok=True)
+                stage_profile.dump_stats(f"{profile_path}.pstats")
+
+                with open(f"{profile_path}_allocations.txt", "w",
+                          encoding="utf-8") as allocations_file:
+                    allocations_file.write(f"Peak traced memory: {peak_memory} bytes\n")
+                    allocations_file.write(format_top_allocations(snapshot, top_allocations))
+
+                print(f"{stage_name} profile written to {profile_path}.pstats at {dt.now()}")
+
+    return run_profiled
+
+
+if __name__ == "__main__":
+
+    stats_lines = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_STATS_LINES
+
+    pstats.Stats(sys.argv[1]).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(stats_lines)
@@ -0,0 +1,255 @@
+"""Incremental hourly, daily and weekly rollups of player history"""
+
+from sqlite3 import Connection, Cursor, DatabaseError
+
+import pandas as pd
+from pandas import DataFrame
+
+from load import dataframe_to_rows
+
+# Raw snapshot table -> (primary key column, {stat name: value column})
+ROLLUP_SOURCES = {
+    "player_trophies": ("player_trophies_id", {"trophies": "trophies",
+                                               "highest_trophies": "highest_trophies"}),
+    "player_exp": ("player_exp_id", {"exp_points": "exp_points",
+                                     "exp_level": "exp_level"}),
+    "player_victories": ("player_victories_id", {"3vs3_victories": "_3vs3_victories",
+                                                 "solo_victories": "solo_victories",
+                                                 "duo_victories": "duo_victories"})
+}
+
+GRANULARITIES = ("hour", "day", "week")
+
+DEFAULT_RETENTION_DAYS = 90
+
+
+def get_bucket_start(created_at: pd.Series, granularity: str) -> pd.Series:
+    """Returns the start of the hour/day/week (weeks start on Monday)
+    each timestamp falls into"""
+
+    timestamps = pd.to_datetime(created_at)
+
+    if granularity == "hour":
+        bucket_start = timestamps.dt.floor("h")
+    elif granularity == "day":
+        bucket_start = timestamps.dt.floor("D")
+    elif granularity == "week":
+        bucket_start = (timestamps.dt.floor("D")
+                        - pd.to_timedelta(timestamps.dt.dayofweek, unit="D"))
+    else:
+        raise ValueError(f"Error: Unknown rollup granularity '{granularity}'!")
+
+    return bucket_start.dt.strftime("%Y-%m-%d %H:%M:%S")
+
+
+def get_rollup_checkpoint(db_conn: Connection, source_table: str) -> int:
+    """Returns the last raw row ID rolled up for a source table"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""SELECT last_rolled_up_id
+                    FROM rollup_checkpoint
+                    WHERE source_table = ?;""", [source_table])
+
+        checkpoint = cur.fetchone()
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    if not checkpoint:
+        return 0
+
+    return checkpoint[0]
+
+
+def get_new_snapshot_rows(db_conn: Connection, source_table: str,
+                          last_rolled_up_id: int) -> DataFrame:
+    """Returns raw snapshot rows newer than the checkpoint, one row per stat"""
+
+    id_column, stat_columns = ROLLUP_SOURCES[source_table]
+    value_columns = ", ".join(stat_columns.values())
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute(f"""SELECT {id_column}, player_id, created_at, {value_columns}
+                    FROM {source_table}
+                    WHERE {id_column} > ?
+                    ORDER BY {id_column};""", [last_rolled_up_id])
+
+        snapshot_rows = cur.fetchall()
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    snapshot_df = DataFrame(snapshot_rows,
+                            columns=["row_id", "player_id", "created_at", *stat_columns])
+
+    return snapshot_df.melt(id_vars=["row_id", "player_id", "created_at"],
+                            var_name="stat_name", value_name="value").dropna(subset=["value"])
+
+
+def aggregate_snapshot_rows(snapshot_df: DataFrame, granularity: str) -> DataFrame:
+    """Aggregates snapshot rows into first/last/min/max values per
+    player, stat and bucket"""
+
+    snapshot_df = snapshot_df.assign(
+        bucket_start=get_bucket_start(snapshot_df["created_at"], granularity)
+    ).sort_values("row_id")
+
+    rollup_df = snapshot_df.groupby(["player_id", "stat_name", "bucket_start"],
+                                    as_index=False).agg(first_value=("value", "first"),
+                                                        last_value=("value", "last"),
+                                                        min_value=("value", "min"),
+                                                        max_value=("value", "max"),
+                                                        sample_count=("value", "size"))
+    rollup_df["granularity"] = granularity
+
+    return rollup_df
+
+
+def upsert_rollups(db_conn: Connection, rollup_df: DataFrame) -> None:
+    """Merges aggregated rows into player_stat_rollup. Existing buckets keep
+    their first value and take the newest last value"""
+
+    rollup_rows = dataframe_to_rows(rollup_df, ["player_id", "stat_name", "granularity",
+                                                "bucket_start", "first_value", "last_value",
+                                                "min_value", "max_value", "sample_count"])
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""INSERT INTO player_stat_rollup
+                        (player_id, stat_name, granularity, bucket_start, first_value,
+                        last_value, min_value, max_value, sample_count)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (player_id, stat_name, granularity, bucket_start)
+                        DO UPDATE SET
+                          last_value = excluded.last_value,
+                          min_value = MIN(min_value, excluded.min_value),
+                          max_value = MAX(max_value, excluded.max_value),
+                          sample_count = sample_count + excluded.sample_count;""",
+                        rollup_rows)
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert rollup data!") from exc
+
+    finally:
+        cur.close()
+
+
+def update_rollup_checkpoint(db_conn: Connection, source_table: str,
+                             last_rolled_up_id: int) -> None:
+    """Stores the last raw row ID rolled up for a source table"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""INSERT INTO rollup_checkpoint
+                    (source_table, last_rolled_up_id)
+                    VALUES (?, ?)
+                    ON CONFLICT (source_table) DO UPDATE SET
+                      last_rolled_up_id = excluded.last_rolled_up_id,
+                      last_updated = datetime('now');""", [source_table, last_rolled_up_id])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to update rollup checkpoint!") from exc
+
+    finally:
+        cur.close()
+
+
+def rollup_player_history(db_conn: Connection) -> int:
+    """Rolls up raw snapshot rows newer than each table's checkpoint
+    into hourly, daily and weekly buckets. Returns raw rows processed"""
+
+    rows_processed = 0
+
+    for source_table in ROLLUP_SOURCES:
+        last_rolled_up_id = get_rollup_checkpoint(db_conn, source_table)
+        snapshot_df = get_new_snapshot_rows(db_conn, source_table, last_rolled_up_id)
+
+        if snapshot_df.empty:
+            continue
+
+        for granularity in GRANULARITIES:
+            upsert_rollups(db_conn, aggregate_snapshot_rows(snapshot_df, granularity))
+
+        update_rollup_checkpoint(db_conn, source_table, int(snapshot_df["row_id"].max()))
+        rows_processed += snapshot_df["row_id"].nunique()
+
+    return rows_processed
+
+
+def compact_player_history(db_conn: Connection,
+                           retention_days: int = DEFAULT_RETENTION_DAYS) -> int:
+    """Deletes raw snapshot rows older than the retention period that have
+    already been rolled up. The latest row of each player is always kept so
+    current values can still be read, older values are read from the hourly
+    rollups (see extract.get_player_snapshot_at). Returns rows deleted"""
+
+    rows_deleted = 0
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+
+        for source_table, (id_column, _) in ROLLUP_SOURCES.items():
+            cur.execute(f"""DELETE FROM {source_table}
+                        WHERE created_at < datetime('now', ?)
+                        AND {id_column} <= (SELECT last_rolled_up_id
+                                            FROM rollup_checkpoint
+                                            WHERE source_table = ?)
+                        AND {id_column} NOT IN (SELECT MAX({id_column})
+                                                FROM {source_table}
+                                                GROUP BY player_id);""",
+                        [f"-{retention_days} days", source_table])
+            rows_deleted += cur.rowcount
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to compact player history!") from exc
+
+    finally:
+        cur.close()
+
+    return rows_deleted
+
+
+def get_player_stat_history(db_conn: Connection, player_id: int, stat_name: str,
+                            granularity: str, since: str) -> DataFrame:
+    """Returns rolled up history of a player stat since a timestamp, with
+    the change since the previous bucket (history is only read from the
+    bucket before the timestamp onwards, not from the raw tables)"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""
+            WITH stat_buckets AS (
+              SELECT bucket_start, first_value, last_value, min_value, max_value,
+                last_value - LAG(last_value, 1, first_value) OVER (ORDER BY bucket_start) AS delta
+              FROM player_stat_rollup
+              WHERE player_id = :player_id AND stat_name = :stat_name
+              AND granularity = :granularity
+              AND bucket_start >= (SELECT COALESCE(MAX(bucket_start), :since)
+                                   FROM player_stat_rollup
+                                   WHERE player_id = :player_id AND stat_name = :stat_name
+                                   AND granularity = :granularity AND bucket_start < :since)
+            )
+            SELECT *
+            FROM stat_buckets
+            WHERE bucket_start >= :since
+            ORDER BY bucket_start;""", {"player_id": player_id, "stat_name": stat_name,
+                                        "granularity": granularity, "since": since})
+
+        stat_history = cur.fetchall()
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    return DataFrame(stat_history, columns=["bucket_start", "first_value", "last_value",
+                                            "min_value", "max_value", "delta"])
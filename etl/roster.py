@@ -0,0 +1,429 @@
+"""Roster of tracked players and the roster ETL
+
+The roster table lists every tracked player. The roster ETL runs the
+player and battle log ETLs for the whole roster in batches of
+roster_batch_size players. Each batch is extracted from the API
+concurrently (roster_workers players at a time), its battles are
+transformed into one dataframe and filtered against every player's most
+recent stored battle in one query, and the batch is loaded in one
+transaction. A player whose extraction, transform or load fails is
+skipped (their load is rolled back to a savepoint) and the rest of the
+batch is still loaded.
+
+After each batch every player's next poll time is set from their battle
+rate (see polling.py). run_roster_polls only polls the players that are
+due, within the API request budget, and is run by the scheduler.
+
+A run over the whole roster records the last player of each completed
+batch (see checkpoint.py), so after a failed run the next run resumes
+from the first player that was not committed.
+
+Usage: python ./etl/roster.py [add|remove|list|run] [player tags]"""
+
+import sys
+from os import environ
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from contextvars import copy_context
+from datetime import datetime as dt, timedelta
+from sqlite3 import Connection, Cursor, DatabaseError
+
+from dotenv import load_dotenv
+from pandas import DataFrame, Series
+
+from db import ConnectionManager, transaction, savepoint
+from backend import StorageBackend, get_load_backend
+from shard import ShardRouter, get_shard_count
+from cache import bump_data_generation
+from checkpoint import (get_checkpoint_max_age_hours, get_last_checkpoint,
+                        get_remaining_player_tags, record_checkpoint, clear_checkpoints)
+from metrics import stage
+from extract import (format_player_tag, get_api_player_data, get_api_player_battle_log,
+                     get_events_latest_version, size_api_session_pool)
+from transform import (transform_player_data_api, normalise_battle, transform_battle_log_events,
+                       generate_event_changes, BATTLE_LOG_COLUMNS)
+from main import get_process_id, update_process_log, load_player_data
+from polling import (PollQueue, RequestBudget, get_next_poll_times, get_roster_polls,
+                     update_roster_polls, get_utc_now, REQUESTS_PER_POLL,
+                     DEFAULT_MIN_POLL_INTERVAL_MINS, POLL_TIME_FORMAT)
+
+DEFAULT_ROSTER_BATCH_SIZE = 500
+
+DEFAULT_ROSTER_WORKERS = 16
+
+
+def get_roster_player_tags(db_conn: Connection) -> list[str]:
+    """Returns the tags of every active player in the roster"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""SELECT player_tag
+                    FROM roster
+                    WHERE active = 1
+                    ORDER BY player_tag;""")
+
+        roster_player_tags = [player_tag for player_tag, in cur.fetchall()]
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    return roster_player_tags
+
+
+def add_roster_players(db_conn: Connection, player_tags: list[str]) -> None:
+    """Adds players to the roster (reactivating removed players)"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""INSERT INTO roster
+                        (player_tag)
+                        VALUES (?)
+                        ON CONFLICT (player_tag) DO UPDATE SET
+                          active = 1;""",
+                        [(f"#{format_player_tag(player_tag)}",) for player_tag in player_tags])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert roster data!") from exc
+
+    finally:
+        cur.close()
+
+
+def remove_roster_players(db_conn: Connection, player_tags: list[str]) -> None:
+    """Removes players from the roster (they are kept inactive)"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""UPDATE roster
+                        SET active = 0
+                        WHERE player_tag = ?;""",
+                        [(f"#{format_player_tag(player_tag)}",) for player_tag in player_tags])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to update roster data!") from exc
+
+    finally:
+        cur.close()
+
+
+def get_latest_battle_times(db_conn: Connection, player_tags: list[str]) -> dict[str, str]:
+    """Returns the most recent stored battle time of each player that has battles"""
+
+    if not player_tags:
+        return {}
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute(f"""SELECT player_tag, MAX(battle_time)
+                    FROM battle
+                    WHERE player_tag IN ({", ".join("?" * len(player_tags))})
+                    GROUP BY player_tag;""", player_tags)
+
+        latest_battle_times = dict(cur.fetchall())
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    return latest_battle_times
+
+
+def extract_roster_player(api_token: str, player_tag: str) -> tuple[dict, dict]:
+    """Returns a player's data and battle log from the API"""
+
+    return (get_api_player_data(api_token, player_tag),
+            get_api_player_battle_log(api_token, player_tag))
+
+
+def extract_roster_batch(api_token: str, player_tags: list[str],
+                         max_workers: int = DEFAULT_ROSTER_WORKERS) -> tuple[dict, dict]:
+    """Extracts a batch of players concurrently. Returns the (player data,
+    battle log) of each player extracted and the error of each player that failed"""
+
+    # A pooled connection per worker, so workers do not open connections the pool discards
+    size_api_session_pool(max_workers)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        player_runs = {player_tag: executor.submit(copy_context().run, extract_roster_player,
+                                                   api_token, player_tag)
+                       for player_tag in player_tags}
+
+    extracted_players, failures = {}, {}
+
+    for player_tag, player_run in player_runs.items():
+        try:
+            extracted_players[player_tag] = player_run.result()
+        except Exception as exc:
+            failures[player_tag] = exc
+
+    return extracted_players, failures
+
+
+def transform_roster_battle_logs(db_conn: Connection,
+                                 battle_logs: dict[str, dict]) -> tuple[DataFrame, dict]:
+    """Transforms the battle logs of a batch into one dataframe of the battles
+    newer than each player's most recent stored battle. Returns the battles
+    and the error of each player whose battle log could not be transformed"""
+
+    battles, failures = [], {}
+
+    for player_tag, battle_log_data in battle_logs.items():
+        try:
+            #Ignore map maker events
+            player_battles = [normalise_battle(battle, player_tag)
+                              for battle in battle_log_data["items"]
+                              if battle["event"]["id"] != 0]
+            battles.extend(player_battles)
+        except Exception as exc:
+            failures[player_tag] = exc
+
+    battle_log_df = DataFrame(battles, columns=BATTLE_LOG_COLUMNS)
+    latest_battle_times = Series(get_latest_battle_times(
+        db_conn, battle_log_df["player_tag"].unique().tolist()), dtype=object)
+    latest_battle_time = battle_log_df["player_tag"].map(latest_battle_times)
+
+    battle_log_df = battle_log_df[latest_battle_time.isna()
+                                  | (battle_log_df["battle_time"] > latest_battle_time)]
+
+    return battle_log_df.reset_index(drop=True), failures
+
+
+def load_roster_batch(conn: Connection, battle_conn: Connection, player_data_batch: dict,
+                      battle_log_df: DataFrame, snapshot_cache: dict, storage: StorageBackend,
+                      checkpoint: tuple[int, str, str] = None) -> tuple[int, dict]:
+    """Loads a transformed batch through storage in one transaction. Events are
+    loaded on conn, players and battles on battle_conn (the batch's shard when
+    storage is sharded), with the batch's (process_id, stage, last_player_tag) checkpoint
+    if given. Returns the number of new battles and the error of each player
+    whose load failed and was rolled back"""
+
+    failures = {}
+
+    with transaction(conn), transaction(battle_conn):
+        event_changes_df = generate_event_changes(get_events_latest_version(conn),
+                                                  transform_battle_log_events(battle_log_df))
+        storage.load_catalogue_changes(conn, "bs_event", event_changes_df)
+
+        for player_tag, player_data in player_data_batch.items():
+            try:
+                with savepoint(battle_conn, "roster_player"):
+                    load_player_data(battle_conn, player_data, snapshot_cache, storage)
+            except Exception as exc:
+                failures[player_tag] = exc
+
+        # A player whose load was rolled back has none of their battles loaded
+        battle_log_df = battle_log_df[~battle_log_df["player_tag"].isin(
+            [f"#{format_player_tag(player_tag)}" for player_tag in failures])]
+
+        # Battles are loaded in bulk, falling back to each player's battles
+        # on their own so a player with bad battle data does not stop the batch
+        try:
+            with savepoint(battle_conn, "roster_battles"):
+                battles_loaded = len(storage.load_battles(battle_conn, battle_log_df))
+
+        except Exception:
+            battles_loaded = 0
+            for player_tag, player_battle_log_df in battle_log_df.groupby("player_tag"):
+                try:
+                    with savepoint(battle_conn, "roster_battles"):
+                        battles_loaded += len(storage.load_battles(battle_conn,
+                                                                   player_battle_log_df))
+                except Exception as exc:
+                    failures[player_tag] = exc
+
+        if checkpoint:
+            record_checkpoint(battle_conn, *checkpoint)
+
+        bump_data_generation(conn)
+        if battle_conn is not conn:
+            bump_data_generation(battle_conn)
+
+    return battles_loaded, failures
+
+
+def etl_roster_batch(db_manager: ConnectionManager, battle_manager: ConnectionManager,
+                     config_parameters: dict, player_tags: list[str],
+                     snapshot_cache: dict, storage: StorageBackend,
+                     checkpoint: tuple[int, str, str] = None) -> dict:
+    """ETL for one batch of roster players, loaded through storage and
+    recording its checkpoint with the batch if given. Returns the players
+    and battles loaded and the error of each player that failed"""
+
+    max_workers = int(config_parameters.get("roster_workers", DEFAULT_ROSTER_WORKERS))
+
+    #Extract
+    with stage("extract_roster_data") as stage_counts:
+        extracted_players, failures = extract_roster_batch(config_parameters["api_token"],
+                                                           player_tags, max_workers)
+        stage_counts["records"] = len(extracted_players)
+
+    #Transform
+    with stage("transform_roster_data") as stage_counts:
+        player_data_batch, battle_logs = {}, {}
+        for player_tag, (player_data_api, battle_log_api) in extracted_players.items():
+            try:
+                player_data_batch[player_tag] = transform_player_data_api(player_data_api)
+                battle_logs[player_tag] = battle_log_api
+            except Exception as exc:
+                failures[player_tag] = exc
+        stage_counts["records"] = len(player_data_batch)
+
+    with db_manager.writer() as conn, battle_manager.writer() as battle_conn:
+        with stage("transform_roster_battle_logs") as stage_counts:
+            battle_log_df, transform_failures = transform_roster_battle_logs(battle_conn,
+                                                                             battle_logs)
+            failures.update(transform_failures)
+            stage_counts["records"] = len(battle_log_df)
+
+        #Load
+        with stage("load_roster_data", conn, battle_conn) as stage_counts:
+            battles_loaded, load_failures = load_roster_batch(conn, battle_conn,
+                                                              player_data_batch,
+                                                              battle_log_df, snapshot_cache,
+                                                              storage, checkpoint)
+            failures.update(load_failures)
+            stage_counts["records"] = len(player_data_batch)
+
+        # Failed players are retried after the minimum poll interval
+        polled_at = get_utc_now()
+        next_poll_times = get_next_poll_times(
+            battle_conn, list(player_data_batch.keys() - load_failures.keys()),
+            config_parameters, polled_at)
+        retry_minutes = float(config_parameters.get("poll_min_interval_mins",
+                                                    DEFAULT_MIN_POLL_INTERVAL_MINS))
+        next_poll_times.update(dict.fromkeys(
+            failures, (polled_at + timedelta(minutes=retry_minutes)).strftime(POLL_TIME_FORMAT)))
+
+        with transaction(conn):
+            update_roster_polls(conn, next_poll_times, polled_at)
+
+    return {"players_loaded": len(player_data_batch.keys() - load_failures.keys()),
+            "battles_loaded": battles_loaded,
+            "failures": failures}
+
+
+def etl_roster(db_manager: ConnectionManager, config_parameters: dict,
+               shard_router: ShardRouter = None, player_tags: list[str] = None) -> dict:
+    """ETL for every player in the roster (or the roster players given), in
+    batches (per shard when storage is sharded). A run over the whole roster
+    skips the players committed by an unfinished earlier run. Returns the
+    players and battles loaded and the error of each player that failed"""
+
+    batch_size = int(config_parameters.get("roster_batch_size", DEFAULT_ROSTER_BATCH_SIZE))
+    roster_summary = {"players_loaded": 0, "battles_loaded": 0, "failures": {}}
+
+    #Update Process Log - Start (process log and roster are kept in the catalogue database)
+    with db_manager.writer() as conn:
+        process_id = get_process_id(conn, "Roster ETL")
+        update_process_log(conn, process_id, "Start")
+        checkpointed = player_tags is None
+        if checkpointed:
+            player_tags = get_roster_player_tags(conn)
+
+    shard_player_tags = (shard_router.group_player_tags(player_tags) if shard_router
+                         else {0: player_tags})
+
+    try:
+        with closing(get_load_backend(config_parameters)) as storage:
+            for shard_index, shard_tags in shard_player_tags.items():
+                battle_manager = shard_router.shards[shard_index] if shard_router else db_manager
+                shard_name = f"shard_{shard_index}"
+                # Player IDs are only unique within a shard, so each shard has its own cache
+                snapshot_cache = {}
+
+                # Checkpoints are kept with the batches, in the shard's database
+                if checkpointed:
+                    with battle_manager.reader() as battle_reader:
+                        shard_tags = get_remaining_player_tags(
+                            shard_tags, get_last_checkpoint(
+                                battle_reader, process_id, shard_name,
+                                get_checkpoint_max_age_hours(config_parameters)))
+
+                for start in range(0, len(shard_tags), batch_size):
+                    batch_tags = shard_tags[start:start + batch_size]
+                    batch_summary = etl_roster_batch(db_manager, battle_manager, config_parameters,
+                                                     batch_tags, snapshot_cache, storage,
+                                                     ((process_id, shard_name, batch_tags[-1])
+                                                      if checkpointed else None))
+                    roster_summary["players_loaded"] += batch_summary["players_loaded"]
+                    roster_summary["battles_loaded"] += batch_summary["battles_loaded"]
+                    roster_summary["failures"].update(batch_summary["failures"])
+
+    except Exception as exc:
+        with db_manager.writer() as conn:
+            update_process_log(conn, process_id, "Failed")
+        raise ChildProcessError("Error within Roster ETL process!") from exc
+
+    #Update Process Log - End
+    if checkpointed:
+        for battle_manager in (shard_router.shards if shard_router else [db_manager]):
+            with battle_manager.transaction() as battle_conn:
+                clear_checkpoints(battle_conn, process_id)
+
+    with db_manager.writer() as conn:
+        update_process_log(conn, process_id, "End")
+
+    return roster_summary
+
+
+def run_roster_polls(db_manager: ConnectionManager, config_parameters: dict,
+                     shard_router: ShardRouter, poll_queue: PollQueue,
+                     request_budget: RequestBudget, now: dt = None) -> dict:
+    """Runs the roster ETL for the players due to be polled, most overdue
+    first, as many as the request budget allows. Returns the roster ETL summary"""
+
+    now = now or get_utc_now()
+
+    with db_manager.reader() as db_reader:
+        poll_queue.sync(get_roster_polls(db_reader))
+
+    player_tags = poll_queue.pop_due(now, request_budget.get_available(now) // REQUESTS_PER_POLL)
+    request_budget.spend(len(player_tags) * REQUESTS_PER_POLL)
+
+    try:
+        return etl_roster(db_manager, config_parameters, shard_router, player_tags)
+
+    finally:
+        # Picks up the new poll times (players whose batch failed are due again)
+        with db_manager.reader() as db_reader:
+            poll_queue.sync(get_roster_polls(db_reader))
+
+
+if __name__ == "__main__":
+
+    load_dotenv()
+
+    config = environ
+
+    shard_router = ShardRouter(config) if get_shard_count(config) else None
+    db_manager = shard_router.catalogue if shard_router else ConnectionManager(config)
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+
+    try:
+        if command == "add":
+            with db_manager.transaction() as db_conn:
+                add_roster_players(db_conn, sys.argv[2:])
+        elif command == "remove":
+            with db_manager.transaction() as db_conn:
+                remove_roster_players(db_conn, sys.argv[2:])
+        elif command == "run":
+            summary = etl_roster(db_manager, config, shard_router)
+            for failed_player_tag, error in summary["failures"].items():
+                print(f"Roster ETL failed for {failed_player_tag}. {error}")
+            print(f"Roster ETL loaded {summary['players_loaded']} players and "
+                  f"{summary['battles_loaded']} battles")
+        else:
+            with db_manager.reader() as db_reader:
+                print("\n".join(get_roster_player_tags(db_reader)))
+
+    finally:
+        if shard_router:
+            shard_router.close()
+        else:
+            db_manager.close()
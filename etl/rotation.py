@@ -0,0 +1,185 @@
+"""Event rotation ETL, refreshed when the rotation changes
+
+Every slot of the event rotation has a startTime and an endTime, so the
+rotation only changes when a slot ends. Rather than polling on a timer the
+event rotation ETL is run again at the earliest upcoming slot end (plus
+rotation_refresh_delay_secs, as the API takes a moment to rotate), so new
+maps are picked up within seconds of rotating in. A rotation whose slots
+have all ended (the API has not rotated yet) is fetched again after
+rotation_retry_secs.
+
+Every slot seen is kept in the event_slot timeline (slot, event, start and
+end as unix seconds), so the rotation at any time can be read back.
+
+Usage: python ./etl/rotation.py"""
+
+from os import environ
+from calendar import timegm
+from contextlib import closing
+from datetime import datetime as dt, timedelta
+from sqlite3 import Connection, Cursor, DatabaseError
+
+from dotenv import load_dotenv
+from pandas import DataFrame
+
+from db import ConnectionManager, transaction
+from backend import get_load_backend
+from cache import bump_data_generation
+from extract import extract_event_data_api, get_events_latest_version
+from transform import transform_event_data_api, generate_event_changes
+from main import get_process_id, update_process_log
+from metrics import stage
+from polling import get_utc_now
+
+API_TIME_FORMAT = "%Y%m%dT%H%M%S.%fZ"
+
+EVENT_SLOT_COLUMNS = ["slot_id", "start_time", "end_time", "bs_event_id"]
+
+DEFAULT_REFRESH_DELAY_SECS = 5
+
+DEFAULT_RETRY_SECS = 30
+
+DEFAULT_MAX_REFRESH_MINS = 60
+
+
+def to_unix_time(time_api_format: str) -> int:
+    """Returns a UTC time from the API as unix seconds"""
+
+    return timegm(dt.strptime(time_api_format, API_TIME_FORMAT).timetuple())
+
+
+def transform_event_slots(event_data_api: list[dict]) -> DataFrame:
+    """Transforms event rotation data into slot, start, end and event rows"""
+
+    return DataFrame([(event["slotId"], to_unix_time(event["startTime"]),
+                       to_unix_time(event["endTime"]), event["event"]["id"])
+                      for event in event_data_api], columns=EVENT_SLOT_COLUMNS)
+
+
+def insert_event_slots(db_conn: Connection, event_slot_df: DataFrame) -> None:
+    """Inserts rotation slots into the timeline, updating slots already stored"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""INSERT INTO event_slot
+                        (slot_id, start_time, end_time, bs_event_id)
+                        VALUES (?, ?, ?, ?)
+                        ON CONFLICT (slot_id, start_time) DO UPDATE SET
+                          end_time = excluded.end_time,
+                          bs_event_id = excluded.bs_event_id;""",
+                        event_slot_df[EVENT_SLOT_COLUMNS].itertuples(index=False, name=None))
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert event slot data!") from exc
+
+    finally:
+        cur.close()
+
+
+def get_event_rotation(db_conn: Connection, at_time: dt) -> DataFrame:
+    """Returns the slots of the rotation at a UTC time with their event's
+    mode and map"""
+
+    unix_time = timegm(at_time.timetuple())
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute("""SELECT es.slot_id, es.start_time, es.end_time, es.bs_event_id,
+                      bec.mode, bec.map
+                    FROM event_slot es
+                    LEFT JOIN bs_event_current bec
+                    ON es.bs_event_id = bec.bs_event_id
+                    WHERE es.start_time <= ?
+                    AND es.end_time > ?
+                    ORDER BY es.slot_id;""", [unix_time, unix_time])
+
+        event_rotation_df = DataFrame(cur.fetchall(),
+                                      columns=[*EVENT_SLOT_COLUMNS, "mode", "map"])
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    return event_rotation_df
+
+
+def get_refresh_delay(event_slot_df: DataFrame, now: dt, config_env) -> timedelta:
+    """Returns the time until the rotation should be fetched again: the
+    earliest upcoming slot end plus the refresh delay, at most
+    rotation_max_refresh_mins away"""
+
+    refresh_delay = timedelta(seconds=float(config_env.get("rotation_refresh_delay_secs",
+                                                           DEFAULT_REFRESH_DELAY_SECS)))
+    max_refresh = timedelta(minutes=float(config_env.get("rotation_max_refresh_mins",
+                                                         DEFAULT_MAX_REFRESH_MINS)))
+    unix_now = timegm(now.timetuple())
+    upcoming_ends = event_slot_df.loc[event_slot_df["end_time"] > unix_now, "end_time"]
+
+    if upcoming_ends.empty:
+        return timedelta(seconds=float(config_env.get("rotation_retry_secs",
+                                                      DEFAULT_RETRY_SECS)))
+
+    return min(timedelta(seconds=int(upcoming_ends.min()) - unix_now) + refresh_delay,
+               max_refresh)
+
+
+def etl_event_rotation(db_manager: ConnectionManager, config_parameters: dict) -> timedelta:
+    """ETL for the event rotation. Loads new events and the rotation's slots
+    and returns the time until the rotation should be fetched again"""
+
+    #Update Process Log - Start
+    with db_manager.writer() as conn:
+        process_id = get_process_id(conn, "Event Rotation ETL")
+        update_process_log(conn, process_id, "Start")
+
+    try:
+        #Extract
+        with stage("extract_event_rotation") as stage_counts:
+            event_data_api = extract_event_data_api(config_parameters)
+            now = get_utc_now()
+            stage_counts["records"] = len(event_data_api)
+
+        #Transform
+        with stage("transform_event_rotation") as stage_counts:
+            event_slot_df = transform_event_slots(event_data_api)
+            event_data_df = transform_event_data_api(event_data_api)
+            stage_counts["records"] = len(event_slot_df)
+
+        #Load
+        with closing(get_load_backend(config_parameters)) as storage:
+            with db_manager.writer() as conn, transaction(conn), stage("load_event_rotation",
+                                                                       conn) as stage_counts:
+                stage_counts["records"] = len(event_slot_df)
+                event_changes_df = generate_event_changes(get_events_latest_version(conn),
+                                                          event_data_df)
+                storage.load_catalogue_changes(conn, "bs_event", event_changes_df)
+                insert_event_slots(conn, event_slot_df)
+                bump_data_generation(conn)
+
+                #Update Process Log - End
+                update_process_log(conn, process_id, "End")
+
+    except Exception as exc:
+        with db_manager.writer() as conn:
+            update_process_log(conn, process_id, "Failed")
+        raise ChildProcessError("Error within Event Rotation ETL process!") from exc
+
+    return get_refresh_delay(event_slot_df, now, config_parameters)
+
+
+if __name__ == "__main__":
+
+    load_dotenv()
+
+    config = environ
+
+    manager = ConnectionManager(config)
+
+    try:
+        next_refresh = etl_event_rotation(manager, config)
+        print(f"Event rotation loaded, next refresh in {next_refresh}")
+
+    finally:
+        manager.close()
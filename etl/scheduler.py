@@ -0,0 +1,191 @@
+"""Resident scheduler for the ETLs, in place of launching main.py from cron
+
+The connections (ConnectionManager or ShardRouter) and the API session
+stay open between runs, so each run only does the ETL work. The player
+snapshot cache is kept per run, as other processes (the roster ETL and job
+queue workers) write the same player tables. Every ETL runs on its own interval (brawler_etl_interval_mins,
+player_etl_interval_mins and battle_log_etl_interval_mins in the .env file)
+with random jitter of up to schedule_jitter of the interval either way, and
+records its runs in process_log as before. On start each ETL is scheduled
+one interval after its last run in process_log.
+
+With roster_etl_interval_mins set the roster ETL is also run on that
+interval, polling the roster players that are due (see polling.py) within
+poll_requests_per_hour API requests.
+
+The event rotation ETL schedules itself: it is run on start and then at
+the next rotation (see rotation.py), or one event_rotation_etl_interval_mins
+interval after a failed run. It loads the events, so the scheduled brawler
+ETL only loads brawlers, starpowers and gadgets.
+
+The stage metrics of every run are saved (see metrics.py).
+
+Usage: python ./etl/scheduler.py"""
+
+import random
+import signal
+from os import environ
+from datetime import datetime as dt, timedelta
+from functools import partial
+from threading import Event
+
+from dotenv import load_dotenv
+
+from db import ConnectionManager
+from shard import ShardRouter, get_shard_count
+from main import (get_process_id, get_last_process_id_run, run_brawler_etl, run_player_etl,
+                  run_battle_log_etl)
+from roster import run_roster_polls
+from rotation import etl_event_rotation
+from metrics import run_with_metrics
+from polling import PollQueue, RequestBudget, DEFAULT_REQUESTS_PER_HOUR, get_utc_now
+
+DEFAULT_INTERVAL_MINS = 60
+
+DEFAULT_JITTER = 0.1
+
+# Process name (in the process table) and the config key of its interval
+SCHEDULED_PROCESSES = {"Brawler ETL": "brawler_etl_interval_mins",
+                       "Player ETL": "player_etl_interval_mins",
+                       "Battle Log ETL": "battle_log_etl_interval_mins",
+                       "Roster ETL": "roster_etl_interval_mins",
+                       "Event Rotation ETL": "event_rotation_etl_interval_mins"}
+
+# Processes whose runs return the time until their next run
+SELF_SCHEDULED_PROCESSES = {"Event Rotation ETL"}
+
+
+def get_interval(config_env, interval_key: str) -> timedelta:
+    """Returns an ETL's interval from the config"""
+
+    return timedelta(minutes=float(config_env.get(interval_key, DEFAULT_INTERVAL_MINS)))
+
+
+def get_jittered_interval(interval: timedelta, jitter: float, rng: random.Random) -> timedelta:
+    """Returns the interval moved by a random fraction of up to jitter either way"""
+
+    return interval * (1 + rng.uniform(-jitter, jitter))
+
+
+class EtlScheduler:
+    """Runs each ETL when it is due, on warm connections"""
+
+    def __init__(self, config_env, db_manager: ConnectionManager,
+                 shard_router: ShardRouter = None, rng: random.Random = None):
+        self.db_manager = db_manager
+        self.jitter = float(config_env.get("schedule_jitter", DEFAULT_JITTER))
+        self.rng = rng or random.Random()
+        self.run_functions = {
+            # The event rotation ETL loads the events, at every rotation
+            "Brawler ETL": partial(run_brawler_etl, db_manager, config_env, load_events=False),
+            "Player ETL": partial(run_player_etl, db_manager, config_env, shard_router),
+            "Battle Log ETL": partial(run_battle_log_etl, db_manager, config_env, shard_router),
+            "Event Rotation ETL": partial(etl_event_rotation, db_manager, config_env)}
+
+        if config_env.get("roster_etl_interval_mins"):
+            self.run_functions["Roster ETL"] = partial(
+                run_roster_polls, db_manager, config_env, shard_router, PollQueue(),
+                RequestBudget(float(config_env.get("poll_requests_per_hour",
+                                                   DEFAULT_REQUESTS_PER_HOUR))))
+
+        self.run_functions = {process_name: partial(run_with_metrics, db_manager, config_env,
+                                                    process_name, run_function)
+                              for process_name, run_function in self.run_functions.items()}
+        self.intervals = {process_name: get_interval(config_env, SCHEDULED_PROCESSES[process_name])
+                          for process_name in self.run_functions}
+        self.next_runs = {}
+        self.run_stats = {"runs": 0, "failures": 0}
+
+    def load_next_runs(self, now: dt = None) -> None:
+        """Schedules each ETL one interval after its last run in process_log
+        (now if it has never run, or if it schedules itself). Times are UTC,
+        as stored in process_log"""
+
+        now = now or get_utc_now()
+
+        with self.db_manager.reader() as db_reader:
+            for process_name, interval in self.intervals.items():
+                if process_name in SELF_SCHEDULED_PROCESSES:
+                    self.next_runs[process_name] = now
+                    continue
+
+                process_id = get_process_id(db_reader, process_name)
+                last_run = get_last_process_id_run(db_reader, process_id)
+                self.next_runs[process_name] = last_run + interval if last_run else now
+
+    def run_pending(self, now: dt = None) -> list[str]:
+        """Runs every ETL that is due, oldest due first, and schedules its
+        next run (when the run says for self scheduled ETLs). Returns the
+        process names run"""
+
+        now = now or get_utc_now()
+        due_processes = sorted((process_name for process_name, next_run in self.next_runs.items()
+                                if next_run <= now), key=self.next_runs.get)
+
+        for process_name in due_processes:
+            self.run_stats["runs"] += 1
+
+            # A failed run is logged in process_log by the ETL and tried again next interval
+            try:
+                run_result = self.run_functions[process_name]()
+            except Exception as exc:
+                run_result = None
+                self.run_stats["failures"] += 1
+                print(f"{process_name} failed at {dt.now()}. {exc}")
+
+            if process_name in SELF_SCHEDULED_PROCESSES and isinstance(run_result, timedelta):
+                self.next_runs[process_name] = max(now, get_utc_now()) + run_result
+                continue
+
+            self.next_runs[process_name] = now + get_jittered_interval(
+                self.intervals[process_name], self.jitter, self.rng)
+
+        return due_processes
+
+    def seconds_until_next_run(self, now: dt = None) -> float:
+        """Returns the seconds until the next ETL is due"""
+
+        now = now or get_utc_now()
+
+        return max((min(self.next_runs.values()) - now).total_seconds(), 0.0)
+
+    def run_forever(self, stop_event: Event) -> None:
+        """Runs ETLs as they fall due until stop_event is set"""
+
+        self.load_next_runs()
+
+        while not stop_event.is_set():
+            self.run_pending()
+            stop_event.wait(self.seconds_until_next_run())
+
+
+if __name__ == "__main__":
+
+    load_dotenv()
+
+    config = environ
+
+    shard_router = ShardRouter(config) if get_shard_count(config) else None
+    db_manager = shard_router.catalogue if shard_router else ConnectionManager(config)
+
+    stop = Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    scheduler = EtlScheduler(config, db_manager, shard_router)
+
+    print(f"Scheduler started at {dt.now()}")
+
+    try:
+        scheduler.run_forever(stop)
+
+    finally:
+        print(f"Scheduler stats: {scheduler.run_stats}")
+        if shard_router:
+            print(f"Connection stats: {shard_router.stats()}")
+            shard_router.close()
+        else:
+            print(f"Connection stats: {db_manager.stats()}")
+            db_manager.close()
+
+    print(f"Scheduler stopped at {dt.now()}")
@@ -0,0 +1,144 @@
+"""Optional sharded storage, player and battle data split across
+database files by a hash of the player tag
+
+The brawler/starpower/gadget/event catalogue and process_log stay in the
+main database (dbpath). Player, player_*, rollup and battle tables are
+stored in db_shards files next to it (brawl.db -> brawl.shard0.db, ...).
+Each shard has its own writer, so shards can be loaded in parallel by
+separate threads or processes. Player IDs are only unique within a shard.
+
+Usage: python ./etl/shard.py init"""
+
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from os import environ
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pandas import DataFrame, concat
+
+from db import ConnectionManager
+from extract import format_player_tag
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "database" / "schema.sql"
+
+SHARDED_TABLES = ("player", "player_exp", "player_trophies", "player_victories",
+                  "player_stat_rollup", "rollup_checkpoint", "battle", "battle_type",
+                  "brawler_stats", "matchup_matrix", "team_composition_stats")
+
+
+def get_shard_count(config_env) -> int:
+    """Returns the number of shards configured (0 means not sharded)"""
+
+    return int(config_env.get("db_shards", 0) or 0)
+
+
+def get_shard_index(player_tag: str, shard_count: int) -> int:
+    """Returns the shard a player tag is stored in. Uses crc32 of the
+    formatted tag so every process routes a tag to the same shard"""
+
+    if shard_count < 1:
+        raise ValueError("Error: Shard count must be at least 1!")
+
+    player_tag = f"#{format_player_tag(player_tag)}"
+
+    return zlib.crc32(player_tag.encode("utf-8")) % shard_count
+
+
+def get_shard_path(db_path: str, shard_index: int) -> str:
+    """Returns the database file of a shard"""
+
+    db_path = Path(db_path)
+
+    return str(db_path.with_name(f"{db_path.stem}.shard{shard_index}{db_path.suffix}"))
+
+
+class ShardRouter:
+    """Routes player and battle data to the shard owning the player tag"""
+
+    def __init__(self, config_env, shard_count: int = None):
+        self.shard_count = shard_count or get_shard_count(config_env)
+
+        if self.shard_count < 1:
+            raise ValueError("Error: Shard count must be at least 1!")
+
+        self.catalogue = ConnectionManager(config_env)
+        self.shards = [ConnectionManager({**config_env,
+                                          "dbpath": get_shard_path(config_env["dbpath"],
+                                                                   shard_index)})
+                       for shard_index in range(self.shard_count)]
+
+    def shard_for(self, player_tag: str) -> ConnectionManager:
+        """Returns the connection manager of the shard owning a player tag"""
+
+        return self.shards[get_shard_index(player_tag, self.shard_count)]
+
+    def group_player_tags(self, player_tags: list[str]) -> dict[int, list[str]]:
+        """Returns player tags grouped by shard index"""
+
+        shard_player_tags = {}
+
+        for player_tag in player_tags:
+            shard_index = get_shard_index(player_tag, self.shard_count)
+            shard_player_tags.setdefault(shard_index, []).append(player_tag)
+
+        return shard_player_tags
+
+    def fan_out(self, sql: str, parameters=(), columns: list[str] = None) -> DataFrame:
+        """Runs a read query on every shard concurrently and returns the
+        combined rows with a shard column, ready for cross-shard aggregates"""
+
+        def read_shard(shard_index: int) -> DataFrame:
+            with self.shards[shard_index].reader() as db_conn:
+                cur = db_conn.execute(sql, parameters)
+                shard_columns = columns or [column[0] for column in cur.description]
+                shard_df = DataFrame(cur.fetchall(), columns=shard_columns)
+                cur.close()
+
+            shard_df["shard"] = shard_index
+            return shard_df
+
+        with ThreadPoolExecutor(max_workers=self.shard_count) as executor:
+            shard_dfs = list(executor.map(read_shard, range(self.shard_count)))
+
+        return concat(shard_dfs, ignore_index=True)
+
+    def stats(self) -> dict:
+        """Returns connection statistics of the catalogue and every shard"""
+
+        return {"catalogue": self.catalogue.stats(),
+                **{f"shard{shard_index}": shard.stats()
+                   for shard_index, shard in enumerate(self.shards)}}
+
+    def close(self) -> None:
+        """Closes every connection owned by the router"""
+
+        self.catalogue.close()
+        for shard in self.shards:
+            shard.close()
+
+
+def create_shard_databases(config_env) -> None:
+    """Creates the schema in every shard database"""
+
+    router = ShardRouter(config_env)
+    schema = SCHEMA_PATH.read_text(encoding="utf-8")
+
+    try:
+        for shard in router.shards:
+            with shard.writer() as db_conn:
+                db_conn.executescript(schema)
+
+    finally:
+        router.close()
+
+
+if __name__ == "__main__":
+
+    load_dotenv()
+
+    config = environ
+
+    if len(sys.argv) > 1 and sys.argv[1] == "init":
+        create_shard_databases(config)
@@ -0,0 +1,205 @@
+"""Incremental brawler pick rate and win rate counters
+
+Battles are counted per (brawler, mode, map, trophy bracket, day) as they
+are loaded, rates are derived from the counters (not the battle table).
+Ban rates are not available, the battle log does not include bans."""
+
+from sqlite3 import Connection, Cursor, DatabaseError
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+from load import dataframe_to_rows
+
+# Lower bound of each brawler trophy bracket
+TROPHY_BRACKETS = (0, 100, 200, 300, 400, 500, 600, 750, 1000, 1250, 1500)
+
+UNKNOWN_TROPHY_BRACKET = -1
+
+# z value of the 95% confidence interval
+DEFAULT_CONFIDENCE_Z = 1.96
+
+STATS_KEY_COLUMNS = ["brawler_id", "mode", "map", "trophy_bracket", "day"]
+
+STATS_COUNTER_COLUMNS = ["games", "wins", "losses", "star_players", "trophy_change_sum"]
+
+
+def get_trophy_bracket(brawler_trophies: pd.Series) -> pd.Series:
+    """Returns the trophy bracket (lower bound) of each brawler trophy count
+    (UNKNOWN_TROPHY_BRACKET if the trophy count is missing)"""
+
+    trophies = pd.to_numeric(brawler_trophies, errors="coerce")
+    bracket_index = np.searchsorted(TROPHY_BRACKETS, trophies.fillna(0), side="right") - 1
+    brackets = np.asarray(TROPHY_BRACKETS)[np.clip(bracket_index, 0, None)]
+
+    return pd.Series(np.where(trophies.isna(), UNKNOWN_TROPHY_BRACKET, brackets),
+                     index=brawler_trophies.index)
+
+
+def get_new_battles(db_conn: Connection, battle_log_data: DataFrame) -> DataFrame:
+    """Returns the battles in a transformed battle log that are not stored yet,
+    so counters are only incremented once per battle"""
+
+    if battle_log_data.empty:
+        return battle_log_data
+
+    # One query per player, a battle log holds at most a few dozen battles
+    player_battle_times = battle_log_data.drop_duplicates(
+        ["player_tag", "battle_time"]).groupby("player_tag")["battle_time"]
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        stored_battles = set()
+        for player_tag, battle_times in player_battle_times:
+            cur.execute(f"""SELECT player_tag, battle_time
+                        FROM battle
+                        WHERE player_tag = ?
+                        AND battle_time IN ({', '.join('?' * len(battle_times))});""",
+                        [player_tag, *battle_times])
+            stored_battles.update(cur.fetchall())
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    is_new = [battle_key not in stored_battles for battle_key in
+              zip(battle_log_data["player_tag"], battle_log_data["battle_time"])]
+
+    return battle_log_data[is_new].drop_duplicates(["player_tag", "battle_time"])
+
+
+def aggregate_battle_stats(battle_log_data: DataFrame) -> DataFrame:
+    """Returns battle counters per (brawler, mode, map, trophy bracket, day).
+    Battles without a mode or map are not counted"""
+
+    battle_data = battle_log_data.dropna(subset=["brawler_played_id", "event_mode",
+                                                 "event_map"])
+
+    if battle_data.empty:
+        return DataFrame(columns=STATS_KEY_COLUMNS + STATS_COUNTER_COLUMNS)
+
+    battle_data = DataFrame({
+        "brawler_id": battle_data["brawler_played_id"].astype(int),
+        "mode": battle_data["event_mode"],
+        "map": battle_data["event_map"],
+        "trophy_bracket": get_trophy_bracket(battle_data["brawler_trophies"]),
+        "day": battle_data["battle_time"].str[:10],
+        "games": 1,
+        "wins": (battle_data["result"] == "Victory").astype(int),
+        "losses": (battle_data["result"] == "Defeat").astype(int),
+        "star_players": battle_data["star_player"].fillna(False).astype(bool).astype(int),
+        "trophy_change_sum": pd.to_numeric(battle_data["trophy_change"],
+                                           errors="coerce").fillna(0).astype(int)})
+
+    return battle_data.groupby(STATS_KEY_COLUMNS, as_index=False)[STATS_COUNTER_COLUMNS].sum()
+
+
+def upsert_brawler_stats(db_conn: Connection, stats_data: DataFrame) -> None:
+    """Adds battle counters to the brawler_stats table"""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.executemany("""INSERT INTO brawler_stats
+                        (brawler_id, mode, map, trophy_bracket, day,
+                        games, wins, losses, star_players, trophy_change_sum)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (mode, map, trophy_bracket, day, brawler_id)
+                        DO UPDATE SET
+                          games = games + excluded.games,
+                          wins = wins + excluded.wins,
+                          losses = losses + excluded.losses,
+                          star_players = star_players + excluded.star_players,
+                          trophy_change_sum = trophy_change_sum + excluded.trophy_change_sum;""",
+                        dataframe_to_rows(stats_data,
+                                          STATS_KEY_COLUMNS + STATS_COUNTER_COLUMNS))
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to insert brawler stats data!") from exc
+
+    finally:
+        cur.close()
+
+
+def update_brawler_stats(db_conn: Connection, new_battle_data: DataFrame) -> int:
+    """Counts new battles (see get_new_battles) into brawler_stats.
+    Returns the number of battles counted"""
+
+    stats_data = aggregate_battle_stats(new_battle_data)
+
+    if stats_data.empty:
+        return 0
+
+    upsert_brawler_stats(db_conn, stats_data)
+
+    return int(stats_data["games"].sum())
+
+
+def get_wilson_interval(successes: pd.Series, trials: pd.Series,
+                        z: float = DEFAULT_CONFIDENCE_Z) -> tuple[pd.Series, pd.Series]:
+    """Returns the lower and upper bounds of the Wilson score interval of
+    successes / trials (NaN where there are no trials)"""
+
+    trials = trials.astype(float).where(trials > 0)
+    rate = successes / trials
+    denominator = 1 + z ** 2 / trials
+    centre = (rate + z ** 2 / (2 * trials)) / denominator
+    margin = z * np.sqrt(rate * (1 - rate) / trials + z ** 2 / (4 * trials ** 2)) / denominator
+
+    return centre - margin, centre + margin
+
+
+def get_brawler_stats(db_conn: Connection, mode: str = None, map_name: str = None,
+                      trophy_bracket: int = None, since: str = None,
+                      until: str = None) -> DataFrame:
+    """Returns brawler_stats counters summed per brawler for the filters given
+    (since and until are inclusive days, YYYY-MM-DD)"""
+
+    filters = {"mode = :mode": mode, "map = :map": map_name,
+               "trophy_bracket = :trophy_bracket": trophy_bracket,
+               "day >= :since": since, "day <= :until": until}
+    conditions = [condition for condition, value in filters.items() if value is not None]
+    where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    cur = db_conn.cursor(factory=Cursor)
+    try:
+        cur.execute(f"""SELECT brawler_id, SUM(games), SUM(wins), SUM(losses),
+                    SUM(star_players), SUM(trophy_change_sum)
+                    FROM brawler_stats
+                    {where_clause}
+                    GROUP BY brawler_id;""",
+                    {"mode": mode, "map": map_name, "trophy_bracket": trophy_bracket,
+                     "since": since, "until": until})
+
+        brawler_stats = cur.fetchall()
+
+    except Exception as exc:
+        raise DatabaseError("Error: Unable to retrieve data from database!") from exc
+
+    finally:
+        cur.close()
+
+    return DataFrame(brawler_stats, columns=["brawler_id"] + STATS_COUNTER_COLUMNS)
+
+
+def add_brawler_rates(stats_data: DataFrame, z: float = DEFAULT_CONFIDENCE_Z) -> DataFrame:
+    """Adds pick rate, win rate (draws excluded) with its confidence interval,
+    star player rate and average trophy change to per brawler counters
+    (counters from several shards can be concatenated first, they are summed)"""
+
+    stats_data = stats_data.groupby("brawler_id", as_index=False)[STATS_COUNTER_COLUMNS].sum()
+    decided_games = stats_data["wins"] + stats_data["losses"]
+    games = stats_data["games"].astype(float)
+
+    stats_data["pick_rate"] = games / games.sum() if games.sum() else np.nan
+    stats_data["win_rate"] = stats_data["wins"] / decided_games.where(decided_games > 0)
+    stats_data["win_rate_lower"], stats_data["win_rate_upper"] = get_wilson_interval(
+        stats_data["wins"], decided_games, z)
+    stats_data["star_player_rate"] = stats_data["star_players"] / games.where(games > 0)
+    stats_data["average_trophy_change"] = (stats_data["trophy_change_sum"]
+                                           / games.where(games > 0))
+
+    return stats_data.sort_values("win_rate_lower", ascending=False,
+                                  ignore_index=True, na_position="last")
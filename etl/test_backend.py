@@ -0,0 +1,232 @@
+"""Testing file for backend.py"""
+
+from os import environ
+from unittest.mock import MagicMock, patch
+
+import pytest
+from pandas import DataFrame
+
+from backend import (SQLiteBackend, PostgresBackend, MirroredBackend, get_storage_backend,
+                     get_load_backend, rows_to_csv, get_postgres_connection)
+from db import ConnectionManager
+from matchup import MatchupMatrix, array_to_blob
+from conftest import SCHEMA_PATH
+from transform import BATTLE_LOG_COLUMNS
+
+POSTGRES_SCHEMA_PATH = SCHEMA_PATH.with_name("schema_postgres.sql")
+
+
+def mock_battle_log_dataframe() -> DataFrame:
+    """Returns a transformed battle log with two battles"""
+
+    return DataFrame([["#LLPCV2GVP", "2025-04-13 09:22:06", 15000132, "brawlBall",
+                       "Center Stage", "soloRanked", "defeat", 150, None, 16000025, True, 16,
+                       [16000025], [16000001]],
+                      ["#LLPCV2GVP", "2025-04-13 09:30:00", 15000132, "brawlBall",
+                       "Center Stage", "ranked", "victory", 120, 8, 16000025, False, 512,
+                       [16000025], [16000001]]],
+                     columns=BATTLE_LOG_COLUMNS)
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path):
+    """Returns a SQLite backend on a database created from the schema"""
+
+    db_manager = ConnectionManager({"dbpath": str(tmp_path / "brawl.db")})
+    with db_manager.writer() as db_conn:
+        db_conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+    backend = SQLiteBackend({}, db_manager)
+    yield backend
+    backend.close()
+
+
+def test_sqlite_backend_load_battles_skips_stored_battles(sqlite_backend):
+    """Tests battles loaded twice are only stored and counted once"""
+
+    with sqlite_backend.transaction() as db_conn:
+        first_load = sqlite_backend.load_battles(db_conn, mock_battle_log_dataframe())
+        second_load = sqlite_backend.load_battles(db_conn, mock_battle_log_dataframe())
+
+    assert (len(first_load), len(second_load)) == (2, 0)
+    assert sqlite_backend.read_query("SELECT COUNT(*) FROM battle;") == [(2,)]
+    assert sqlite_backend.read_query("SELECT SUM(games) FROM brawler_stats;") == [(2,)]
+
+
+def test_sqlite_backend_iter_query_yields_batches(sqlite_backend):
+    """Tests iter_query yields rows in batches of batch_size"""
+
+    with sqlite_backend.transaction() as db_conn:
+        sqlite_backend.load_catalogue_changes(db_conn, "bs_event", DataFrame(
+            {"event_id": range(5), "event_version": 1, "mode": "m", "map": "m"}))
+
+    batches = list(sqlite_backend.iter_query("SELECT bs_event_id FROM bs_event;",
+                                             batch_size=2))
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+
+
+def test_load_catalogue_changes_unknown_table_raises_value_error(sqlite_backend):
+    """Tests only catalogue tables can be loaded as catalogue changes"""
+
+    with pytest.raises(ValueError):
+        sqlite_backend.load_catalogue_changes(None, "battle", DataFrame({"a": [1]}))
+
+
+def test_rows_to_csv_writes_none_as_copy_null():
+    """Tests None values are written as the COPY null marker"""
+
+    assert rows_to_csv([(1, None, "a,b")]).getvalue() == '1,\\N,"a,b"\r\n'
+
+
+def test_postgres_backend_bulk_insert_uses_copy():
+    """Tests bulk inserts without conflicts are streamed with a single COPY"""
+
+    mock_db_conn = MagicMock()
+    mock_cur = mock_db_conn.cursor.return_value.__enter__.return_value
+    backend = PostgresBackend({}, mock_db_conn)
+
+    backend.bulk_insert(mock_db_conn, "player_exp", ["player_id", "exp_level", "exp_points"],
+                        [(1, 2, 3), (1, 3, 4)])
+
+    assert mock_cur.copy_expert.call_count == 1
+    assert "COPY player_exp" in mock_cur.copy_expert.call_args[0][0]
+    assert mock_cur.execute.call_count == 0
+
+
+def test_postgres_backend_bulk_insert_with_conflicts_uses_staging_table():
+    """Tests bulk inserts skipping conflicts COPY into a staging table first"""
+
+    mock_db_conn = MagicMock()
+    mock_cur = mock_db_conn.cursor.return_value.__enter__.return_value
+    backend = PostgresBackend({}, mock_db_conn)
+
+    backend.bulk_insert(mock_db_conn, "battle_type", ["battle_type_name"], [("ranked",)],
+                        conflict_columns=["battle_type_name"])
+
+    assert "COPY staging_battle_type" in mock_cur.copy_expert.call_args[0][0]
+    assert "ON CONFLICT (battle_type_name) DO NOTHING" in mock_cur.execute.call_args[0][0]
+
+
+def test_postgres_backend_upserts_current_versions_with_its_own_placeholders():
+    """Tests catalogue versions update the current table with %s placeholders"""
+
+    mock_db_conn = MagicMock()
+    backend = PostgresBackend({}, mock_db_conn)
+
+    with patch("backend.execute_batch") as mock_execute_batch:
+        backend.upsert_current_versions(mock_db_conn, "brawler", [(16000000, 1, "Shelly")])
+
+    upsert_sql = mock_execute_batch.call_args[0][1]
+    assert "VALUES (%s, %s, %s)" in upsert_sql and "?" not in upsert_sql
+
+
+def test_postgres_backend_iter_query_uses_server_side_cursor():
+    """Tests reads use a named (server side) cursor"""
+
+    mock_db_conn = MagicMock()
+    mock_cur = mock_db_conn.cursor.return_value.__enter__.return_value
+    mock_cur.fetchmany.side_effect = [[(1,)], []]
+    backend = PostgresBackend({}, mock_db_conn)
+
+    assert list(backend.iter_query("SELECT 1;", batch_size=5)) == [[(1,)]]
+    assert "name" in mock_db_conn.cursor.call_args.kwargs
+    assert mock_cur.itersize == 5
+
+
+def test_postgres_backend_iter_query_commits_once_exhausted():
+    """Tests a read outside a transaction is committed once exhausted, and a
+    read inside a transaction is left to the transaction"""
+
+    mock_db_conn = MagicMock()
+    mock_cur = mock_db_conn.cursor.return_value.__enter__.return_value
+    mock_cur.fetchmany.side_effect = [[(1,)], [], [(1,)], []]
+    backend = PostgresBackend({}, mock_db_conn)
+
+    list(backend.iter_query("SELECT 1;"))
+    assert mock_db_conn.commit.call_count == 1
+
+    with backend.transaction():
+        list(backend.iter_query("SELECT 1;"))
+        assert mock_db_conn.commit.call_count == 1
+    assert mock_db_conn.commit.call_count == 2
+
+
+def test_postgres_backend_load_battles_runs_in_the_callers_transaction():
+    """Tests battle types, battles and the aggregates are loaded on the
+    caller's connection without committing, and only new battles are returned"""
+
+    mock_db_conn = MagicMock()
+    mock_cur = mock_db_conn.cursor.return_value.__enter__.return_value
+    mock_cur.fetchall.side_effect = [[(1, "soloRanked"), (2, "ranked")],
+                                     [("#LLPCV2GVP", "2025-04-13 09:30:00")]]
+    mock_cur.fetchone.return_value = (array_to_blob(MatchupMatrix("brawlBall").wins),
+                                      array_to_blob(MatchupMatrix("brawlBall").games))
+    backend = PostgresBackend({}, mock_db_conn)
+
+    with patch("backend.execute_batch"), patch("backend.execute_values") as mock_execute_values:
+        mock_execute_values.return_value = [("Center Stage", 1, 0, 1)]
+        new_battles = backend.load_battles(mock_db_conn, mock_battle_log_dataframe())
+
+    assert new_battles["battle_time"].tolist() == ["2025-04-13 09:30:00"]
+    assert mock_db_conn.commit.call_count == 0
+    assert any("RETURNING player_tag" in call[0][0] for call in mock_cur.execute.call_args_list)
+
+
+def test_mirrored_backend_commits_mirror_load_and_returns_primary_result(sqlite_backend):
+    """Tests loads are written to the primary on the caller's connection
+    and to the mirror in its own committed transaction"""
+
+    mock_mirror = MagicMock()
+    backend = MirroredBackend(sqlite_backend, mock_mirror)
+
+    with sqlite_backend.transaction() as db_conn:
+        new_battles = backend.load_battles(db_conn, mock_battle_log_dataframe())
+
+    mirror_conn = mock_mirror.transaction.return_value.__enter__.return_value
+    assert len(new_battles) == 2
+    assert mock_mirror.load_battles.call_args[0][0] is mirror_conn
+    assert mock_mirror.transaction.return_value.__exit__.call_count == 1
+
+
+def test_get_storage_backend_unknown_backend_raises_value_error():
+    """Tests an unknown db_backend raises a value error"""
+
+    with pytest.raises(ValueError):
+        get_storage_backend({"db_backend": "mysql"})
+
+
+def test_get_load_backend_mirrors_postgres_loads_to_sqlite():
+    """Tests the ETLs load into SQLite, mirrored to PostgreSQL when it is set"""
+
+    assert isinstance(get_load_backend({}), SQLiteBackend)
+
+    with patch("backend.get_postgres_connection"):
+        load_backend = get_load_backend({"db_backend": "postgres"})
+
+    assert isinstance(load_backend, MirroredBackend)
+    assert isinstance(load_backend.primary, SQLiteBackend)
+    assert isinstance(load_backend.mirror, PostgresBackend)
+
+
+@pytest.mark.skipif(not environ.get("pg_test_dsn"), reason="pg_test_dsn is not set")
+def test_postgres_backend_load_battles_skips_stored_battles():
+    """Tests battles loaded twice are only stored once in a local PostgreSQL"""
+
+    db_conn = get_postgres_connection({"pg_dsn": environ["pg_test_dsn"]})
+    with db_conn.cursor() as cur:
+        cur.execute(POSTGRES_SCHEMA_PATH.read_text(encoding="utf-8"))
+    db_conn.commit()
+    backend = PostgresBackend({}, db_conn)
+
+    for _ in range(2):
+        with backend.transaction() as pg_conn:
+            backend.load_battles(pg_conn, mock_battle_log_dataframe())
+
+    assert backend.read_query("SELECT COUNT(*) FROM battle;") == [(2,)]
+    assert backend.read_query("SELECT SUM(games) FROM brawler_stats;") == [(2,)]
+    backend.close()
+
+
+if __name__ == "__main__":
+
+    pytest.main()
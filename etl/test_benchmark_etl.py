@@ -0,0 +1,44 @@
+"""Testing file for benchmark_etl.py"""
+
+import numpy as np
+import pytest
+
+from benchmark_etl import (generate_brawl_data_api, generate_player_tags, generate_events,
+                           generate_battle_log_api, run_benchmarks, compare_results)
+
+TINY_SCALE = {"brawlers": 5, "events": 10, "players": 4, "battles": 200}
+
+
+def test_synthetic_data_is_the_same_for_a_seed():
+    """Tests the generators return the same data for the same seed"""
+
+    def generate(seed):
+        rng = np.random.default_rng(seed)
+        events = generate_events(rng, 10)
+        player_tags = generate_player_tags(rng, 3)
+        return (generate_brawl_data_api(rng, 5), player_tags, events.to_dict("records"),
+                generate_battle_log_api(rng, player_tags[0], 25, np.array([16000000]),
+                                        events.to_dict("records")))
+
+    assert generate(1) == generate(1)
+    assert generate(1) != generate(2)
+
+
+def test_run_benchmarks_measures_every_benchmark_at_every_scale():
+    """Tests each benchmark has a time and peak memory per scale and a run
+    compared to itself has ratios of 1"""
+
+    results = run_benchmarks({"tiny": TINY_SCALE}, seed=1, repeats=1)
+
+    assert len(results["results"]) == 11
+    assert all(result["seconds"] > 0 and result["peak_memory_bytes"] > 0
+               for result in results["results"])
+    assert {result["benchmark"]: result["records"] for result in results["results"]}[
+        "insert_battle_log_db"] == 200
+    assert {comparison["seconds_ratio"]
+            for comparison in compare_results(results, results)} == {1.0}
+
+
+if __name__ == "__main__":
+
+    pytest.main()
@@ -0,0 +1,36 @@
+"""Testing file for benchmark_query_plans.py"""
+
+import pytest
+
+from benchmark_query_plans import (seed_history, run_query_plan_benchmark, is_full_scan,
+                                   get_uncovered_query_functions)
+
+
+def test_is_full_scan_ignores_index_scans():
+    """Tests only scans without an index are full scans"""
+
+    assert is_full_scan("SCAN process_log")
+    assert not is_full_scan("SCAN battle_type USING COVERING INDEX sqlite_autoindex_battle_type_1")
+    assert not is_full_scan("SCAN CONSTANT ROW")
+    assert not is_full_scan("SEARCH player USING INDEX sqlite_autoindex_player_1 (player_tag=?)")
+
+
+def test_every_query_function_is_benchmarked():
+    """Tests every extract.py and main.py function taking a connection has a query plan"""
+
+    assert not get_uncovered_query_functions()
+
+
+def test_queries_do_not_full_scan(schema_db_conn):
+    """Tests no extract.py or main.py query scans a full table"""
+
+    seed_history(schema_db_conn, 3)
+    results = run_query_plan_benchmark(schema_db_conn)
+
+    assert results
+    assert [result for result in results if result["failed"]] == []
+
+
+if __name__ == "__main__":
+
+    pytest.main()
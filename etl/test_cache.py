@@ -0,0 +1,106 @@
+"""Testing file for cache.py"""
+
+import pytest
+from pandas import DataFrame
+
+from cache import QueryCache, CachedReader, bump_data_generation, get_data_generation
+from db import ConnectionManager
+from extract import get_brawlers_latest_version
+from conftest import SCHEMA_PATH
+
+
+def insert_mock_brawler(db_conn, brawler_id: int) -> None:
+    """Inserts a brawler into the current brawler table"""
+
+    db_conn.execute("""INSERT INTO brawler_current (brawler_id, brawler_version, brawler_name)
+                    VALUES (?, 1, ?);""", [brawler_id, f"Brawler {brawler_id}"])
+
+
+def test_bump_data_generation_increments_generation(schema_db_conn):
+    """Tests each bump starts a new generation"""
+
+    bump_data_generation(schema_db_conn)
+    bump_data_generation(schema_db_conn)
+
+    assert get_data_generation(schema_db_conn) == 2
+
+
+def test_query_cache_serves_results_until_generation_changes(schema_db_conn):
+    """Tests a cached result is returned until the data generation is bumped"""
+
+    query_cache = QueryCache()
+    insert_mock_brawler(schema_db_conn, 16000001)
+
+    assert len(query_cache.get(schema_db_conn, get_brawlers_latest_version)) == 1
+
+    insert_mock_brawler(schema_db_conn, 16000002)
+    assert len(query_cache.get(schema_db_conn, get_brawlers_latest_version)) == 1
+
+    bump_data_generation(schema_db_conn)
+    assert len(query_cache.get(schema_db_conn, get_brawlers_latest_version)) == 2
+
+    assert query_cache.stats()["hits"] == 1
+    assert query_cache.stats()["misses"] == 2
+    assert query_cache.stats()["invalidations"] == 1
+
+
+def test_query_cache_evicts_least_recently_used(schema_db_conn):
+    """Tests the least recently used result is evicted when the cache is full"""
+
+    def get_value(_db_conn, value):
+        return DataFrame({"value": [value]})
+
+    query_cache = QueryCache(max_entries=2)
+    query_cache.get(schema_db_conn, get_value, 1)
+    query_cache.get(schema_db_conn, get_value, 2)
+    query_cache.get(schema_db_conn, get_value, 1)
+    query_cache.get(schema_db_conn, get_value, 3)
+    query_cache.get(schema_db_conn, get_value, 1)
+
+    assert query_cache.stats()["evictions"] == 1
+    assert query_cache.stats()["hits"] == 2
+    assert query_cache.stats()["hit_rate"] == 0.4
+
+
+def test_query_cache_results_can_be_modified(schema_db_conn):
+    """Tests modifying a returned result does not change the cached result"""
+
+    query_cache = QueryCache()
+    insert_mock_brawler(schema_db_conn, 16000001)
+
+    brawlers_df = query_cache.get(schema_db_conn, get_brawlers_latest_version)
+    brawlers_df["brawler_name"] = "changed"
+
+    assert query_cache.get(schema_db_conn, get_brawlers_latest_version).loc[
+        0, "brawler_name"] == "Brawler 16000001"
+
+
+def test_query_cache_keeps_results_per_database(tmp_path):
+    """Tests a result cached from one database is not served for another
+    database at the same generation (e.g. another shard)"""
+
+    shard_managers = [ConnectionManager({"dbpath": str(tmp_path / f"shard_{index}.db")})
+                      for index in range(2)]
+    query_cache = QueryCache()
+
+    for shard_index, shard_manager in enumerate(shard_managers):
+        with shard_manager.writer() as db_conn:
+            db_conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+            insert_mock_brawler(db_conn, 16000000 + shard_index)
+            db_conn.commit()
+
+    brawler_ids = [CachedReader(shard_manager, query_cache).read(
+        get_brawlers_latest_version)["brawler_id"].tolist() for shard_manager in shard_managers]
+
+    assert brawler_ids == [[16000000], [16000001]]
+    assert CachedReader(shard_managers[0], query_cache).read(
+        get_brawlers_latest_version)["brawler_id"].tolist() == [16000000]
+    assert query_cache.stats()["hits"] == 1
+
+    for shard_manager in shard_managers:
+        shard_manager.close()
+
+
+if __name__ == "__main__":
+
+    pytest.main()
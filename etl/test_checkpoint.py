@@ -0,0 +1,59 @@
+"""Testing file for checkpoint.py"""
+
+import pytest
+
+from checkpoint import (get_last_checkpoint, get_remaining_player_tags, record_checkpoint,
+                        clear_checkpoints)
+
+
+def test_checkpoints_are_recorded_per_stage(schema_db_conn):
+    """Tests the last recorded player tag is returned for each stage
+    and stages without checkpoints have none"""
+
+    record_checkpoint(schema_db_conn, 4, "shard_0", "#2LPRQUV92")
+    record_checkpoint(schema_db_conn, 4, "shard_0", "8qc8rp02")
+    record_checkpoint(schema_db_conn, 4, "shard_1", "#LLPCV2GVP")
+
+    assert get_last_checkpoint(schema_db_conn, 4, "shard_0") == "#8QC8RP02"
+    assert get_last_checkpoint(schema_db_conn, 4, "shard_1") == "#LLPCV2GVP"
+    assert get_last_checkpoint(schema_db_conn, 2, "shard_0") is None
+
+
+def test_get_last_checkpoint_ignores_checkpoints_older_than_max_age(schema_db_conn):
+    """Tests a checkpoint left by an abandoned run is not resumed from"""
+
+    record_checkpoint(schema_db_conn, 4, "shard_0", "#8QC8RP02")
+    schema_db_conn.execute("""UPDATE process_checkpoint
+                           SET last_updated = datetime('now', '-25 hours');""")
+
+    assert get_last_checkpoint(schema_db_conn, 4, "shard_0") is None
+    assert get_last_checkpoint(schema_db_conn, 4, "shard_0", 48) == "#8QC8RP02"
+
+
+def test_get_remaining_player_tags_skips_tags_up_to_the_checkpoint():
+    """Tests the players after the checkpointed tag are returned in tag order,
+    including players added since the checkpoint was recorded"""
+
+    result = get_remaining_player_tags(["llpcv2gvp", "#2LPRQUV92", "#Y98JQCQJ8", "#8QC8RP02"],
+                                       "#8QC8RP02")
+
+    assert result == ["#LLPCV2GVP", "#Y98JQCQJ8"]
+    assert get_remaining_player_tags(["#8QC8RP02", "#2LPRQUV92"]) == ["#2LPRQUV92",
+                                                                      "#8QC8RP02"]
+
+
+def test_clear_checkpoints_only_clears_the_process(schema_db_conn):
+    """Tests clearing a process's checkpoints leaves other processes' checkpoints"""
+
+    record_checkpoint(schema_db_conn, 2, "players", "#2LPRQUV92")
+    record_checkpoint(schema_db_conn, 4, "shard_0", "#8QC8RP02")
+
+    clear_checkpoints(schema_db_conn, 4)
+
+    assert get_last_checkpoint(schema_db_conn, 4, "shard_0") is None
+    assert get_last_checkpoint(schema_db_conn, 2, "players") == "#2LPRQUV92"
+
+
+if __name__ == "__main__":
+
+    pytest.main()
@@ -0,0 +1,80 @@
+"""Testing file for composition.py"""
+
+import numpy as np
+import pytest
+from pandas import DataFrame, Series
+
+from composition import (encode_compositions, decode_composition, aggregate_compositions,
+                         update_team_compositions, get_top_compositions)
+from stats import get_wilson_interval
+
+
+def get_mock_battle_log_df(battles: list[tuple]) -> DataFrame:
+    """Returns a battle log dataframe from (map, result, team ids, opponent ids) tuples"""
+
+    return DataFrame([{"event_map": map_name, "result": result, "team_brawler_ids": team,
+                       "opponent_brawler_ids": opponents}
+                      for map_name, result, team, opponents in battles])
+
+
+def test_encode_compositions_ignores_brawler_order():
+    """Tests the same brawlers in any order have the same composition key"""
+
+    keys = encode_compositions(np.array([[16000003, 16000001, 16000002],
+                                         [16000001, 16000002, 16000003]]))
+
+    assert keys[0] == keys[1]
+    assert decode_composition(keys[0]) == (16000001, 16000002, 16000003)
+
+
+def test_aggregate_compositions_counts_both_teams_of_3v3_battles():
+    """Tests the winning and losing team are counted and other battles are not"""
+
+    result = aggregate_compositions(get_mock_battle_log_df([
+        ("Hard Rock Mine", "Victory", [16000001, 16000002, 16000003],
+         [16000004, 16000005, 16000006]),
+        ("Hard Rock Mine", "Draw", [16000001, 16000002, 16000003],
+         [16000004, 16000005, 16000006]),
+        ("Skull Creek", "Victory", [16000001], [16000004])]))
+
+    assert result[["wins", "games"]].values.tolist() == [[1, 1], [0, 1]]
+
+
+def test_get_top_compositions_orders_by_score(schema_db_conn):
+    """Tests compositions with more wins over more games rank first"""
+
+    winners, losers = [16000001, 16000002, 16000003], [16000004, 16000005, 16000006]
+    update_team_compositions(schema_db_conn, get_mock_battle_log_df(
+        [("Hard Rock Mine", "Victory", winners, losers)] * 3))
+    update_team_compositions(schema_db_conn, get_mock_battle_log_df(
+        [("Hard Rock Mine", "Defeat", winners, losers)]))
+
+    result = get_top_compositions(schema_db_conn, "Hard Rock Mine", top_k=1)
+
+    assert result.loc[0, "brawler_ids"] == tuple(winners)
+    assert result.loc[0, ["wins", "games"]].tolist() == [3, 4]
+
+
+
+def test_update_team_compositions_scores_every_changed_composition(schema_db_conn):
+    """Tests counts are added to stored compositions and each changed
+    composition's score is its win rate lower bound"""
+
+    winners, losers = [16000001, 16000002, 16000003], [16000004, 16000005, 16000006]
+    for _ in range(2):
+        update_team_compositions(schema_db_conn, get_mock_battle_log_df(
+            [("Hard Rock Mine", "Victory", winners, losers),
+             ("Gem Fort", "Defeat", winners, losers)]))
+
+    result = schema_db_conn.execute("""SELECT map, wins, games, score
+                                    FROM team_composition_stats
+                                    ORDER BY map, score DESC;""").fetchall()
+
+    assert [row[:3] for row in result] == [("Gem Fort", 2, 2), ("Gem Fort", 0, 2),
+                                           ("Hard Rock Mine", 2, 2), ("Hard Rock Mine", 0, 2)]
+    assert result[0][3] == pytest.approx(get_wilson_interval(Series([2]), Series([2]))[0][0])
+    assert result[1][3] == pytest.approx(0)
+
+if __name__ == "__main__":
+
+    pytest.main()
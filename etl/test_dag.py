@@ -0,0 +1,68 @@
+"""Testing file for dag.py"""
+
+from threading import Barrier
+
+import pytest
+
+from dag import get_stage_order, run_stages
+
+
+def test_get_stage_order_puts_dependencies_first():
+    """Tests every stage comes after the stages it depends on"""
+
+    stage_order = get_stage_order({"starpower": (None, ("brawler",)),
+                                   "brawler": (None, ()),
+                                   "gadget": (None, ("brawler",))})
+
+    assert stage_order[0] == "brawler"
+
+
+@pytest.mark.parametrize("stages", [{"brawler": (None, ("unknown",))},
+                                    {"brawler": (None, ("gadget",)),
+                                     "gadget": (None, ("brawler",))}])
+def test_get_stage_order_invalid_graph_raises_value_error(stages):
+    """Tests unknown dependencies and cycles are rejected"""
+
+    with pytest.raises(ValueError):
+        get_stage_order(stages)
+
+
+def test_run_stages_runs_independent_stages_concurrently():
+    """Tests independent stages run at the same time and dependent stages
+    get their dependencies' results"""
+
+    # Both API stages must be running at once to pass the barrier
+    barrier = Barrier(2, timeout=5)
+
+    def extract(value):
+        barrier.wait()
+        return value
+
+    results = run_stages({
+        "brawler_api": (lambda: extract(["brawler"]), ()),
+        "event_api": (lambda: extract(["event"]), ()),
+        "load": (lambda brawler_api, event_api: brawler_api + event_api,
+                 ("brawler_api", "event_api"))})
+
+    assert results["load"] == ["brawler", "event"]
+
+
+def test_run_stages_stops_after_a_failed_stage():
+    """Tests stages depending on a failed stage are not run"""
+
+    stages_run = []
+
+    def fail():
+        raise ConnectionError("Error: Unable to return brawler data from API!")
+
+    with pytest.raises(ChildProcessError) as exc_info:
+        run_stages({"brawler_api": (fail, ()),
+                    "load": (lambda **_: stages_run.append("load"), ("brawler_api",))})
+
+    assert isinstance(exc_info.value.__cause__, ConnectionError)
+    assert not stages_run
+
+
+if __name__ == "__main__":
+
+    pytest.main()
@@ -0,0 +1,138 @@
+"""Testing file for db.py"""
+
+import sqlite3
+
+import pytest
+
+from db import get_connection_pragmas, transaction, savepoint, ConnectionManager
+
+
+def test_get_connection_pragmas_unknown_profile_raises_value_error():
+    """Tests value error is raised for an unknown connection profile"""
+
+    with pytest.raises(ValueError):
+        get_connection_pragmas({}, "not_a_profile")
+
+
+def test_get_connection_pragmas_uses_config_overrides():
+    """Tests config values override the profile pragmas"""
+
+    pragmas = get_connection_pragmas({"db_cache_size": "-1000"}, "write")
+
+    assert pragmas["cache_size"] == "-1000"
+    assert pragmas["journal_mode"] == "WAL"
+
+
+def test_connection_manager_writer_enables_wal(tmp_path):
+    """Tests the write profile sets WAL journal mode and synchronous=NORMAL"""
+
+    db_manager = ConnectionManager({"dbpath": str(tmp_path / "test.db")})
+
+    with db_manager.writer() as db_conn:
+        assert db_conn.execute("PRAGMA journal_mode;").fetchone()[0] == "wal"
+        assert db_conn.execute("PRAGMA synchronous;").fetchone()[0] == 1
+
+    db_manager.close()
+
+
+def test_transaction_commits_on_success():
+    """Tests transaction commits the enclosed statements"""
+
+    db_conn = sqlite3.connect(":memory:")
+    db_conn.execute("CREATE TABLE test (a INTEGER);")
+
+    with transaction(db_conn):
+        db_conn.execute("INSERT INTO test VALUES (1);")
+
+    assert not db_conn.in_transaction
+    assert db_conn.execute("SELECT COUNT(*) FROM test;").fetchone()[0] == 1
+
+
+def test_transaction_rolls_back_on_error():
+    """Tests transaction rolls back the enclosed statements if an error is raised"""
+
+    db_conn = sqlite3.connect(":memory:")
+    db_conn.execute("CREATE TABLE test (a INTEGER);")
+
+    with pytest.raises(ValueError):
+        with transaction(db_conn):
+            db_conn.execute("INSERT INTO test VALUES (1);")
+            raise ValueError("Error")
+
+    assert db_conn.execute("SELECT COUNT(*) FROM test;").fetchone()[0] == 0
+
+
+def test_savepoint_only_rolls_back_its_statements():
+    """Tests an error in a savepoint keeps the rest of the transaction"""
+
+    db_conn = sqlite3.connect(":memory:")
+    db_conn.execute("CREATE TABLE test (a INTEGER);")
+
+    with transaction(db_conn):
+        db_conn.execute("INSERT INTO test VALUES (1);")
+        with pytest.raises(ValueError):
+            with savepoint(db_conn, "test_savepoint"):
+                db_conn.execute("INSERT INTO test VALUES (2);")
+                raise ValueError("Error")
+
+    assert db_conn.execute("SELECT a FROM test;").fetchall() == [(1,)]
+
+
+def test_connection_manager_reuses_writer(tmp_path):
+    """Tests the connection manager hands out the same writer connection"""
+
+    db_manager = ConnectionManager({"dbpath": str(tmp_path / "test.db")})
+
+    with db_manager.writer() as first_conn:
+        pass
+    with db_manager.writer() as second_conn:
+        pass
+
+    assert first_conn is second_conn
+    assert db_manager.stats()["connections_opened"] == 1
+    db_manager.close()
+
+
+def test_connection_manager_reader_is_read_only(tmp_path):
+    """Tests reader connections cannot write"""
+
+    db_manager = ConnectionManager({"dbpath": str(tmp_path / "test.db")})
+
+    with db_manager.reader() as db_conn:
+        with pytest.raises(sqlite3.OperationalError):
+            db_conn.execute("CREATE TABLE test (a INTEGER);")
+
+    db_manager.close()
+
+
+def test_connection_manager_reader_pool_is_bounded(tmp_path):
+    """Tests returned readers are reused rather than reopened"""
+
+    db_manager = ConnectionManager({"dbpath": str(tmp_path / "test.db")}, readers=1)
+
+    for _ in range(3):
+        with db_manager.reader():
+            pass
+
+    assert db_manager.stats()["readers_open"] == 1
+    assert db_manager.stats()["reader_checkouts"] == 3
+    db_manager.close()
+
+
+def test_connection_manager_counts_statement_cache_hits(tmp_path):
+    """Tests repeated statements are counted as statement cache hits"""
+
+    db_manager = ConnectionManager({"dbpath": str(tmp_path / "test.db")})
+
+    with db_manager.transaction() as db_conn:
+        db_conn.execute("CREATE TABLE test (a INTEGER);")
+        for i in range(3):
+            db_conn.cursor(factory=sqlite3.Cursor).execute("INSERT INTO test VALUES (?);", [i])
+
+    assert db_manager.stats()["statement_cache_hits"] == 2
+    db_manager.close()
+
+
+if __name__ == "__main__":
+
+    pytest.main()
@@ -4,9 +4,13 @@ from unittest.mock import MagicMock
 from sqlite3 import DatabaseError
 
 import pytest
+import requests
 from pandas import DataFrame
 
-from extract import get_brawlers_latest_version, get_brawler_latest_version_id
+import extract
+from extract import (get_brawlers_latest_version, get_brawler_latest_version_id,
+                     get_player_latest_snapshot, get_player_snapshot_at,
+                     get_starpowers_latest_version, get_api_adapter, size_api_session_pool)
 
 
 #TODO Fix me
@@ -91,6 +95,80 @@ def test_get_brawler_latest_version_id_wrong_input_data_type():
 #     assert mock_cursor.fetchone.call_count == 1
 
 
+def insert_mock_trophies(db_conn, trophies: int, created_at: str):
+    """Inserts a player_trophies row for player 1"""
+
+    db_conn.execute("""INSERT INTO player_trophies
+                    (player_id, trophies, highest_trophies, created_at)
+                    VALUES (1, ?, ?, ?);""", [trophies, trophies, created_at])
+
+
+def test_get_player_latest_snapshot_returns_none_values_without_rows(schema_db_conn):
+    """Tests get_player_latest_snapshot returns None values if nothing is stored"""
+
+    result = get_player_latest_snapshot(schema_db_conn, 1)
+
+    assert result["trophies"] is None
+    assert result["exp_level"] is None
+
+
+def test_get_player_latest_snapshot_uses_cache(schema_db_conn):
+    """Tests get_player_latest_snapshot returns the cached snapshot
+    without querying the database"""
+
+    snapshot_cache = {1: {"trophies": 50}}
+    mock_db_conn = MagicMock()
+
+    assert get_player_latest_snapshot(mock_db_conn, 1, snapshot_cache) == {"trophies": 50}
+    assert mock_db_conn.cursor.call_count == 0
+
+
+def test_get_player_snapshot_at_returns_last_value_before_timestamp(schema_db_conn):
+    """Tests get_player_snapshot_at carries the last stored value forward"""
+
+    insert_mock_trophies(schema_db_conn, 100, "2025-01-01 00:00:00")
+    insert_mock_trophies(schema_db_conn, 150, "2025-01-05 00:00:00")
+
+    assert get_player_snapshot_at(schema_db_conn, 1, "2025-01-04 12:00:00")["trophies"] == 100
+    assert get_player_snapshot_at(schema_db_conn, 1, "2025-01-06 00:00:00")["trophies"] == 150
+    assert get_player_snapshot_at(schema_db_conn, 1, "2024-12-31 00:00:00")["trophies"] is None
+
+
+def test_get_starpowers_latest_version_labels_columns(schema_db_conn):
+    """Tests get_starpowers_latest_version reads the current table with matching labels"""
+
+    schema_db_conn.execute("""INSERT INTO starpower_current VALUES
+                           (10, 2, 'SP', 1, 3, 'Brawler');""")
+    result = get_starpowers_latest_version(schema_db_conn)
+
+    assert result.to_dict("records") == [{"brawler_id": 1, "brawler_name": "Brawler",
+                                          "starpower_id": 10, "starpower_version": 2,
+                                          "starpower_name": "SP"}]
+
+
+def test_get_brawler_latest_version_id_returns_zero_for_new_brawler(schema_db_conn):
+    """Tests a brawler without a current version returns version 0"""
+
+    assert get_brawler_latest_version_id(schema_db_conn, 1) == 0
+
+
+
+def test_size_api_session_pool_only_grows_the_pool(monkeypatch):
+    """Tests the API session's pool is grown to the concurrent requests, never shrunk"""
+
+    api_session = requests.Session()
+    api_session.mount("https://", get_api_adapter())
+    monkeypatch.setattr(extract, "API_SESSION", api_session)
+
+    def get_pool_maxsize():
+        return api_session.get_adapter("https://").poolmanager.connection_pool_kw["maxsize"]
+
+    size_api_session_pool(16)
+    assert get_pool_maxsize() == 16
+
+    size_api_session_pool(4)
+    assert get_pool_maxsize() == 16
+
 if __name__ == "__main__":
 
     pytest.main()
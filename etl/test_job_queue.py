@@ -0,0 +1,130 @@
+"""Testing file for job_queue.py"""
+
+import copy
+from datetime import datetime as dt, timedelta
+from threading import Thread
+from time import sleep
+
+import pytest
+
+import roster
+from db import ConnectionManager
+from job_queue import (enqueue_jobs, claim_jobs, complete_jobs, fail_jobs, get_job_counts,
+                       run_worker, LeaseHeartbeat, ROSTER_JOB_TYPE)
+from polling import POLL_TIME_FORMAT
+
+NOW = dt(2025, 4, 13, 12, 0, 0)
+
+
+def test_claimed_jobs_are_not_claimed_again_until_their_lease_expires(schema_db_conn):
+    """Tests each pending job is claimed by one worker and a job whose lease
+    expired is claimed by another worker"""
+
+    enqueue_jobs(schema_db_conn, ROSTER_JOB_TYPE, ["#A", "#B", "#C"])
+
+    first_jobs = claim_jobs(schema_db_conn, ROSTER_JOB_TYPE, "worker-1", 2, 60, now=NOW)
+    second_jobs = claim_jobs(schema_db_conn, ROSTER_JOB_TYPE, "worker-2", 2, 60, now=NOW)
+    expired_jobs = claim_jobs(schema_db_conn, ROSTER_JOB_TYPE, "worker-2", 2, 60,
+                              now=NOW + timedelta(seconds=61))
+
+    assert list(first_jobs.values()) == ["#A", "#B"]
+    assert list(second_jobs.values()) == ["#C"]
+    assert list(expired_jobs.values()) == ["#A", "#B"]
+
+
+def test_only_the_lease_holder_can_complete_a_job(schema_db_conn):
+    """Tests a worker whose lease was taken over does not complete or fail
+    the job and completing a job twice has no effect"""
+
+    enqueue_jobs(schema_db_conn, ROSTER_JOB_TYPE, ["#A"])
+    claim_jobs(schema_db_conn, ROSTER_JOB_TYPE, "worker-1", 1, 60, now=NOW)
+    job_ids = list(claim_jobs(schema_db_conn, ROSTER_JOB_TYPE, "worker-2", 1, 60,
+                              now=NOW + timedelta(seconds=61)))
+
+    assert complete_jobs(schema_db_conn, "worker-1", job_ids) == 0
+    assert fail_jobs(schema_db_conn, "worker-1", dict.fromkeys(job_ids, "Timed out")) == 0
+    assert complete_jobs(schema_db_conn, "worker-2", job_ids) == 1
+    assert complete_jobs(schema_db_conn, "worker-2", job_ids) == 0
+    assert get_job_counts(schema_db_conn, ROSTER_JOB_TYPE) == {"done": 1}
+
+
+def test_failed_jobs_are_retried_until_max_attempts(schema_db_conn):
+    """Tests a failed job is pending again until its last attempt fails"""
+
+    enqueue_jobs(schema_db_conn, ROSTER_JOB_TYPE, ["#A"])
+
+    for attempt in range(2):
+        job_ids = list(claim_jobs(schema_db_conn, ROSTER_JOB_TYPE, "worker-1", 1, 60,
+                                  max_attempts=2, now=NOW))
+        fail_jobs(schema_db_conn, "worker-1", dict.fromkeys(job_ids, "Timed out"),
+                  max_attempts=2)
+        assert get_job_counts(schema_db_conn, ROSTER_JOB_TYPE) == (
+            {"pending": 1} if attempt == 0 else {"failed": 1})
+
+    assert not claim_jobs(schema_db_conn, ROSTER_JOB_TYPE, "worker-1", 1, 60,
+                          max_attempts=2, now=NOW)
+
+
+def test_lease_heartbeat_extends_leases_while_the_workers_writer_is_held(schema_db_manager):
+    """Tests the heartbeat does not wait for the worker's writer, which the
+    worker holds for the whole roster load"""
+
+    with schema_db_manager.transaction() as db_conn:
+        enqueue_jobs(db_conn, ROSTER_JOB_TYPE, ["#A"])
+        job_ids = list(claim_jobs(db_conn, ROSTER_JOB_TYPE, "worker-1", 1, 60, now=NOW))
+
+    with schema_db_manager.writer():
+        with LeaseHeartbeat(schema_db_manager, "worker-1", job_ids, lease_seconds=0.3):
+            sleep(0.25)
+
+    with schema_db_manager.reader() as db_reader:
+        lease_expires_at = db_reader.execute("""SELECT lease_expires_at
+                                             FROM job_queue;""").fetchone()[0]
+
+    assert lease_expires_at > (NOW + timedelta(seconds=60)).strftime(POLL_TIME_FORMAT)
+
+
+def test_workers_share_the_queue_and_complete_every_job(schema_db_manager, tmp_path,
+                                                        monkeypatch, mock_single_bs_battle,
+                                                        mock_player_data_api):
+    """Tests workers with their own connections each claim jobs until the
+    queue is empty and every player is loaded once"""
+
+    monkeypatch.setattr(roster, "get_api_player_data", lambda _api_token, player_tag: {
+        **mock_player_data_api, "tag": player_tag})
+
+    def get_api_player_battle_log(_api_token, player_tag):
+        battle = copy.deepcopy(mock_single_bs_battle)
+        battle["battle"]["teams"][0][0]["tag"] = player_tag
+        return {"items": [battle]}
+
+    monkeypatch.setattr(roster, "get_api_player_battle_log", get_api_player_battle_log)
+    player_tags = [f"#PLAYER{player_number}" for player_number in range(12)]
+    with schema_db_manager.transaction() as db_conn:
+        enqueue_jobs(db_conn, ROSTER_JOB_TYPE, player_tags)
+
+    config = {"api_token": "token", "dbpath": str(tmp_path / "test.db"), "job_batch_size": 2}
+    worker_managers = [ConnectionManager(config) for _ in range(3)]
+    worker_summaries = {}
+
+    def run(worker_number):
+        worker_summaries[worker_number] = run_worker(worker_managers[worker_number], config,
+                                                     worker_id=f"worker-{worker_number}")
+
+    workers = [Thread(target=run, args=(worker_number,)) for worker_number in range(3)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    for worker_manager in worker_managers:
+        worker_manager.close()
+
+    assert sum(summary["jobs_completed"] for summary in worker_summaries.values()) == 12
+    with schema_db_manager.reader() as db_reader:
+        assert get_job_counts(db_reader, ROSTER_JOB_TYPE) == {"done": 12}
+        assert db_reader.execute("SELECT COUNT(*) FROM player;").fetchone()[0] == 12
+
+
+if __name__ == "__main__":
+
+    pytest.main()
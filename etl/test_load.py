@@ -4,7 +4,11 @@ from unittest.mock import MagicMock
 
 import pytest
 
-from load import insert_new_event_data, insert_brawler_db
+from pandas import DataFrame
+
+from load import (insert_new_event_data, insert_brawler_db, dataframe_to_rows,
+                  insert_battle_log_db, insert_new_starpower_data, rebuild_current_tables)
+from transform import BATTLE_LOG_COLUMNS
 
 def test_insert_new_event_empty_dataframe_returns_none(empty_dataframe):
     """Tests insert_new_event_data with an empty dataframe returns none"""
@@ -47,6 +51,116 @@ def test_insert_new_brawler_data_wrong_data_type():
         mock_db_conn = MagicMock()
         insert_brawler_db(mock_db_conn, "not_a_dataframe")
 
+def test_dataframe_to_rows_orders_columns():
+    """Tests dataframe_to_rows returns tuples in the requested column order"""
+
+    data = DataFrame({"b": ["x", "y"], "a": [1, 2]})
+    assert dataframe_to_rows(data, ["a", "b"]) == [(1, "x"), (2, "y")]
+
+def test_dataframe_to_rows_returns_python_types():
+    """Tests dataframe_to_rows converts numpy values to python types"""
+
+    data = DataFrame({"a": [1, 2], "b": [1.5, None]})
+    rows = dataframe_to_rows(data, ["a", "b"])
+
+    assert isinstance(rows[0][0], int)
+    assert rows[1][1] is None
+
+def test_insert_new_brawler_data_calls_executemany_per_table():
+    """Tests insert_brawler_db inserts every row with a single executemany
+    into brawler and brawler_current and increments the brawler version"""
+
+    mock_db_conn = MagicMock()
+    mock_cursor = mock_db_conn.cursor.return_value
+    brawler_data = DataFrame({"brawler_id": [1, 2], "brawler_name": ["A", "B"],
+                              "brawler_version": [0, 3]})
+    insert_brawler_db(mock_db_conn, brawler_data)
+
+    assert mock_cursor.executemany.call_count == 2
+    for call in mock_cursor.executemany.call_args_list:
+        assert call[0][1] == [(1, 1, "A"), (2, 4, "B")]
+
+def test_insert_brawler_and_starpower_data_updates_current_tables(schema_db_conn):
+    """Tests the current tables hold the latest version after each load"""
+
+    for brawler_version, brawler_name in ((0, "A"), (1, "B")):
+        insert_brawler_db(schema_db_conn, DataFrame({"brawler_id": [1],
+                                                     "brawler_name": [brawler_name],
+                                                     "brawler_version": [brawler_version]}))
+    insert_new_starpower_data(schema_db_conn, DataFrame({"starpower_id": [10],
+                                                         "starpower_name": ["SP"],
+                                                         "starpower_version": [0],
+                                                         "brawler_id": [1],
+                                                         "brawler_version": [2]}))
+
+    assert schema_db_conn.execute("SELECT * FROM brawler_current;").fetchall() == [(1, 2, "B")]
+    assert schema_db_conn.execute("SELECT * FROM starpower_current;").fetchall() == [
+        (10, 1, "SP", 1, 2, "B")]
+
+def test_insert_new_event_data_does_not_downgrade_current_version(schema_db_conn):
+    """Tests an older event version does not replace the current version"""
+
+    for event_version in (2, 1):
+        insert_new_event_data(schema_db_conn, DataFrame({"event_id": [5],
+                                                         "event_version": [event_version],
+                                                         "mode": ["Gem Grab"],
+                                                         "map": [f"Map {event_version}"]}))
+
+    assert schema_db_conn.execute("SELECT * FROM bs_event_current;").fetchall() == [
+        (5, 2, "Gem Grab", "Map 2")]
+
+def test_rebuild_current_tables_matches_version_history(schema_db_conn):
+    """Tests rebuilt current tables hold the latest version of each entity"""
+
+    schema_db_conn.executemany("""INSERT INTO bs_event (bs_event_id, bs_event_version, mode, map)
+                               VALUES (?, ?, ?, ?);""",
+                               [(1, 1, "Heist", "Old"), (1, 2, "Heist", "New"),
+                                (2, 1, "Bounty", "Only")])
+    rebuild_current_tables(schema_db_conn)
+
+    assert schema_db_conn.execute("""SELECT bs_event_id, map FROM bs_event_current
+                                  ORDER BY bs_event_id;""").fetchall() == [(1, "New"),
+                                                                           (2, "Only")]
+
+def get_mock_battle_log_df(battle_times: list[str]) -> DataFrame:
+    """Returns a battle log dataframe with one battle per battle time"""
+
+    return DataFrame([["#LLPCV2GVP", battle_time, 15000132, "Brawl Ball", "Center Stage",
+                       "Solo Ranked", "Defeat", 150, None, 16000025, False, 16,
+                       [16000025], [16000001]]
+                      for battle_time in battle_times], columns=BATTLE_LOG_COLUMNS)
+
+def test_insert_battle_log_db_wrong_data_type():
+    """Tests insert_battle_log_db with an incorrect data type raises a TypeError"""
+
+    with pytest.raises(TypeError):
+        insert_battle_log_db(MagicMock(), "not_a_dataframe")
+
+def test_insert_battle_log_db_inserts_battles_and_battle_types(schema_db_conn):
+    """Tests insert_battle_log_db inserts every battle and its battle type"""
+
+    battle_log_df = get_mock_battle_log_df(["2025-04-13 09:22:06", "2025-04-13 09:30:00"])
+
+    assert insert_battle_log_db(schema_db_conn, battle_log_df) == 2
+    assert schema_db_conn.execute("""SELECT bt.battle_type_name
+                                  FROM battle b
+                                  INNER JOIN battle_type bt
+                                  ON b.battle_type_id = bt.battle_type_id
+                                  LIMIT 1;""").fetchone()[0] == "Solo Ranked"
+
+def test_insert_battle_log_db_skips_overlapping_battles(schema_db_conn):
+    """Tests re-inserting an overlapping battle log only inserts new battles"""
+
+    insert_battle_log_db(schema_db_conn, get_mock_battle_log_df(["2025-04-13 09:22:06",
+                                                                 "2025-04-13 09:30:00"]))
+    inserted = insert_battle_log_db(schema_db_conn,
+                                    get_mock_battle_log_df(["2025-04-13 09:30:00",
+                                                            "2025-04-13 09:40:00"]))
+
+    assert inserted == 1
+    assert schema_db_conn.execute("SELECT COUNT(*) FROM battle;").fetchone()[0] == 3
+    assert schema_db_conn.execute("SELECT COUNT(*) FROM battle_type;").fetchone()[0] == 1
+
 if __name__ == "__main__":
 
     pytest.main()
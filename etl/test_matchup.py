@@ -0,0 +1,88 @@
+"""Testing file for matchup.py"""
+
+import pytest
+from pandas import DataFrame
+
+from matchup import (MatchupMatrix, load_matchup_matrix, update_matchup_matrices,
+                     array_to_blob, blob_to_array, pad_brawler_ids)
+
+
+def get_mock_battle_log_df(battles: list[tuple]) -> DataFrame:
+    """Returns a battle log dataframe from (mode, result, team ids, opponent ids) tuples"""
+
+    return DataFrame([{"event_mode": mode, "result": result, "team_brawler_ids": team,
+                       "opponent_brawler_ids": opponents}
+                      for mode, result, team, opponents in battles])
+
+
+def test_pad_brawler_ids_pads_smaller_teams():
+    """Tests teams of different sizes are padded with -1"""
+
+    assert pad_brawler_ids([[16000001], [16000002, 16000003]]).tolist() == [[1, -1], [2, 3]]
+
+
+def test_add_battles_counts_both_sides_of_every_pair():
+    """Tests a win is counted for the winning brawlers and a loss for the losers"""
+
+    matchup_matrix = MatchupMatrix("Gem Grab")
+    matchup_matrix.add_battles(get_mock_battle_log_df([
+        ("Gem Grab", "Victory", [16000001, 16000002], [16000003]),
+        ("Gem Grab", "Defeat", [16000001], [16000003]),
+        ("Gem Grab", "Draw", [16000001], [16000003]),
+        ("Heist", "Victory", [16000001], [16000003])]))
+
+    assert matchup_matrix.games[1, 3] == 2
+    assert matchup_matrix.wins[1, 3] == 1
+    assert matchup_matrix.wins[3, 1] == 1
+    assert matchup_matrix.wins[2, 3] == 1 and matchup_matrix.games[3, 2] == 1
+
+
+def test_get_brawler_matchups_returns_played_opponents():
+    """Tests a brawler's matchups only include opponents it has played"""
+
+    matchup_matrix = MatchupMatrix("Gem Grab")
+    matchup_matrix.add_battles(get_mock_battle_log_df([
+        ("Gem Grab", "Victory", [16000001], [16000003]),
+        ("Gem Grab", "Victory", [16000001], [16000003])]))
+
+    result = matchup_matrix.get_brawler_matchups(16000001)
+
+    assert result.values.tolist() == [[16000003, 2, 2, 1.0]]
+
+
+def test_merge_adds_matrices_of_different_sizes():
+    """Tests merging a larger matrix grows the matrix and adds the counts"""
+
+    matchup_matrix = MatchupMatrix("Gem Grab", size=2)
+    other_matrix = MatchupMatrix("Gem Grab", size=4)
+    other_matrix.games[3, 1] = 5
+    matchup_matrix.merge(other_matrix)
+
+    assert matchup_matrix.size == 4
+    assert matchup_matrix.games[3, 1] == 5
+
+
+def test_array_to_blob_round_trips():
+    """Tests a stored array is loaded unchanged"""
+
+    matchup_matrix = MatchupMatrix("Gem Grab", size=3)
+    matchup_matrix.wins[1, 2] = 7
+
+    assert (blob_to_array(array_to_blob(matchup_matrix.wins)) == matchup_matrix.wins).all()
+
+
+def test_update_matchup_matrices_adds_to_stored_matrix(schema_db_conn):
+    """Tests matrices are stored and later battles are added to them"""
+
+    battle_log_df = get_mock_battle_log_df([("Gem Grab", "Victory", [16000001], [16000002])])
+
+    update_matchup_matrices(schema_db_conn, battle_log_df)
+    update_matchup_matrices(schema_db_conn, battle_log_df)
+
+    assert load_matchup_matrix(schema_db_conn, "Gem Grab").games[1, 2] == 2
+    assert load_matchup_matrix(schema_db_conn, "Heist").size == 0
+
+
+if __name__ == "__main__":
+
+    pytest.main()
@@ -0,0 +1,97 @@
+"""Testing file for metrics.py"""
+
+from types import SimpleNamespace
+
+import pytest
+
+from dag import run_stages
+from metrics import (EtlMetrics, stage, timed_stage, record_api_response, run_with_metrics,
+                     save_metrics, get_latest_metrics, write_prometheus_textfile)
+
+
+def test_stage_does_nothing_outside_a_run():
+    """Tests stages can run without metrics being collected"""
+
+    with stage("extract_player_data") as stage_counts:
+        stage_counts["records"] = 1
+
+    assert timed_stage("transform_player_data", lambda: [1, 2])() == [1, 2]
+
+
+def test_run_with_metrics_saves_every_stage_of_the_run(schema_db_manager):
+    """Tests stages on other threads, API responses and rows written are
+    counted in their stage and saved with a row for the whole run"""
+
+    def load(conn):
+        with stage("load_player_data", conn) as stage_counts:
+            conn.executemany("INSERT INTO roster (player_tag) VALUES (?);", [("#A",), ("#B",)])
+            stage_counts["records"] = 2
+
+    def extract():
+        record_api_response(SimpleNamespace(raw=None, content=b"{}"))
+        return ["#A", "#B"]
+
+    def run():
+        run_stages({"extract": (timed_stage("extract_player_data", extract), ())})
+        with schema_db_manager.transaction() as conn:
+            load(conn)
+
+    run_with_metrics(schema_db_manager, {}, "Roster ETL", run)
+
+    with schema_db_manager.reader() as db_reader:
+        latest_metrics_df = get_latest_metrics(db_reader).set_index("process_stage")
+
+    assert latest_metrics_df.index.tolist() == ["extract_player_data", "load_player_data", "run"]
+    assert latest_metrics_df.loc["extract_player_data", ["records", "api_calls", "bytes"]
+                                 ].tolist() == [2, 1, 2]
+    assert latest_metrics_df.loc["load_player_data", ["records", "rows_written"]
+                                 ].tolist() == [2, 2]
+    assert latest_metrics_df.loc["run", "seconds"] >= latest_metrics_df["seconds"].iloc[:2].max()
+
+
+def test_failed_run_metrics_are_exported_as_prometheus_text(schema_db_manager, tmp_path):
+    """Tests the metrics of a failed run are still saved and the textfile
+    has a gauge per metric labelled by process and stage"""
+
+    def fail():
+        with stage("extract_event_rotation"):
+            raise ConnectionError("Error: Unable to retrieve data from API!")
+
+    textfile_path = tmp_path / "brawl_stars_etl.prom"
+
+    with pytest.raises(ConnectionError):
+        run_with_metrics(schema_db_manager, {"metrics_textfile": str(textfile_path)},
+                         "Event Rotation ETL", fail)
+
+    textfile_lines = textfile_path.read_text(encoding="utf-8").splitlines()
+
+    assert "# TYPE brawl_stars_etl_stage_seconds gauge" in textfile_lines
+    assert ('brawl_stars_etl_stage_calls{process="Event Rotation ETL",'
+            'stage="extract_event_rotation"} 1') in textfile_lines
+
+    with schema_db_manager.reader() as db_reader:
+        write_prometheus_textfile(db_reader, str(textfile_path))
+
+    assert textfile_path.read_text(encoding="utf-8").splitlines() == textfile_lines
+
+
+def test_runs_started_at_the_same_time_keep_their_own_metrics(schema_db_conn):
+    """Tests concurrent runs of a process (e.g. job queue workers) saved with
+    the same start time do not overwrite each other's rows"""
+
+    worker_metrics = [EtlMetrics("Roster ETL"), EtlMetrics("Roster ETL")]
+
+    for records, metrics in enumerate(worker_metrics, start=1):
+        metrics.started_at = worker_metrics[0].started_at
+        metrics.add("load_player_data", records=records)
+        save_metrics(schema_db_conn, metrics)
+
+    assert schema_db_conn.execute("""SELECT records
+                                  FROM etl_metric
+                                  ORDER BY records;""").fetchall() == [(1,), (2,)]
+    assert len(get_latest_metrics(schema_db_conn)) == 1
+
+
+if __name__ == "__main__":
+
+    pytest.main()
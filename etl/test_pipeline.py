@@ -0,0 +1,117 @@
+"""Testing file for pipeline.py"""
+
+from threading import current_thread, main_thread
+
+import pytest
+
+from db import ConnectionManager
+from pipeline import WriteBehindLoader
+
+
+def create_test_table(db_conn):
+    """Creates the table used by the loader tests"""
+
+    db_conn.execute("CREATE TABLE IF NOT EXISTS test (a INTEGER);")
+
+
+def insert_test_rows(db_conn, rows: list[int]):
+    """Inserts rows into the test table"""
+
+    db_conn.executemany("INSERT INTO test VALUES (?);", [(row,) for row in rows])
+
+
+@pytest.fixture
+def db_manager(tmp_path):
+    """Returns a connection manager with an empty test table"""
+
+    manager = ConnectionManager({"dbpath": str(tmp_path / "test.db")})
+    with manager.transaction() as db_conn:
+        create_test_table(db_conn)
+    yield manager
+    manager.close()
+
+
+def test_write_behind_loader_loads_all_batches(db_manager):
+    """Tests every submitted batch is loaded and committed"""
+
+    with WriteBehindLoader(db_manager, max_queued_batches=2) as loader:
+        for start in range(0, 30, 10):
+            loader.submit(insert_test_rows, list(range(start, start + 10)))
+
+    with db_manager.reader() as db_conn:
+        assert db_conn.execute("SELECT COUNT(*) FROM test;").fetchone()[0] == 30
+    assert loader.batches_loaded == 3
+
+
+def test_write_behind_loader_loads_on_writer_thread(db_manager):
+    """Tests batches are loaded on the loader thread, not the submitting thread"""
+
+    load_threads = []
+
+    with WriteBehindLoader(db_manager) as loader:
+        loader.submit(lambda db_conn: load_threads.append(current_thread()))
+
+    assert load_threads[0] is not main_thread()
+
+
+def test_write_behind_loader_raises_load_errors_on_close(db_manager):
+    """Tests an error in a load function is raised when the loader is closed
+    and the failed batch is rolled back"""
+
+    def failing_load(db_conn):
+        insert_test_rows(db_conn, [1])
+        raise ValueError("Error")
+
+    with pytest.raises(ChildProcessError):
+        with WriteBehindLoader(db_manager) as loader:
+            loader.submit(failing_load)
+
+    with db_manager.reader() as db_conn:
+        assert db_conn.execute("SELECT COUNT(*) FROM test;").fetchone()[0] == 0
+
+
+@pytest.mark.parametrize("commit_every, rows_committed", [(2, 20), (3, 0)])
+def test_write_behind_loader_commits_every_commit_every_batches(db_manager, commit_every,
+                                                               rows_committed):
+    """Tests batches are committed in groups of commit_every, so a failed
+    batch only rolls back the batches loaded since the last commit"""
+
+    def failing_load(db_conn):
+        insert_test_rows(db_conn, [1])
+        raise ValueError("Error")
+
+    with pytest.raises(ChildProcessError):
+        with WriteBehindLoader(db_manager, commit_every=commit_every) as loader:
+            for start in range(0, 20, 10):
+                loader.submit(insert_test_rows, list(range(start, start + 10)))
+            loader.submit(failing_load)
+
+    with db_manager.reader() as db_conn:
+        assert db_conn.execute("SELECT COUNT(*) FROM test;").fetchone()[0] == rows_committed
+
+
+def test_write_behind_loader_passes_committed_results_to_on_commit(db_manager):
+    """Tests on_commit only receives the results of committed batches"""
+
+    committed_results = []
+
+    def load(db_conn, rows: list[int]):
+        insert_test_rows(db_conn, rows)
+        return rows
+
+    def failing_load(db_conn):
+        raise ValueError("Error")
+
+    with pytest.raises(ChildProcessError):
+        with WriteBehindLoader(db_manager, commit_every=2,
+                               on_commit=committed_results.append) as loader:
+            for row in range(3):
+                loader.submit(load, [row])
+            loader.submit(failing_load)
+
+    assert committed_results == [[0], [1]]
+
+
+if __name__ == "__main__":
+
+    pytest.main()
@@ -0,0 +1,74 @@
+"""Testing file for polling.py"""
+
+from datetime import datetime as dt, timedelta
+
+import pytest
+from pandas import Series
+
+from polling import (get_battle_rates, get_poll_intervals, PollQueue, RequestBudget,
+                     POLL_TIME_FORMAT)
+
+NOW = dt(2025, 4, 13, 12, 0)
+
+
+def test_get_battle_rates_counts_battles_per_hour(schema_db_conn):
+    """Tests the rate is battles per hour since the player's first recent
+    battle and players without recent battles have a rate of 0"""
+
+    schema_db_conn.executemany("""INSERT INTO battle (player_tag, battle_time, bs_event_id,
+                               brawler_id) VALUES (?, ?, 1, 1);""",
+                               [("#LLPCV2GVP", (NOW - timedelta(minutes=30 * i))
+                                 .strftime(POLL_TIME_FORMAT)) for i in range(1, 11)]
+                               + [("#8QC8RP02", "2025-01-01 00:00:00")])
+
+    result = get_battle_rates(schema_db_conn, ["#LLPCV2GVP", "#8QC8RP02"], NOW)
+
+    assert result.to_dict() == {"#LLPCV2GVP": 2.0, "#8QC8RP02": 0.0}
+
+
+def test_get_poll_intervals_keeps_expected_battles_below_window():
+    """Tests active players are polled before filling the battle log window
+    and intervals stay within the configured bounds"""
+
+    result = get_poll_intervals(Series([2.0, 0.0, 1000.0]), {"poll_target_fill": "0.8"})
+
+    assert result.tolist() == [600.0, 1440.0, 15.0]
+
+
+def test_poll_queue_pops_most_overdue_players_first():
+    """Tests due players are popped in next poll order up to the limit,
+    with players never polled first"""
+
+    poll_queue = PollQueue()
+    poll_queue.sync({"#A": "2025-04-13 11:00:00", "#B": None, "#C": "2025-04-13 10:00:00",
+                     "#D": "2025-04-13 13:00:00"})
+
+    assert poll_queue.pop_due(NOW, limit=2) == ["#B", "#C"]
+    assert poll_queue.pop_due(NOW, limit=2) == ["#A"]
+
+
+def test_poll_queue_sync_reschedules_and_removes_players():
+    """Tests rescheduled players are popped at their new time and removed
+    players are not popped"""
+
+    poll_queue = PollQueue()
+    poll_queue.sync({"#A": "2025-04-13 10:00:00", "#B": "2025-04-13 11:00:00"})
+    poll_queue.sync({"#A": "2025-04-13 14:00:00"})
+
+    assert not poll_queue.pop_due(NOW, limit=10)
+    assert len(poll_queue) == 1
+
+
+def test_request_budget_refills_up_to_one_hour():
+    """Tests spent requests are refilled over time, up to one hour of requests"""
+
+    request_budget = RequestBudget(requests_per_hour=60, now=NOW)
+    request_budget.spend(request_budget.get_available(NOW))
+
+    assert request_budget.get_available(NOW + timedelta(minutes=30)) == 30
+    assert request_budget.get_available(NOW + timedelta(hours=5)) == 60
+
+
+if __name__ == "__main__":
+
+    pytest.main()
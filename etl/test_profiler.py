@@ -0,0 +1,61 @@
+"""Testing file for profiler.py"""
+
+import pstats
+
+import pytest
+
+from main import get_etl_stages, ETL_STAGE_NAMES
+from profiler import get_profiled_stages, profile_stage
+
+
+def test_get_profiled_stages_only_returns_known_stages():
+    """Tests stages are only profiled when named in etl_profile"""
+
+    assert not get_profiled_stages({}, ETL_STAGE_NAMES)
+    assert get_profiled_stages({"etl_profile": "player_etl, unknown"},
+                               ETL_STAGE_NAMES) == {"player_etl"}
+    assert get_profiled_stages({"etl_profile": "all"}, ETL_STAGE_NAMES) == set(ETL_STAGE_NAMES)
+
+
+def test_profile_stage_dumps_pstats_and_allocations_of_a_failed_run(tmp_path):
+    """Tests a profiled stage dumps a pstats file with its calls and its top
+    allocation sites, even when it fails"""
+
+    def transform_battles():
+        battles = [{"battle_id": battle_id} for battle_id in range(10_000)]
+        raise ValueError(len(battles))
+
+    config = {"etl_profile_dir": str(tmp_path), "etl_profile_top_allocations": "5"}
+
+    with pytest.raises(ValueError):
+        profile_stage("battle_log_etl", transform_battles, config)()
+
+    pstats_path, = tmp_path.glob("battle_log_etl_*.pstats")
+    allocations_path, = tmp_path.glob("battle_log_etl_*_allocations.txt")
+    allocation_lines = allocations_path.read_text(encoding="utf-8").splitlines()
+
+    assert any(function_name == "transform_battles"
+               for _, _, function_name in pstats.Stats(str(pstats_path)).stats)
+    assert allocation_lines[0].startswith("Peak traced memory:")
+    assert "test_profiler.py" in allocation_lines[1]
+    assert len(allocation_lines) <= 6
+
+
+def test_get_etl_stages_only_wraps_profiled_etls(schema_db_manager, tmp_path, monkeypatch):
+    """Tests only the ETLs named in etl_profile are profiled"""
+
+    monkeypatch.setattr("main.run_brawler_etl", lambda *_args: None)
+    monkeypatch.setattr("main.run_player_etl", lambda *_args: None)
+    config = {"etl_profile": "brawler_etl", "etl_profile_dir": str(tmp_path)}
+
+    stages = get_etl_stages(schema_db_manager, config, {"Brawler ETL", "Player ETL"})
+    for stage_function, _ in stages.values():
+        stage_function()
+
+    assert [profile_path.name.split("_2")[0]
+            for profile_path in tmp_path.glob("*.pstats")] == ["brawler_etl"]
+
+
+if __name__ == "__main__":
+
+    pytest.main()
@@ -0,0 +1,113 @@
+"""Testing file for rollup.py"""
+
+import pytest
+from pandas import Series
+
+from extract import get_player_snapshot_at
+from rollup import (get_bucket_start, rollup_player_history, compact_player_history,
+                    get_player_stat_history, get_rollup_checkpoint)
+
+
+def insert_mock_trophies(db_conn, trophies: int, created_at: str):
+    """Inserts a player_trophies row for player 1"""
+
+    db_conn.execute("""INSERT INTO player_trophies
+                    (player_id, trophies, highest_trophies, created_at)
+                    VALUES (1, ?, ?, ?);""", [trophies, trophies, created_at])
+
+
+def test_get_bucket_start_week_starts_on_monday():
+    """Tests weekly buckets start on the Monday of the week"""
+
+    result = get_bucket_start(Series(["2025-04-13 09:22:06"]), "week")
+    assert result[0] == "2025-04-07 00:00:00"
+
+
+def test_get_bucket_start_unknown_granularity_raises_value_error():
+    """Tests value error is raised for an unknown granularity"""
+
+    with pytest.raises(ValueError):
+        get_bucket_start(Series(["2025-04-13 09:22:06"]), "month")
+
+
+def test_rollup_player_history_aggregates_buckets(schema_db_conn):
+    """Tests raw rows are aggregated into min/max/last per hour"""
+
+    insert_mock_trophies(schema_db_conn, 100, "2025-04-13 09:00:00")
+    insert_mock_trophies(schema_db_conn, 120, "2025-04-13 09:20:00")
+    insert_mock_trophies(schema_db_conn, 110, "2025-04-13 09:40:00")
+    rollup_player_history(schema_db_conn)
+
+    assert schema_db_conn.execute("""SELECT first_value, last_value, min_value, max_value
+                                  FROM player_stat_rollup
+                                  WHERE stat_name = 'trophies'
+                                  AND granularity = 'hour';""").fetchall() == [(100, 110,
+                                                                                100, 120)]
+
+
+def test_rollup_player_history_only_processes_new_rows(schema_db_conn):
+    """Tests a second rollup merges only rows newer than the checkpoint"""
+
+    insert_mock_trophies(schema_db_conn, 100, "2025-04-13 09:00:00")
+    rollup_player_history(schema_db_conn)
+    insert_mock_trophies(schema_db_conn, 90, "2025-04-13 09:30:00")
+
+    assert rollup_player_history(schema_db_conn) == 1
+    assert get_rollup_checkpoint(schema_db_conn, "player_trophies") == 2
+    assert schema_db_conn.execute("""SELECT first_value, last_value, min_value, sample_count
+                                  FROM player_stat_rollup
+                                  WHERE stat_name = 'trophies'
+                                  AND granularity = 'day';""").fetchall() == [(100, 90, 90, 2)]
+
+
+def test_get_player_stat_history_returns_delta_from_previous_bucket(schema_db_conn):
+    """Tests the delta of a bucket is measured from the previous bucket"""
+
+    insert_mock_trophies(schema_db_conn, 100, "2025-04-11 09:00:00")
+    insert_mock_trophies(schema_db_conn, 130, "2025-04-13 09:00:00")
+    rollup_player_history(schema_db_conn)
+
+    result = get_player_stat_history(schema_db_conn, 1, "trophies", "day",
+                                     "2025-04-12 00:00:00")
+
+    assert result["last_value"].tolist() == [130]
+    assert result["delta"].tolist() == [30]
+
+
+def test_compact_player_history_keeps_latest_row(schema_db_conn):
+    """Tests compaction deletes old rolled up rows but keeps each player's latest row"""
+
+    insert_mock_trophies(schema_db_conn, 100, "2020-01-01 00:00:00")
+    insert_mock_trophies(schema_db_conn, 110, "2020-01-02 00:00:00")
+    rollup_player_history(schema_db_conn)
+
+    assert compact_player_history(schema_db_conn, 90) == 1
+    assert schema_db_conn.execute("SELECT trophies FROM player_trophies;").fetchall() == [(110,)]
+
+
+def test_compact_player_history_keeps_rows_not_rolled_up(schema_db_conn):
+    """Tests compaction does not delete rows newer than the rollup checkpoint"""
+
+    insert_mock_trophies(schema_db_conn, 100, "2020-01-01 00:00:00")
+    insert_mock_trophies(schema_db_conn, 110, "2020-01-02 00:00:00")
+
+    assert compact_player_history(schema_db_conn, 90) == 0
+
+
+def test_get_player_snapshot_at_reads_compacted_values_from_rollups(schema_db_conn):
+    """Tests values whose raw rows were compacted are read from the hourly rollups"""
+
+    insert_mock_trophies(schema_db_conn, 100, "2020-01-01 09:10:00")
+    insert_mock_trophies(schema_db_conn, 105, "2020-01-01 09:40:00")
+    insert_mock_trophies(schema_db_conn, 110, "2020-01-02 00:00:00")
+    rollup_player_history(schema_db_conn)
+    compact_player_history(schema_db_conn, 90)
+
+    assert get_player_snapshot_at(schema_db_conn, 1, "2020-01-01 12:00:00")["trophies"] == 105
+    assert get_player_snapshot_at(schema_db_conn, 1, "2020-01-03 00:00:00")["trophies"] == 110
+    assert get_player_snapshot_at(schema_db_conn, 1, "2019-12-31 00:00:00")["trophies"] is None
+
+
+if __name__ == "__main__":
+
+    pytest.main()
@@ -0,0 +1,229 @@
+"""Testing file for roster.py"""
+
+import copy
+
+import pytest
+
+import roster
+from roster import (add_roster_players, remove_roster_players, get_roster_player_tags,
+                    transform_roster_battle_logs, etl_roster_batch, etl_roster,
+                    run_roster_polls)
+from backend import SQLiteBackend
+from polling import PollQueue, RequestBudget, get_roster_polls
+from shard import SCHEMA_PATH, ShardRouter, create_shard_databases, get_shard_index
+
+
+def test_roster_players_can_be_added_and_removed(schema_db_conn):
+    """Tests added players are active until removed and can be added back"""
+
+    add_roster_players(schema_db_conn, ["llpcv2gvp", "#8QC8RP02"])
+    remove_roster_players(schema_db_conn, ["#LLPCV2GVP"])
+
+    assert get_roster_player_tags(schema_db_conn) == ["#8QC8RP02"]
+
+    add_roster_players(schema_db_conn, ["#LLPCV2GVP"])
+
+    assert get_roster_player_tags(schema_db_conn) == ["#8QC8RP02", "#LLPCV2GVP"]
+
+
+def test_transform_roster_battle_logs_keeps_battles_newer_than_stored(schema_db_conn,
+                                                                       mock_single_bs_battle):
+    """Tests every player's battles are transformed together and battles
+    already stored for a player are dropped"""
+
+    schema_db_conn.execute("""INSERT INTO battle (player_tag, battle_time, bs_event_id,
+                           brawler_id) VALUES ('#LLPCV2GVP', '2025-04-13 09:22:06', 1, 1);""")
+    battle_logs = {"#LLPCV2GVP": {"items": [copy.deepcopy(mock_single_bs_battle)]},
+                   "#8QC8RP02": {"items": [copy.deepcopy(mock_single_bs_battle)]},
+                   "#2LPRQUV92": {"items": [{"event": {"id": 15000132}}]}}
+
+    battle_log_df, failures = transform_roster_battle_logs(schema_db_conn, battle_logs)
+
+    assert battle_log_df["player_tag"].tolist() == ["#8QC8RP02"]
+    assert list(failures) == ["#2LPRQUV92"]
+
+
+def test_etl_roster_batch_loads_players_that_did_not_fail(schema_db_manager, monkeypatch,
+                                                          mock_single_bs_battle,
+                                                          mock_player_data_api):
+    """Tests a player whose extraction fails does not stop the rest of the batch"""
+
+    def get_api_player_data(_api_token, player_tag):
+        if player_tag == "#2LPRQUV92":
+            raise ConnectionError("Error: Unable to retrieve player data from API!")
+        return {**mock_player_data_api, "tag": player_tag}
+
+    monkeypatch.setattr(roster, "get_api_player_data", get_api_player_data)
+    monkeypatch.setattr(roster, "get_api_player_battle_log", lambda _api_token, _player_tag: {
+        "items": [copy.deepcopy(mock_single_bs_battle)]})
+
+    result = etl_roster_batch(schema_db_manager, schema_db_manager, {"api_token": "token"},
+                              ["#LLPCV2GVP", "#8QC8RP02", "#2LPRQUV92"], {},
+                              SQLiteBackend({}))
+
+    assert result["players_loaded"] == 2
+    assert result["battles_loaded"] == 2
+    assert list(result["failures"]) == ["#2LPRQUV92"]
+    with schema_db_manager.reader() as db_reader:
+        assert db_reader.execute("SELECT COUNT(*) FROM player;").fetchone()[0] == 2
+
+
+def test_run_roster_polls_polls_due_players_within_budget(schema_db_manager, monkeypatch,
+                                                         mock_single_bs_battle,
+                                                         mock_player_data_api):
+    """Tests only as many due players as the request budget allows are polled
+    and polled players are scheduled again"""
+
+    monkeypatch.setattr(roster, "get_api_player_data", lambda _api_token, player_tag: {
+        **mock_player_data_api, "tag": player_tag})
+    monkeypatch.setattr(roster, "get_api_player_battle_log", lambda _api_token, _player_tag: {
+        "items": [copy.deepcopy(mock_single_bs_battle)]})
+    with schema_db_manager.transaction() as db_conn:
+        add_roster_players(db_conn, ["#LLPCV2GVP", "#8QC8RP02", "#2LPRQUV92"])
+
+    result = run_roster_polls(schema_db_manager, {"api_token": "token"}, None, PollQueue(),
+                              RequestBudget(requests_per_hour=4))
+
+    with schema_db_manager.reader() as db_reader:
+        roster_polls = get_roster_polls(db_reader)
+
+    assert result["players_loaded"] == 2
+    assert roster_polls["#LLPCV2GVP"] is None
+    assert all(roster_polls[player_tag] for player_tag in ("#2LPRQUV92", "#8QC8RP02"))
+
+
+def test_etl_roster_resumes_after_the_last_committed_player(schema_db_manager, monkeypatch,
+                                                            mock_single_bs_battle,
+                                                            mock_player_data_api):
+    """Tests a run after a failed run only extracts the players the failed
+    run did not commit, and the checkpoints are cleared when it ends"""
+
+    extracted_batches = []
+    failed_batches = []
+
+    # The second batch of the first run fails
+    def extract_roster_batch(_api_token, player_tags, _max_workers):
+        if len(extracted_batches) == 1 and not failed_batches:
+            failed_batches.append(player_tags)
+            raise ConnectionError("Error: Unable to retrieve data from API!")
+        extracted_batches.append(player_tags)
+        return ({player_tag: ({**mock_player_data_api, "tag": player_tag},
+                              {"items": [copy.deepcopy(mock_single_bs_battle)]})
+                 for player_tag in player_tags}, {})
+
+    monkeypatch.setattr(roster, "extract_roster_batch", extract_roster_batch)
+    with schema_db_manager.transaction() as db_conn:
+        add_roster_players(db_conn, ["#LLPCV2GVP", "#8QC8RP02", "#2LPRQUV92"])
+    config = {"api_token": "token", "roster_batch_size": 1}
+
+    with pytest.raises(ChildProcessError):
+        etl_roster(schema_db_manager, config)
+
+    result = etl_roster(schema_db_manager, config)
+
+    assert extracted_batches == [["#2LPRQUV92"], ["#8QC8RP02"], ["#LLPCV2GVP"]]
+    assert result["players_loaded"] == 2
+    with schema_db_manager.reader() as db_reader:
+        assert db_reader.execute("SELECT COUNT(*) FROM player;").fetchone()[0] == 3
+        assert db_reader.execute("SELECT COUNT(*) FROM process_checkpoint;").fetchone()[0] == 0
+
+
+def test_etl_roster_resumes_after_the_last_committed_player_when_the_roster_changes(
+        schema_db_manager, monkeypatch, mock_single_bs_battle, mock_player_data_api):
+    """Tests a player removed from the roster between a failed run and the
+    next run does not make the next run skip players it did not commit"""
+
+    extracted_batches = []
+    failed_batches = []
+
+    # The second batch of the first run fails
+    def extract_roster_batch(_api_token, player_tags, _max_workers):
+        if len(extracted_batches) == 1 and not failed_batches:
+            failed_batches.append(player_tags)
+            raise ConnectionError("Error: Unable to retrieve data from API!")
+        extracted_batches.append(player_tags)
+        return ({player_tag: ({**mock_player_data_api, "tag": player_tag},
+                              {"items": [copy.deepcopy(mock_single_bs_battle)]})
+                 for player_tag in player_tags}, {})
+
+    monkeypatch.setattr(roster, "extract_roster_batch", extract_roster_batch)
+    with schema_db_manager.transaction() as db_conn:
+        add_roster_players(db_conn, ["#LLPCV2GVP", "#8QC8RP02", "#2LPRQUV92"])
+    config = {"api_token": "token", "roster_batch_size": 1}
+
+    with pytest.raises(ChildProcessError):
+        etl_roster(schema_db_manager, config)
+
+    with schema_db_manager.transaction() as db_conn:
+        remove_roster_players(db_conn, ["#2LPRQUV92"])
+
+    etl_roster(schema_db_manager, config)
+
+    assert extracted_batches == [["#2LPRQUV92"], ["#8QC8RP02"], ["#LLPCV2GVP"]]
+
+
+def test_etl_roster_batch_skips_battles_of_players_whose_load_failed(
+        schema_db_manager, monkeypatch, mock_single_bs_battle, mock_player_data_api):
+    """Tests the battles of a player whose player data load was rolled back
+    are not loaded"""
+
+    def load_player_data(conn, player_data, snapshot_cache, storage):
+        if player_data["tag"] == "#8QC8RP02":
+            raise ValueError("Error: Invalid player data!")
+        return roster_load_player_data(conn, player_data, snapshot_cache, storage)
+
+    def get_api_player_battle_log(_api_token, player_tag):
+        battle = copy.deepcopy(mock_single_bs_battle)
+        battle["battle"]["teams"][0][0]["tag"] = player_tag
+        return {"items": [battle]}
+
+    roster_load_player_data = roster.load_player_data
+    monkeypatch.setattr(roster, "load_player_data", load_player_data)
+    monkeypatch.setattr(roster, "get_api_player_data", lambda _api_token, player_tag: {
+        **mock_player_data_api, "tag": player_tag})
+    monkeypatch.setattr(roster, "get_api_player_battle_log", get_api_player_battle_log)
+
+    result = etl_roster_batch(schema_db_manager, schema_db_manager, {"api_token": "token"},
+                              ["#LLPCV2GVP", "#8QC8RP02"], {}, SQLiteBackend({}))
+
+    assert list(result["failures"]) == ["#8QC8RP02"]
+    with schema_db_manager.reader() as db_reader:
+        assert db_reader.execute("SELECT player_tag FROM battle;").fetchall() == [
+            ("#LLPCV2GVP",)]
+
+
+def test_etl_roster_compares_players_with_snapshots_of_their_own_shard(
+        tmp_path, monkeypatch, mock_single_bs_battle, mock_player_data_api):
+    """Tests players with the same player ID on different shards are each
+    compared with their own shard's snapshot, so unchanged players are not
+    written again"""
+
+    player_trophies = {"#2POLV8PV": 100, "#8QC8RP02": 200}
+    config = {"dbpath": str(tmp_path / "brawl.db"), "db_shards": "2", "api_token": "token"}
+    create_shard_databases(config)
+    shard_router = ShardRouter(config)
+
+    monkeypatch.setattr(roster, "get_api_player_data", lambda _api_token, player_tag: {
+        **mock_player_data_api, "tag": player_tag, "trophies": player_trophies[player_tag]})
+    monkeypatch.setattr(roster, "get_api_player_battle_log",
+                        lambda _api_token, _player_tag: {"items": []})
+    with shard_router.catalogue.writer() as db_conn:
+        db_conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+    with shard_router.catalogue.transaction() as db_conn:
+        add_roster_players(db_conn, list(player_trophies))
+
+    etl_roster(shard_router.catalogue, config, shard_router)
+    etl_roster(shard_router.catalogue, config, shard_router)
+
+    for player_tag in player_trophies:
+        with shard_router.shards[get_shard_index(player_tag, 2)].reader() as db_reader:
+            assert db_reader.execute("""SELECT player_id, COUNT(*)
+                                     FROM player_trophies
+                                     GROUP BY player_id;""").fetchall() == [(1, 1)]
+
+    shard_router.close()
+
+
+if __name__ == "__main__":
+
+    pytest.main()
@@ -0,0 +1,60 @@
+"""Testing file for rotation.py"""
+
+from datetime import datetime as dt, timedelta
+
+import pytest
+
+import rotation
+from rotation import (transform_event_slots, get_refresh_delay, etl_event_rotation,
+                      get_event_rotation)
+
+NOW = dt(2025, 4, 13, 9, 30, 0)
+
+
+@pytest.fixture
+def mock_event_rotation_api():
+    """Returns mock event rotation api data"""
+
+    return [{"startTime": "20250413T080000.000Z", "endTime": "20250414T080000.000Z",
+             "slotId": 1, "event": {"id": 15000005, "mode": "brawlBall", "map": "Center Stage"}},
+            {"startTime": "20250413T060000.000Z", "endTime": "20250413T100000.000Z",
+             "slotId": 2, "event": {"id": 15000132, "mode": "gemGrab", "map": "Hard Rock Mine"}}]
+
+
+def test_get_refresh_delay_is_the_earliest_upcoming_slot_end(mock_event_rotation_api):
+    """Tests the rotation is refreshed just after the next slot ends, retried
+    soon when every slot has ended and refreshed at most max refresh apart"""
+
+    event_slot_df = transform_event_slots(mock_event_rotation_api)
+    config = {"rotation_refresh_delay_secs": "5", "rotation_retry_secs": "30"}
+
+    assert get_refresh_delay(event_slot_df, NOW, config) == timedelta(minutes=30, seconds=5)
+    assert get_refresh_delay(event_slot_df, dt(2025, 4, 14, 9, 0), config) == timedelta(
+        seconds=30)
+    assert get_refresh_delay(event_slot_df, NOW, {**config, "rotation_max_refresh_mins": "10"}
+                             ) == timedelta(minutes=10)
+
+
+def test_etl_event_rotation_loads_the_slot_timeline(schema_db_manager, monkeypatch,
+                                                    mock_event_rotation_api):
+    """Tests each slot is stored once with its event and the rotation at a
+    time is read back with its modes and maps"""
+
+    monkeypatch.setattr(rotation, "extract_event_data_api", lambda _config: [
+        {**event, "event": dict(event["event"])} for event in mock_event_rotation_api])
+    monkeypatch.setattr(rotation, "get_utc_now", lambda: NOW)
+
+    etl_event_rotation(schema_db_manager, {})
+    refresh_delay = etl_event_rotation(schema_db_manager, {})
+
+    assert refresh_delay == timedelta(minutes=30, seconds=5)
+    with schema_db_manager.reader() as db_reader:
+        assert db_reader.execute("SELECT COUNT(*) FROM event_slot;").fetchone()[0] == 2
+        assert get_event_rotation(db_reader, NOW)["map"].tolist() == ["Center Stage",
+                                                                      "Hard Rock Mine"]
+        assert get_event_rotation(db_reader, dt(2025, 4, 13, 12, 0))["slot_id"].tolist() == [1]
+
+
+if __name__ == "__main__":
+
+    pytest.main()
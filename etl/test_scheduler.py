@@ -0,0 +1,116 @@
+"""Testing file for scheduler.py"""
+
+import random
+from datetime import datetime as dt, timedelta
+
+import pytest
+
+from main import get_process_id, update_process_log
+from polling import get_utc_now
+from scheduler import EtlScheduler, get_jittered_interval
+
+
+def test_get_jittered_interval_stays_within_jitter():
+    """Tests the jittered interval is within the jitter fraction of the interval"""
+
+    rng = random.Random(41)
+    intervals = [get_jittered_interval(timedelta(minutes=60), 0.1, rng) for _ in range(100)]
+
+    assert all(timedelta(minutes=54) <= interval <= timedelta(minutes=66)
+               for interval in intervals)
+    assert len(set(intervals)) > 1
+
+
+def test_load_next_runs_schedules_after_last_run(schema_db_manager):
+    """Tests an ETL is due one interval after its last run and ETLs
+    that have never run are due now"""
+
+    with schema_db_manager.writer() as db_conn:
+        db_conn.execute("""INSERT INTO process_log (process_id, process_status, last_updated)
+                        VALUES (1, 'Start', '2025-04-13 09:00:00');""")
+        db_conn.commit()
+
+    scheduler = EtlScheduler({"brawler_etl_interval_mins": "30"}, schema_db_manager)
+    now = dt(2025, 4, 13, 9, 10)
+    scheduler.load_next_runs(now)
+
+    assert scheduler.next_runs["Brawler ETL"] == dt(2025, 4, 13, 9, 30)
+    assert scheduler.next_runs["Player ETL"] == now
+    assert scheduler.seconds_until_next_run(now) == 0
+
+
+def test_scheduled_brawler_etl_leaves_events_to_the_event_rotation_etl(schema_db_manager,
+                                                                       monkeypatch):
+    """Tests the scheduled brawler ETL does not extract events, the event
+    rotation ETL loads them at every rotation"""
+
+    monkeypatch.setattr("main.extract_brawler_data_api", lambda _config: [])
+    monkeypatch.setattr("main.extract_event_data_api", lambda _config: pytest.fail(
+        "Events were extracted by the brawler ETL!"))
+    brawler_etl_runs = []
+    monkeypatch.setattr("main.load_brawler_etl_data", lambda _conn, brawler_etl_data, _storage:
+                        brawler_etl_runs.append(brawler_etl_data))
+
+    EtlScheduler({}, schema_db_manager).run_functions["Brawler ETL"]()
+
+    assert brawler_etl_runs[0]["event_data"] is None
+
+
+def test_run_pending_runs_due_etls_and_continues_after_a_failure(schema_db_manager):
+    """Tests due ETLs are run, a failed ETL does not stop the others
+    and every ETL run is scheduled again"""
+
+    scheduler = EtlScheduler({"schedule_jitter": "0"}, schema_db_manager)
+    runs = []
+
+    def fail():
+        runs.append("Player ETL")
+        raise ChildProcessError("Error within Player ETL process!")
+
+    scheduler.run_functions = {"Brawler ETL": lambda: runs.append("Brawler ETL"),
+                               "Player ETL": fail,
+                               "Battle Log ETL": lambda: runs.append("Battle Log ETL")}
+    now = dt(2025, 4, 13, 9, 0)
+    scheduler.next_runs = {"Brawler ETL": now - timedelta(minutes=5), "Player ETL": now,
+                           "Battle Log ETL": now + timedelta(minutes=5)}
+
+    assert scheduler.run_pending(now) == ["Brawler ETL", "Player ETL"]
+    assert runs == ["Brawler ETL", "Player ETL"]
+    assert scheduler.run_stats == {"runs": 2, "failures": 1}
+    assert scheduler.next_runs["Player ETL"] == now + timedelta(minutes=60)
+
+
+def test_self_scheduled_etl_runs_when_its_run_says(schema_db_manager):
+    """Tests the event rotation ETL is due on start and its next run is
+    the time its run returns, without jitter"""
+
+    scheduler = EtlScheduler({"schedule_jitter": "0.5"}, schema_db_manager)
+    now = dt(2025, 4, 13, 9, 0)
+    scheduler.load_next_runs(now)
+    scheduler.run_functions = {"Event Rotation ETL": lambda: timedelta(minutes=30, seconds=5)}
+    scheduler.next_runs = {"Event Rotation ETL": scheduler.next_runs["Event Rotation ETL"]}
+
+    assert scheduler.run_pending(now) == ["Event Rotation ETL"]
+    assert (scheduler.next_runs["Event Rotation ETL"] - get_utc_now()
+            <= timedelta(minutes=30, seconds=5))
+    assert (scheduler.next_runs["Event Rotation ETL"] - get_utc_now()
+            > timedelta(minutes=30))
+
+
+def test_load_next_runs_compares_process_log_times_in_utc(schema_db_manager):
+    """Tests an ETL that just started (process_log times are UTC) is next due
+    a full interval from now"""
+
+    with schema_db_manager.writer() as db_conn:
+        update_process_log(db_conn, get_process_id(db_conn, "Brawler ETL"), "Start")
+
+    scheduler = EtlScheduler({"schedule_jitter": "0"}, schema_db_manager)
+    scheduler.load_next_runs()
+    scheduler.next_runs = {"Brawler ETL": scheduler.next_runs["Brawler ETL"]}
+
+    assert 3590 <= scheduler.seconds_until_next_run() <= 3600
+
+
+if __name__ == "__main__":
+
+    pytest.main()
@@ -0,0 +1,89 @@
+"""Testing file for shard.py"""
+
+import pytest
+
+from main import etl_player_sharded
+from shard import (SCHEMA_PATH, get_shard_index, get_shard_path, ShardRouter,
+                   create_shard_databases)
+
+
+def test_get_shard_index_is_within_shard_count():
+    """Tests shard index is between 0 and the shard count"""
+
+    for player_tag in ("#2POLV8PV", "#8QC8RP02", "#LLPCV2GVP", "#Y98JQCQJ8"):
+        assert 0 <= get_shard_index(player_tag, 4) < 4
+
+
+def test_get_shard_index_ignores_tag_format():
+    """Tests the same player tag is routed to the same shard however it is written"""
+
+    assert get_shard_index("#2polv8pv", 8) == get_shard_index(" 2POLV8PV", 8)
+
+
+def test_get_shard_index_zero_shards_raises_value_error():
+    """Tests value error is raised if there are no shards"""
+
+    with pytest.raises(ValueError):
+        get_shard_index("#2POLV8PV", 0)
+
+
+def test_get_shard_path_numbers_shard_files():
+    """Tests shard files are created next to the main database"""
+
+    assert get_shard_path("/data/brawl.db", 2) == "/data/brawl.shard2.db"
+
+
+def test_shard_router_fan_out_combines_shards(tmp_path):
+    """Tests fan_out returns rows from every shard"""
+
+    config = {"dbpath": str(tmp_path / "brawl.db"), "db_shards": "2"}
+    create_shard_databases(config)
+    router = ShardRouter(config)
+
+    for player_tag in ("#2POLV8PV", "#8QC8RP02", "#LLPCV2GVP", "#Y98JQCQJ8"):
+        with router.shard_for(player_tag).transaction() as db_conn:
+            db_conn.execute("""INSERT INTO player (player_tag, player_name)
+                            VALUES (?, ?);""", [player_tag, "mock_name"])
+
+    result = router.fan_out("SELECT COUNT(*) AS players FROM player;")
+    router.close()
+
+    assert result["players"].sum() == 4
+    assert sorted(result["shard"].tolist()) == [0, 1]
+
+
+def test_shard_router_group_player_tags_matches_shard_for(tmp_path):
+    """Tests grouped player tags are grouped by the shard they route to"""
+
+    router = ShardRouter({"dbpath": str(tmp_path / "brawl.db")}, shard_count=3)
+    player_tags = ["#2POLV8PV", "#8QC8RP02", "#LLPCV2GVP", "#Y98JQCQJ8"]
+
+    for shard_index, shard_tags in router.group_player_tags(player_tags).items():
+        for player_tag in shard_tags:
+            assert router.shard_for(player_tag) is router.shards[shard_index]
+
+    router.close()
+
+
+def test_etl_player_sharded_without_player_tags_ends(tmp_path):
+    """Tests a sharded player ETL with no players to load ends rather than fails"""
+
+    config = {"dbpath": str(tmp_path / "brawl.db"), "db_shards": "2", "api_token": "token"}
+    create_shard_databases(config)
+    router = ShardRouter(config)
+    with router.catalogue.writer() as db_conn:
+        db_conn.executescript(SCHEMA_PATH.read_text(encoding="utf-8"))
+
+    etl_player_sharded(router, config, [])
+
+    with router.catalogue.reader() as db_reader:
+        assert db_reader.execute("""SELECT process_status
+                                 FROM process_log
+                                 ORDER BY process_log_id;""").fetchall() == [("Start",),
+                                                                              ("End",)]
+    router.close()
+
+
+if __name__ == "__main__":
+
+    pytest.main()
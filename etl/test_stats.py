@@ -0,0 +1,124 @@
+"""Testing file for stats.py"""
+
+import pytest
+from pandas import DataFrame, Series, concat
+
+from load import insert_battle_log_db
+from stats import (get_trophy_bracket, get_new_battles, aggregate_battle_stats,
+                   update_brawler_stats, get_brawler_stats, add_brawler_rates,
+                   get_wilson_interval, UNKNOWN_TROPHY_BRACKET)
+from transform import BATTLE_LOG_COLUMNS
+
+
+def get_mock_battle_log_df(battles: list[tuple]) -> DataFrame:
+    """Returns a battle log dataframe from (battle time, brawler id, result, trophies) tuples"""
+
+    return DataFrame([["#LLPCV2GVP", battle_time, 15000132, "Brawl Ball", "Center Stage",
+                       "Ranked", result, 120, 8 if result == "Victory" else -8, brawler_id,
+                       False, trophies, [brawler_id], [16000001]]
+                      for battle_time, brawler_id, result, trophies in battles],
+                     columns=BATTLE_LOG_COLUMNS)
+
+
+def test_get_trophy_bracket_returns_bracket_lower_bound():
+    """Tests trophies are placed in the bracket they fall into"""
+
+    result = get_trophy_bracket(Series([0, 99, 100, 760, 5000, None]))
+
+    assert result.tolist() == [0, 0, 100, 750, 1500, UNKNOWN_TROPHY_BRACKET]
+
+
+def test_aggregate_battle_stats_counts_per_brawler_and_day():
+    """Tests battles are counted per brawler, trophy bracket and day"""
+
+    battle_log_df = get_mock_battle_log_df([("2025-04-13 09:00:00", 1, "Victory", 520),
+                                            ("2025-04-13 10:00:00", 1, "Defeat", 530),
+                                            ("2025-04-13 11:00:00", 1, "Draw", 540),
+                                            ("2025-04-14 09:00:00", 1, "Victory", 550)])
+
+    result = aggregate_battle_stats(battle_log_df)
+
+    assert result[["day", "games", "wins", "losses", "trophy_change_sum"]].values.tolist() == [
+        ["2025-04-13", 3, 1, 1, -8], ["2025-04-14", 1, 1, 0, 8]]
+    assert set(result["trophy_bracket"]) == {500}
+
+
+def test_update_brawler_stats_only_counts_new_battles(schema_db_conn):
+    """Tests battles already stored are not counted again"""
+
+    first_log = get_mock_battle_log_df([("2025-04-13 09:00:00", 1, "Victory", 520)])
+    second_log = get_mock_battle_log_df([("2025-04-13 09:00:00", 1, "Victory", 520),
+                                         ("2025-04-13 10:00:00", 1, "Defeat", 530)])
+
+    for battle_log_df in (first_log, second_log):
+        new_battle_log_df = get_new_battles(schema_db_conn, battle_log_df)
+        insert_battle_log_db(schema_db_conn, new_battle_log_df)
+        update_brawler_stats(schema_db_conn, new_battle_log_df)
+
+    result = get_brawler_stats(schema_db_conn, mode="Brawl Ball")
+
+    assert result[["brawler_id", "games", "wins", "losses"]].values.tolist() == [[1, 2, 1, 1]]
+
+
+def test_get_new_battles_reads_each_players_stored_battles_in_one_query(schema_db_conn):
+    """Tests stored battles are found with one query per player, not per battle"""
+
+    stored_log = get_mock_battle_log_df([("2025-04-13 09:00:00", 1, "Victory", 520)])
+    insert_battle_log_db(schema_db_conn, stored_log)
+    battle_log_df = get_mock_battle_log_df([("2025-04-13 09:00:00", 1, "Victory", 520),
+                                            ("2025-04-13 10:00:00", 1, "Defeat", 530),
+                                            ("2025-04-13 11:00:00", 1, "Defeat", 540)])
+    battle_log_df = concat([battle_log_df, stored_log.assign(player_tag="#8QC8RP02")],
+                           ignore_index=True)
+    queries = []
+    schema_db_conn.set_trace_callback(queries.append)
+
+    result = get_new_battles(schema_db_conn, battle_log_df)
+    schema_db_conn.set_trace_callback(None)
+
+    assert result[["player_tag", "battle_time"]].values.tolist() == [
+        ["#LLPCV2GVP", "2025-04-13 10:00:00"], ["#LLPCV2GVP", "2025-04-13 11:00:00"],
+        ["#8QC8RP02", "2025-04-13 09:00:00"]]
+    assert sum(query.lstrip().startswith("SELECT") for query in queries) == 2
+
+
+def test_get_brawler_stats_filters_by_day(schema_db_conn):
+    """Tests since and until only include counters between the days given"""
+
+    update_brawler_stats(schema_db_conn,
+                         get_mock_battle_log_df([("2025-04-13 09:00:00", 1, "Victory", 0),
+                                                 ("2025-04-14 09:00:00", 1, "Victory", 0),
+                                                 ("2025-04-15 09:00:00", 2, "Victory", 0)]))
+
+    result = get_brawler_stats(schema_db_conn, since="2025-04-14", until="2025-04-14")
+
+    assert result[["brawler_id", "games"]].values.tolist() == [[1, 1]]
+
+
+def test_get_wilson_interval_contains_rate():
+    """Tests the interval contains the observed rate and is undefined without trials"""
+
+    lower, upper = get_wilson_interval(Series([7, 0]), Series([10, 0]))
+
+    assert lower[0] < 0.7 < upper[0]
+    assert lower.isna()[1]
+
+
+def test_add_brawler_rates_sums_shard_counters():
+    """Tests counters for the same brawler (e.g. from two shards) are summed
+    before rates are calculated"""
+
+    stats_df = DataFrame({"brawler_id": [1, 1, 2], "games": [4, 6, 10], "wins": [2, 3, 2],
+                          "losses": [2, 3, 8], "star_players": [1, 1, 0],
+                          "trophy_change_sum": [0, 10, -20]})
+
+    result = add_brawler_rates(stats_df).set_index("brawler_id")
+
+    assert result.loc[1, "pick_rate"] == 0.5
+    assert result.loc[1, "win_rate"] == 0.5
+    assert result.loc[2, "average_trophy_change"] == -2
+
+
+if __name__ == "__main__":
+
+    pytest.main()
@@ -1,12 +1,15 @@
 """Testing file for transform.py"""
 
+from unittest.mock import MagicMock
+
 import pytest
 
 from pandas import DataFrame
 
 from transform import (to_snake_case, brawler_name_value_to_title, to_title,
                        valid_trophy_change, transform_brawl_data_api, battle_to_df,
-                       format_datetime)
+                       format_datetime, transform_battle_log_api,
+                       get_changed_snapshot_tables)
 
 
 def test_to_snake_case_base_case_1():
@@ -305,32 +308,75 @@ def test_battle_to_df_raises_type_error_with_wrong_input():
         battle_to_df("This is not a dictionary!")
 
 
-#TODO add mock_connection fixture
 def test_battle_to_df_raises_value_error_with_empty_dictionary():
     """Tests value error is raised for battle_to_df
     if the dictionary input is empty"""
 
     with pytest.raises(ValueError):
-        battle_to_df("",{}, "#LLPCV2GVP")
+        battle_to_df({}, "#LLPCV2GVP")
+
+
+def test_battle_to_df_returns_dataframe(mock_single_bs_battle):
+    """Tests battle_to_df returns a dataframe"""
+
+    result = battle_to_df(mock_single_bs_battle, "#LLPCV2GVP")
+    assert isinstance(result, DataFrame)
+
+
+def test_battle_to_df_returns_correct_columns(mock_single_bs_battle):
+    """Tests battle_to_df returns the correct columns"""
+
+    desired_columns = ["player_tag", "battle_time", "event_id", "event_mode", "event_map",
+                       "battle_type", "result", "duration", "trophy_change",
+                       "brawler_played_id", "star_player", "brawler_trophies",
+                       "team_brawler_ids", "opponent_brawler_ids"]
+    result = battle_to_df(mock_single_bs_battle, "#LLPCV2GVP")
+    assert result.columns.tolist() == desired_columns
+
+
+def test_battle_to_df_returns_player_brawler_and_star_player(mock_single_bs_battle):
+    """Tests battle_to_df finds the brawler played and star player for the player tag"""
+
+    result = battle_to_df(mock_single_bs_battle, "LLPCV2GVP")
+
+    assert result.loc[0, "brawler_played_id"] == 16000025
+    assert result.loc[0, "brawler_trophies"] == 16
+    assert result.loc[0, "team_brawler_ids"] == [16000025, 16000087, 16000020]
+    assert result.loc[0, "opponent_brawler_ids"] == [16000034, 16000029, 16000002]
+    assert result.loc[0, "star_player"] == True
+    assert result.loc[0, "player_tag"] == "#LLPCV2GVP"
+    assert result.loc[0, "battle_time"] == "2025-04-13 09:22:06"
+
+
+def test_transform_battle_log_api_skips_stored_battles(mock_single_bs_battle):
+    """Tests transform_battle_log_api drops battles that are not newer
+    than the most recent stored battle"""
+
+    mock_db_conn = MagicMock()
+    mock_db_conn.cursor.return_value.fetchone.return_value = ["2025-04-13 09:22:06"]
+    result = transform_battle_log_api(mock_db_conn, {"items": [mock_single_bs_battle]},
+                                      "#LLPCV2GVP")
+
+    assert result.empty
+
 
+def test_get_changed_snapshot_tables_returns_all_tables_without_snapshot():
+    """Tests every snapshot table is returned if no snapshot is stored"""
 
-#TODO add mock_connection fixture
-# def test_battle_to_df_returns_dataframe(mock_single_bs_battle):
-#     """Tests battle_to_df returns a dataframe"""
+    result = get_changed_snapshot_tables({}, {"exp_level": 1, "trophies": 2,
+                                              "3vs3_victories": 3})
+    assert result == ["player_exp", "player_trophies", "player_victories"]
 
-#     result = battle_to_df(mock_single_bs_battle, "#LLPCV2GVP")
-#     assert isinstance(result, DataFrame)
 
+def test_get_changed_snapshot_tables_returns_only_changed_tables():
+    """Tests only tables with changed values are returned"""
 
-#TODO add mock_connection fixture
-# def test_battle_to_df_returns_correct_columns(mock_single_bs_battle):
-#     """Tests battle_to_df returns the correct columns"""
+    previous_snapshot = {"exp_level": 1, "exp_points": 10, "trophies": 100,
+                         "highest_trophies": 200, "3vs3_victories": 5,
+                         "solo_victories": 0, "duo_victories": 0}
+    player_data = {**previous_snapshot, "trophies": 108, "name": "mock_name"}
 
-#     desired_columns = ["player_tag", "battle_time", "event_id", "result", 
-#                        "duration", "battle_type", "trophy_change", "brawler_played_id",
-#                        "star_player"]
-#     result = battle_to_df(mock_single_bs_battle, "#LLPCV2GVP")
-#     assert result.columns.tolist().sort() == desired_columns.sort()
+    assert get_changed_snapshot_tables(previous_snapshot, player_data) == ["player_trophies"]
 
 
 if __name__ == "__main__":
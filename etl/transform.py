@@ -8,7 +8,18 @@ from pandas import DataFrame, concat
 from psycopg2.extensions import connection
 
 from extract import (get_starpower_latest_version_id, get_gadget_latest_version_id,
-                     get_brawler_latest_version_id)
+                     get_brawler_latest_version_id, get_most_recent_battle_log_time,
+                     format_player_tag, PLAYER_SNAPSHOT_KEYS)
+
+BATTLE_LOG_COLUMNS = ["player_tag", "battle_time", "event_id", "event_mode", "event_map",
+                      "battle_type", "result", "duration", "trophy_change",
+                      "brawler_played_id", "star_player", "brawler_trophies",
+                      "team_brawler_ids", "opponent_brawler_ids"]
+
+PLAYER_SNAPSHOT_TABLES = {"player_exp": ("exp_level", "exp_points"),
+                          "player_trophies": ("trophies", "highest_trophies"),
+                          "player_victories": ("3vs3_victories", "solo_victories",
+                                               "duo_victories")}
 
 
 def brawler_name_value_to_title(brawler_data: dict) -> dict:
@@ -303,26 +314,77 @@ def transform_player_data_api(player_data: dict) -> dict:
     return player_data
 
 
-def get_brawler_played_from_battle_log(battle_teams: list[list[dict]], player_tag: str) -> int:
-    """Gets the brawler played by the player for a specific battle"""
+def build_player_snapshot(player_data: dict) -> dict:
+    """Returns the snapshot values (exp, trophies and victories) of transformed player data"""
+
+    return {key: player_data.get(key) for key in PLAYER_SNAPSHOT_KEYS}
+
+
+def get_changed_snapshot_tables(previous_snapshot: dict, player_data: dict) -> list[str]:
+    """Returns the player snapshot tables whose values have changed
+    since the previous snapshot"""
+
+    return [table for table, keys in PLAYER_SNAPSHOT_TABLES.items()
+            if any(previous_snapshot.get(key) != player_data.get(key) for key in keys)]
+
+
+def get_battle_teams(battle_data: dict) -> list[list[dict]]:
+    """Returns the teams of a battle (showdown battles list players instead of teams)"""
+
+    if "teams" in battle_data:
+        return battle_data["teams"]
+
+    return [battle_data.get("players", [])]
+
+
+def get_battle_player(battle_teams: list[list[dict]], player_tag: str) -> dict:
+    """Gets the battle log entry (tag, name and brawler) of the player"""
 
     all_teams = []
     for team in battle_teams:
         all_teams.extend(team)
 
     for player_data in all_teams:
-        if player_data["tag"] == f"{player_tag}":
-            return player_data["brawler"]["id"]
+        if format_player_tag(player_data["tag"]) == format_player_tag(player_tag):
+            return player_data
 
     raise ValueError("Error: Player tag not found in battle log!")
 
 
+def get_battle_brawler_ids(battle_teams: list[list[dict]],
+                           player_tag: str) -> tuple[list[int], list[int]]:
+    """Returns the brawler ids of the player's team and of the opposing teams
+    (in showdown, where players are not in teams, the player is their own team)"""
+
+    if len(battle_teams) == 1:
+        battle_teams = [[player_data] for player_data in battle_teams[0]]
+
+    team_brawler_ids, opponent_brawler_ids = [], []
+
+    for team in battle_teams:
+        brawler_ids = [player_data["brawler"]["id"] for player_data in team]
+
+        if any(format_player_tag(player_data["tag"]) == format_player_tag(player_tag)
+               for player_data in team):
+            team_brawler_ids.extend(brawler_ids)
+        else:
+            opponent_brawler_ids.extend(brawler_ids)
+
+    return team_brawler_ids, opponent_brawler_ids
+
+
+def get_brawler_played_from_battle_log(battle_teams: list[list[dict]], player_tag: str) -> int:
+    """Gets the brawler played by the player for a specific battle"""
+
+    return get_battle_player(battle_teams, player_tag)["brawler"]["id"]
+
+
 def is_star_player(star_player_data: dict, player_tag: str) -> bool:
     """Returns true if star player and false if not"""
 
     if star_player_data is None:
         return None
-    if star_player_data["tag"] == f"#{player_tag}":
+    if format_player_tag(star_player_data["tag"]) == format_player_tag(player_tag):
         return True
     return False
 
@@ -346,35 +408,39 @@ def valid_trophy_change(battle_log_entry: dict) -> bool:
     return True
 
 
-def normalise_battle(db_connection: connection, battle: dict, player_tag: str) -> dict:
+def normalise_battle(battle: dict, player_tag: str) -> dict:
     """Normalises a single battle log entry to load into a dataframe"""
 
-    battle["player_tag"] = player_tag
+    battle_data = battle["battle"]
+
+    battle["player_tag"] = f"#{format_player_tag(player_tag)}"
     battle["battle_time"] = format_datetime(battle["battleTime"])
     del battle["battleTime"]
 
     battle["event_id"] = battle["event"]["id"]
-    #Insert missing event ids
-    if battle["event_id"] not in get_distinct_event_ids(db_connection):
-        print(battle["event"])
-        # insert_new_event_data(db_connection, battle["event"])
-
+    battle["event_mode"] = to_title(battle["event"]["mode"]) if battle["event"].get("mode") else None
+    battle["event_map"] = battle["event"].get("map")
     del battle["event"]
 
-    battle["battle_type"] = to_title(battle["battle"]["type"])
-    battle["result"] = to_title(battle["battle"]["result"])
-    battle["duration"] = battle["battle"]["duration"]
+    battle["battle_type"] = to_title(battle_data["type"]) if battle_data.get("type") else None
+    battle["result"] = to_title(battle_data["result"]) if battle_data.get("result") else None
+    battle["duration"] = battle_data.get("duration")
     if valid_trophy_change(battle):
-        battle["trophy_change"] = battle["battle"]["trophyChange"]
+        battle["trophy_change"] = battle_data["trophyChange"]
     else:
         battle["trophy_change"] = None
-    battle["brawler_played_id"] = get_brawler_played_from_battle_log(battle["battle"]["teams"], player_tag)
-    battle["star_player"] = is_star_player(battle["battle"]["starPlayer"], player_tag)
+    battle_teams = get_battle_teams(battle_data)
+    battle_player = get_battle_player(battle_teams, player_tag)
+    battle["brawler_played_id"] = battle_player["brawler"]["id"]
+    battle["brawler_trophies"] = battle_player["brawler"].get("trophies")
+    battle["team_brawler_ids"], battle["opponent_brawler_ids"] = get_battle_brawler_ids(
+        battle_teams, player_tag)
+    battle["star_player"] = is_star_player(battle_data.get("starPlayer"), player_tag)
     del battle["battle"]
     return battle
 
 
-def battle_to_df(db_connection: connection, battle: dict, player_tag) -> DataFrame:
+def battle_to_df(battle: dict, player_tag: str) -> DataFrame:
     """Transforms single battle to a dataframe"""
 
     if not isinstance(battle, dict):
@@ -382,41 +448,45 @@ def battle_to_df(db_connection: connection, battle: dict, player_tag) -> DataFra
     if not battle:
         raise ValueError("Error: Battle entry is empty!")
 
-    battle = normalise_battle(db_connection, battle, player_tag)
-    battle_df = pd.DataFrame(battle, index=[0])
-    return battle_df
+    battle = normalise_battle(battle, player_tag)
+    battle_df = pd.DataFrame([battle])
+    return battle_df[BATTLE_LOG_COLUMNS]
 
 
 def transform_battle_log_api(db_connection: connection,
-                             battle_log_data: list[dict],
+                             battle_log_data: dict,
                              player_tag: str) -> pd.DataFrame:
-    """Transforms player battle log and returns desired values"""
+    """Transforms player battle log and returns battles newer
+    than the most recent battle stored for the player"""
 
-    battle_log_df = pd.DataFrame(columns=["player_tag", "battle_time", "event_id", "result",
-                                       "duration", "battle_type", "trophy_change", "star_player",
-                                       "brawler_played_id"])
-
-    most_recent_battle_log_time = get_most_recent_battle_log_time(db_connection,
-                                                                  player_tag)
-    if most_recent_battle_log_time:
-        battle_log_data = [battle for battle in battle_log_data
-                           if battle["battleTime"] > most_recent_battle_log_time]
+    most_recent_battle_log_time = get_most_recent_battle_log_time(
+        db_connection, f"#{format_player_tag(player_tag)}")
 
+    battles = []
     for battle in battle_log_data["items"]:
         #Ignore map maker events
         if battle["event"]["id"] == 0:
             continue
 
-        battle_df = battle_to_df(db_connection, battle, player_tag)
-        battle_log_df = pd.concat([battle_log_df, battle_df], ignore_index=True)
+        if (most_recent_battle_log_time
+                and format_datetime(battle["battleTime"]) <= most_recent_battle_log_time):
+            continue
+
+        battles.append(normalise_battle(battle, player_tag))
+
+    return pd.DataFrame(battles, columns=BATTLE_LOG_COLUMNS)
+
+
+def transform_battle_log_events(battle_log_df: DataFrame) -> DataFrame:
+    """Returns the distinct events played in a battle log,
+    in the same format as transform_event_data_api"""
 
-    #Insert missing battle types
-    battle_types = battle_log_df["battle_type"].unique()
-    for battle_type in battle_types:
-        if battle_type not in get_distinct_battle_types(db_connection):
-            insert_new_battle_type_data(db_connection, battle_type)
+    event_data_df = battle_log_df[["event_id", "event_mode", "event_map"]].dropna()
+    event_data_df = event_data_df.rename(columns={"event_mode": "mode", "event_map": "map"})
+    event_data_df = event_data_df.drop_duplicates(subset="event_id").reset_index(drop=True)
+    event_data_df["event_version"] = None
 
-    return battle_log_df
+    return event_data_df[["event_id", "event_version", "mode", "map"]]
 
 
 if __name__ =="__main__":